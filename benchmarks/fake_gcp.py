@@ -0,0 +1,205 @@
+"""
+In-process stand-ins for the Google Cloud IAM and Service Usage clients.
+
+The fakes serve a synthetic, seeded catalogue of predefined roles and services using the
+real protobuf types, so the sync code paths run unchanged. Every call can be slowed down
+by a fixed latency and fail with a quota error at a configurable rate. Inject them with
+`gcp_iam_roles.auth.use_clients`.
+"""
+
+import hashlib
+import random
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+
+from google.api_core.exceptions import NotFound, TooManyRequests
+from google.cloud import iam_admin_v1, service_usage_v1
+
+RESOURCES = ("instances", "disks", "buckets", "objects", "keys", "jobs", "models", "tables")
+VERBS = ("get", "list", "create", "delete", "update", "use", "getIamPolicy", "setIamPolicy")
+# ListRoles and ListServices cap the page size server-side
+MAX_ROLES_PAGE = 1000
+MAX_SERVICES_PAGE = 200
+# The first roles stand in for basic roles like roles/owner that grant (nearly) everything
+BASIC_ROLES = 3
+
+
+@dataclass
+class Catalogue:
+    """Synthetic predefined roles and services, shaped like the public GCP catalogue."""
+
+    roles: int = 2000
+    services: int = 300
+    seed: int = 1
+    role_list: list[iam_admin_v1.Role] = field(init=False, repr=False)
+    service_list: list[service_usage_v1.Service] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        rnd = random.Random(self.seed)
+        names = [f"service{index}" for index in range(self.services)]
+        permissions = {
+            name: [f"{name}.{resource}.{verb}" for resource in RESOURCES for verb in VERBS]
+            for name in names
+        }
+        everything = [permission for group in permissions.values() for permission in group]
+        self.role_list = []
+        for index in range(self.roles):
+            service = names[index % len(names)]
+            if index < BASIC_ROLES:
+                granted = rnd.sample(
+                    everything, len(everything) * (BASIC_ROLES - index) // BASIC_ROLES
+                )
+            else:
+                own = rnd.sample(permissions[service], rnd.randint(1, 40))
+                granted = own + rnd.sample(everything, rnd.randint(0, 8))
+            self.role_list.append(self._role(f"roles/{service}.role{index}", index, granted))
+        self.service_list = [
+            service_usage_v1.Service(
+                config={"name": f"{name}.googleapis.com", "title": f"Service {name}"}
+            )
+            for name in names
+        ]
+        self._by_name = {role.name: role for role in self.role_list}
+
+    @staticmethod
+    def _role(name: str, index: int, permissions: list[str]) -> iam_admin_v1.Role:
+        permissions = sorted(set(permissions))
+        return iam_admin_v1.Role(
+            name=name,
+            title=f"Role {index}",
+            description=f"Synthetic role {index}",
+            stage=iam_admin_v1.Role.RoleLaunchStage.GA,
+            included_permissions=permissions,
+            etag=hashlib.md5("\n".join(permissions).encode()).digest(),
+        )
+
+    def role(self, name: str) -> iam_admin_v1.Role:
+        if name not in self._by_name:
+            raise NotFound(f"Role {name} not found")
+        return self._by_name[name]
+
+    def mutate(self, fraction: float) -> int:
+        """Changes the permissions, and so the etag, of a fraction of the roles."""
+        rnd = random.Random(self.seed + 1)
+        changed = rnd.sample(range(len(self.role_list)), int(len(self.role_list) * fraction))
+        for index in changed:
+            role = self.role_list[index]
+            permissions = [*list(role.included_permissions)[1:], f"extra.changed.role{index}"]
+            self.role_list[index] = self._role(role.name, index, permissions)
+            self._by_name[role.name] = self.role_list[index]
+        return len(changed)
+
+
+class FakeAPI:
+    """Shared call accounting, latency and quota error injection for the fake clients."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        error_methods: tuple[str, ...] | None = None,
+        seed: int = 1,
+    ) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        # None injects errors into every method
+        self.error_methods = error_methods
+        self.calls: Counter[str] = Counter()
+        self.errors: Counter[str] = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def call(self, method: str) -> None:
+        with self._lock:
+            self.calls[method] += 1
+            eligible = self.error_methods is None or method in self.error_methods
+            failed = eligible and self._random.random() < self.error_rate
+            if failed:
+                self.errors[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            raise TooManyRequests(f"Quota exceeded for {method}")
+
+
+class _Pager:
+    """Minimal page iterator with the interface of the google-api-core pagers."""
+
+    def __init__(self, fetch: Callable[[str], object], page_token: str, items: str) -> None:
+        self._fetch = fetch
+        self._items = items
+        self._response = fetch(page_token)
+
+    @property
+    def pages(self) -> Iterator[object]:
+        response = self._response
+        yield response
+        while response.next_page_token:
+            response = self._fetch(response.next_page_token)
+            yield response
+
+    def __iter__(self) -> Iterator[object]:
+        for page in self.pages:
+            yield from getattr(page, self._items)
+
+    def __getattr__(self, name: str) -> object:
+        return getattr(self._response, name)
+
+
+class FakeIAMClient:
+    """Serves `list_roles` and `get_role` from a Catalogue."""
+
+    def __init__(self, catalogue: Catalogue, api: FakeAPI) -> None:
+        self.catalogue = catalogue
+        self.api = api
+
+    def list_roles(self, request: iam_admin_v1.ListRolesRequest) -> _Pager:
+        page_size = min(request.page_size or 300, MAX_ROLES_PAGE)
+        full = request.view == iam_admin_v1.RoleView.FULL
+
+        def fetch(page_token: str) -> iam_admin_v1.ListRolesResponse:
+            self.api.call("list_roles")
+            start = int(page_token or 0)
+            roles = []
+            for role in self.catalogue.role_list[start : start + page_size]:
+                copy = iam_admin_v1.Role(role)
+                if not full:
+                    copy.included_permissions = []
+                roles.append(copy)
+            end = start + page_size
+            more = end < len(self.catalogue.role_list)
+            return iam_admin_v1.ListRolesResponse(
+                roles=roles, next_page_token=str(end) if more else ""
+            )
+
+        return _Pager(fetch, request.page_token, "roles")
+
+    def get_role(self, request: iam_admin_v1.GetRoleRequest) -> iam_admin_v1.Role:
+        self.api.call("get_role")
+        return self.catalogue.role(request.name)
+
+
+class FakeServiceUsageClient:
+    """Serves `list_services` from a Catalogue."""
+
+    def __init__(self, catalogue: Catalogue, api: FakeAPI) -> None:
+        self.catalogue = catalogue
+        self.api = api
+
+    def list_services(self, request: service_usage_v1.ListServicesRequest) -> _Pager:
+        page_size = min(request.page_size or 50, MAX_SERVICES_PAGE)
+
+        def fetch(page_token: str) -> service_usage_v1.ListServicesResponse:
+            self.api.call("list_services")
+            start = int(page_token or 0)
+            end = start + page_size
+            more = end < len(self.catalogue.service_list)
+            return service_usage_v1.ListServicesResponse(
+                services=self.catalogue.service_list[start:end],
+                next_page_token=str(end) if more else "",
+            )
+
+        return _Pager(fetch, request.page_token, "services")
@@ -0,0 +1,244 @@
+"""
+Query path benchmark over synthetic databases at several scales.
+
+Times role and permission search, permission listing, role diffs and the status page in
+the table format, splitting off the time rich spends rendering, and in the TSV stream
+format. Each scale runs in its own process on a database built by `synthetic_db.py`,
+cached under `benchmarks/tmp/`:
+
+    python benchmarks/query_benchmark.py --scales 1 10 --save benchmarks/baselines/query.json
+    python benchmarks/query_benchmark.py --scales 1 10 --compare benchmarks/baselines/query.json
+
+`--compare` exits with status 1 when a case got slower than the baseline by more than
+`--threshold`, so it can gate a release.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+import tomllib
+from collections.abc import Callable
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+from synthetic_db import BENCHMARKS, DB_NAME, generate, load_metadata
+
+DATA_DIR = BENCHMARKS.joinpath("tmp")
+# Differences below this are timer noise, not regressions
+NOISE_MS = 1.0
+
+
+class RenderTimer:
+    """Accumulates the time spent inside rich's Console.print."""
+
+    seconds = 0.0
+
+    @classmethod
+    def install(cls) -> None:
+        import rich.console
+
+        original = rich.console.Console.print
+
+        def timed(self: rich.console.Console, *args: object, **kwargs: object) -> None:
+            started = time.perf_counter()
+            try:
+                original(self, *args, **kwargs)
+            finally:
+                cls.seconds += time.perf_counter() - started
+
+        rich.console.Console.print = timed
+
+
+def _pick_roles(db_file: Path) -> dict[str, str]:
+    """Picks a typical role, the next typical one and the largest role of the dataset."""
+    conn = sqlite3.connect(db_file)
+    try:
+        sizes = conn.execute(
+            """
+            SELECT r.role, COUNT(*) AS size
+            FROM roles r JOIN role_permissions rp ON rp.role_id = r.id
+            WHERE r.deleted IS NULL
+            GROUP BY r.id
+            ORDER BY size, r.role
+            """
+        ).fetchall()
+    finally:
+        conn.close()
+    middle = len(sizes) // 2
+    return {"typical": sizes[middle][0], "other": sizes[middle + 1][0], "largest": sizes[-1][0]}
+
+
+def _cases(roles: dict[str, str]) -> list[tuple[str, Callable[..., None], tuple, bool]]:
+    """Returns (name, function, arguments, takes an output format) for every query path."""
+    from gcp_iam_roles.db import status_db
+    from gcp_iam_roles.permissions import list_permissions, search_permissions
+    from gcp_iam_roles.roles import diff_roles, search_roles
+
+    return [
+        ("search_roles", search_roles, ("role1",), True),
+        ("search_roles_short", search_roles, ("e1",), True),
+        ("search_permissions", search_permissions, ("instances.get",), True),
+        ("search_permissions_all", search_permissions, ("instances.get", 0), True),
+        ("list_permissions", list_permissions, (roles["typical"],), True),
+        ("list_permissions_largest", list_permissions, (roles["largest"],), True),
+        ("diff_roles", diff_roles, (roles["typical"], roles["other"]), True),
+        ("diff_roles_largest", diff_roles, (roles["largest"], roles["typical"]), True),
+        ("status_db", status_db, (), False),
+    ]
+
+
+def run_scale(args: argparse.Namespace) -> list[dict[str, object]]:
+    """Times every case on one scale; must run before gcp_iam_roles is imported."""
+    directory = DATA_DIR.joinpath(f"scale-{args.child:g}-seed-{args.seed}")
+    dataset = load_metadata(directory)
+    if dataset is None or args.regenerate:
+        dataset = generate(directory, args.child, args.seed)
+    else:
+        os.environ["GCP_IAM_ROLES_DB"] = str(directory.joinpath(DB_NAME))
+        sys.path.insert(0, str(BENCHMARKS.parent.joinpath("src")))
+
+    from gcp_iam_roles.output import OutputFormat
+
+    RenderTimer.install()
+    rows = []
+    for name, function, arguments, formatted in _cases(_pick_roles(directory / DB_NAME)):
+        for output_format in (OutputFormat.table, OutputFormat.tsv) if formatted else (None,):
+            extra = {"output_format": output_format} if output_format else {}
+            totals, renders = [], []
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                for run in range(args.runs + 1):
+                    RenderTimer.seconds = 0.0
+                    started = time.perf_counter()
+                    function(*arguments, **extra)
+                    # The first run warms the page cache and imports; it is not counted
+                    if run:
+                        totals.append(time.perf_counter() - started)
+                        renders.append(RenderTimer.seconds)
+            total = statistics.median(totals) * 1000
+            render = statistics.median(renders) * 1000
+            rows.append(
+                {
+                    "scale": args.child,
+                    "case": name,
+                    "format": (output_format or OutputFormat.table).value,
+                    "total_ms": round(total, 3),
+                    "render_ms": round(render, 3),
+                    "query_ms": round(total - render, 3),
+                    "dataset": dataset,
+                }
+            )
+    return rows
+
+
+def _environment() -> dict[str, str]:
+    with BENCHMARKS.parent.joinpath("pyproject.toml").open("rb") as file:
+        version = tomllib.load(file)["project"]["version"]
+    return {
+        "version": version,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": f"{platform.system()} {platform.machine()}",
+        "processor": platform.processor() or "-",
+    }
+
+
+def _compare(
+    rows: list[dict[str, object]], baseline: dict[str, object], threshold: float
+) -> list[str]:
+    """Adds each row's ratio to the baseline and returns the regressed cases."""
+    previous = {(row["scale"], row["case"], row["format"]): row for row in baseline["results"]}
+    regressions = []
+    for row in rows:
+        before = previous.get((row["scale"], row["case"], row["format"]))
+        if before is None or not before["total_ms"]:
+            continue
+        row["ratio"] = row["total_ms"] / before["total_ms"]
+        if row["ratio"] > threshold and row["total_ms"] - before["total_ms"] > NOISE_MS:
+            regressions.append(f"{row['case']} ({row['format']}, scale {row['scale']:g})")
+    return regressions
+
+
+def _print_results(rows: list[dict[str, object]], threshold: float | None) -> None:
+    """Prints the results, with the ratio to the baseline when comparing."""
+    table = Table(title="Query benchmark (median ms)")
+    for column in ("Scale", "Case", "Format", "Total", "Query", "Render"):
+        table.add_column(
+            column,
+            justify="right" if column in ("Total", "Query", "Render") else "left",
+            no_wrap=True,
+        )
+    if threshold is not None:
+        table.add_column("vs baseline", justify="right")
+    for row in rows:
+        cells = [
+            f"{row['scale']:g}",
+            row["case"],
+            row["format"],
+            f"{row['total_ms']:.2f}",
+            f"{row['query_ms']:.2f}",
+            f"{row['render_ms']:.2f}",
+        ]
+        if threshold is not None:
+            ratio = row.get("ratio")
+            color = "red" if ratio and ratio > threshold else "green"
+            cells.append(f"[{color}]{ratio:.2f}x[/{color}]" if ratio else "-")
+        table.add_row(*cells)
+    console.print(table)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--scales", nargs="+", type=float, default=[1.0, 10.0])
+    parser.add_argument("--runs", type=int, default=3, help="Timed runs per case")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--regenerate", action="store_true", help="Rebuild cached databases")
+    parser.add_argument("--save", type=Path, help="Write the results as a baseline")
+    parser.add_argument("--compare", type=Path, help="Compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Regression ratio")
+    parser.add_argument("--child", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_scale(args)))
+        return
+
+    rows = []
+    for scale in args.scales:
+        argv = [f"--runs={args.runs}", f"--seed={args.seed}", f"--child={scale}"]
+        if args.regenerate:
+            argv.append("--regenerate")
+        output = subprocess.run(
+            [sys.executable, __file__, *argv], check=True, capture_output=True, text=True
+        ).stdout
+        rows.extend(json.loads(output.splitlines()[-1]))
+
+    regressions = []
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        regressions = _compare(rows, baseline, args.threshold)
+
+    _print_results(rows, args.threshold if args.compare else None)
+
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        baseline = {"environment": _environment(), "runs": args.runs, "results": rows}
+        args.save.write_text(json.dumps(baseline, indent=2) + "\n", encoding="utf-8")
+        console.print(f"[green]Saved baseline to {args.save}[/green]")
+    if regressions:
+        console.print(f"[red]Slower than the baseline: {', '.join(regressions)}[/red]")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
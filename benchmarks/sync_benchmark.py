@@ -0,0 +1,210 @@
+"""
+Sync throughput benchmark against the in-process IAM and Service Usage stand-ins.
+
+Every sync mode runs in its own process on a scratch database, so peak RSS is per mode
+and no state leaks between runs:
+
+    python benchmarks/sync_benchmark.py --roles 2000 --latency 0.02 --error-rate 0.05
+    python benchmarks/sync_benchmark.py --modes single-pass incremental --json sync.json
+
+`incremental` is measured as a re-sync after `--changed` of the roles changed their
+permissions, starting from a database filled by a single-pass sync.
+"""
+
+import argparse
+import functools
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+BENCHMARKS = Path(__file__).resolve().parent
+SRC = BENCHMARKS.parent.joinpath("src")
+MODES = ("per-role", "single-pass", "incremental", "services")
+# The sync code retries GetRole and ListServices; ListRoles failures abort a sync
+RETRIED_METHODS = ("get_role", "list_services")
+
+
+class DBTimer:
+    """Accumulates the time spent in SQLite statements that write."""
+
+    seconds = 0.0
+    statements = 0
+
+    @classmethod
+    def record(cls, sql: str, started: float) -> None:
+        if not sql.lstrip()[:6].upper().startswith(("SELECT", "PRAGMA")):
+            cls.seconds += time.perf_counter() - started
+            cls.statements += 1
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql: str, parameters: object = (), /) -> sqlite3.Cursor:
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            DBTimer.record(sql, started)
+
+    def executemany(self, sql: str, parameters: object, /) -> sqlite3.Cursor:
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            DBTimer.record(sql, started)
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory: type[sqlite3.Cursor] = TimedCursor) -> sqlite3.Cursor:
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters: object = (), /) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, parameters: object, /) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, parameters)
+
+    def commit(self) -> None:
+        started = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            DBTimer.record("COMMIT", started)
+
+
+def run_mode(args: argparse.Namespace) -> dict[str, object]:
+    """Runs one sync mode in this process; GCP_IAM_ROLES_DB must point at a scratch file."""
+    sys.path[:0] = [str(SRC), str(BENCHMARKS)]
+    from fake_gcp import Catalogue, FakeAPI, FakeIAMClient, FakeServiceUsageClient
+
+    from gcp_iam_roles.auth import use_clients
+    from gcp_iam_roles.db import create_db
+    from gcp_iam_roles.indexes import rebuild_indexes
+    from gcp_iam_roles.permissions import sync_permissions
+    from gcp_iam_roles.roles import sync_roles, sync_roles_incremental, sync_roles_single_pass
+    from gcp_iam_roles.services import sync_services
+
+    catalogue = Catalogue(roles=args.roles, services=args.services, seed=args.seed)
+    api = FakeAPI(args.latency, args.error_rate, RETRIED_METHODS, args.seed)
+    use_clients(FakeIAMClient(catalogue, api), FakeServiceUsageClient(catalogue, api))
+    sqlite3.connect = functools.partial(sqlite3.connect, factory=TimedConnection)
+
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        create_db()
+        if args.child == "incremental":
+            sync_roles_single_pass()
+            catalogue.mutate(args.changed)
+            api.calls.clear()
+            api.errors.clear()
+            DBTimer.seconds = DBTimer.statements = 0
+
+        started = time.perf_counter()
+        match args.child:
+            case "per-role":
+                sync_roles()
+                sync_permissions(concurrency=args.concurrency, rate=args.rate)
+            case "single-pass":
+                sync_roles_single_pass()
+            case "incremental":
+                sync_roles_incremental(concurrency=args.concurrency, rate=args.rate)
+            case "services":
+                sync_services(restart=True)
+        sync_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        if args.child != "services":
+            rebuild_indexes()
+        index_seconds = time.perf_counter() - started
+
+    conn = sqlite3.connect(os.environ["GCP_IAM_ROLES_DB"])
+    table = "services" if args.child == "services" else "roles"
+    items = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    conn.close()
+
+    return {
+        "mode": args.child,
+        "items": items,
+        "items_per_s": round(items / sync_seconds, 1) if sync_seconds else None,
+        "sync_s": round(sync_seconds, 3),
+        "index_s": round(index_seconds, 3),
+        "db_write_s": round(DBTimer.seconds, 3),
+        "db_write_statements": DBTimer.statements,
+        "api_calls": dict(api.calls),
+        "quota_errors": sum(api.errors.values()),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--roles", type=int, default=2000, help="Roles in the catalogue")
+    parser.add_argument("--services", type=int, default=300, help="Services in the catalogue")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to each call")
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Share of retried calls failing with 429"
+    )
+    parser.add_argument("--changed", type=float, default=0.05, help="Changed roles (incremental)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=1000.0, help="API requests per second")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", type=Path, help="Also write the results to this file")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_mode(args)))
+        return
+
+    child_argv = [
+        f"--{name.replace('_', '-')}={value}"
+        for name, value in vars(args).items()
+        if name not in ("modes", "json", "child")
+    ]
+    results = []
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as scratch:
+            env = {**os.environ, "GCP_IAM_ROLES_DB": str(Path(scratch, "bench.db"))}
+            output = subprocess.run(
+                [sys.executable, __file__, *child_argv, "--child", mode],
+                env=env,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            results.append(json.loads(output.splitlines()[-1]))
+
+    table = Table(title=f"Sync benchmark: {args.roles} roles, {args.services} services")
+    for column in ("Mode", "Items/s", "Sync", "Index", "DB writes", "API calls", "429s", "RSS"):
+        table.add_column(column, justify="left" if column == "Mode" else "right", no_wrap=True)
+    for result in results:
+        table.add_row(
+            result["mode"],
+            f"{result['items_per_s']:,}",
+            f"{result['sync_s']:.2f} s",
+            f"{result['index_s']:.2f} s",
+            f"{result['db_write_s']:.2f} s",
+            str(sum(result["api_calls"].values())),
+            str(result["quota_errors"]),
+            f"{result['peak_rss_mb']} MB",
+        )
+    console.print(table)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Builds synthetic gcp-iam-roles databases at configurable scales.
+
+Scale 1 is shaped like the public catalogue: about 2,000 predefined roles, 300 services
+and 19,000 permissions, including a few basic roles granting nearly everything. Scale 10
+is what an organisation with many custom roles and enabled services looks like. The
+data goes through the real sync and index code, fed by the fake clients, so the tables,
+search indexes, completion cache and query snapshot match what a real sync writes:
+
+    python benchmarks/synthetic_db.py --scale 10 --output benchmarks/tmp/scale-10
+
+The package reads the database location once at import, so `generate` must run before
+anything imports `gcp_iam_roles` in the process.
+"""
+
+import argparse
+import json
+import os
+import sys
+from contextlib import redirect_stdout
+from pathlib import Path
+
+BENCHMARKS = Path(__file__).resolve().parent
+SRC = BENCHMARKS.parent.joinpath("src")
+BASE_ROLES = 2000
+BASE_SERVICES = 300
+DB_NAME = "gcp-iam-roles.db"
+# Written last, so a directory without it holds an interrupted generation
+METADATA_NAME = "synthetic.json"
+
+
+def generate(directory: Path, scale: float = 1.0, seed: int = 1) -> dict[str, object]:
+    """Fills `directory` with a database of `scale` times the public catalogue."""
+    if "gcp_iam_roles" in sys.modules:
+        raise RuntimeError("generate() must run before gcp_iam_roles is imported")
+    directory.mkdir(parents=True, exist_ok=True)
+    directory.joinpath(METADATA_NAME).unlink(missing_ok=True)
+    db_file = directory.joinpath(DB_NAME)
+    db_file.unlink(missing_ok=True)
+    os.environ["GCP_IAM_ROLES_DB"] = str(db_file)
+    sys.path[:0] = [str(SRC), str(BENCHMARKS)]
+
+    from fake_gcp import Catalogue, FakeAPI, FakeIAMClient, FakeServiceUsageClient
+
+    from gcp_iam_roles.auth import use_clients
+    from gcp_iam_roles.db import create_db
+    from gcp_iam_roles.indexes import rebuild_indexes
+    from gcp_iam_roles.roles import sync_roles_single_pass
+    from gcp_iam_roles.services import sync_services
+
+    catalogue = Catalogue(
+        roles=round(BASE_ROLES * scale), services=round(BASE_SERVICES * scale), seed=seed
+    )
+    api = FakeAPI(seed=seed)
+    use_clients(FakeIAMClient(catalogue, api), FakeServiceUsageClient(catalogue, api))
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        create_db()
+        sync_roles_single_pass()
+        sync_services(restart=True)
+        rebuild_indexes()
+
+    metadata = {
+        "scale": scale,
+        "seed": seed,
+        "roles": len(catalogue.role_list),
+        "services": len(catalogue.service_list),
+        "grants": sum(len(role.included_permissions) for role in catalogue.role_list),
+        "db_bytes": db_file.stat().st_size,
+    }
+    directory.joinpath(METADATA_NAME).write_text(json.dumps(metadata) + "\n", encoding="utf-8")
+    return metadata
+
+
+def load_metadata(directory: Path) -> dict[str, object] | None:
+    """Returns the metadata of a completed generation, or None."""
+    try:
+        return json.loads(directory.joinpath(METADATA_NAME).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiple of the catalogue")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=Path, required=True, help="Directory to fill")
+    args = parser.parse_args()
+    print(json.dumps(generate(args.output, args.scale, args.seed)))
+
+
+if __name__ == "__main__":
+    main()
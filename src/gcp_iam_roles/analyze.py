@@ -0,0 +1,219 @@
+import gzip
+import json
+import re
+import sqlite3
+import sys
+import time
+from collections import Counter, defaultdict
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any, TextIO
+
+from rich.console import Console
+
+console = Console(stderr=True)
+
+from .connection import connect
+from .cover import bitmask
+from .output import OutputFormat, write_rows
+from .profiling import count, profiled
+
+# Characters read from an export at a time; memory stays near this plus the largest
+# single document (one policy, or one line of a Cloud Asset export)
+CHUNK_SIZE = 1 << 20
+# Between top-level values: whitespace, and the commas and closing bracket of an array
+_SEPARATORS = re.compile(r"[\s,\]]*")
+_decoder = json.JSONDecoder()
+
+ROLE_ID = "SELECT id FROM roles WHERE role = ? AND deleted IS NULL"
+ROLE_PERMISSION_IDS = "SELECT permission_id FROM role_permissions WHERE role_id = ?"
+
+PRINCIPAL_COLUMNS = ("principal", "permissions", "roles", "bindings")
+WHO_CAN_COLUMNS = ("permission", "principal", "resource", "role", "conditional")
+
+
+def iter_json_values(stream: TextIO) -> Iterator[Any]:
+    """
+    Yields the top-level JSON values of a stream without reading it whole.
+
+    Handles one document (`gcloud projects get-iam-policy --format=json`), JSON lines or
+    concatenated documents (Cloud Asset exports) and a top-level array, whose elements
+    are yielded one by one (`gcloud asset search-all-iam-policies --format=json`).
+    """
+    buffer = stream.read(CHUNK_SIZE)
+    eof = not buffer
+    content = buffer.lstrip()
+    position = len(buffer) - len(content) + content.startswith("[")
+    while True:
+        position = _SEPARATORS.match(buffer, position).end()
+        if position == len(buffer):
+            if eof:
+                return
+            buffer, position = stream.read(CHUNK_SIZE), 0
+            eof = not buffer
+            continue
+        try:
+            value, position = _decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # The value continues past the buffer: keep its start and read at least as
+            # much again, so a large value costs a logarithmic number of re-parses
+            more = stream.read(max(CHUNK_SIZE, len(buffer) - position))
+            buffer, position = buffer[position:] + more, 0
+            eof = not more
+            continue
+        yield value
+
+
+def iter_policies(document: Any, source: str) -> Iterator[tuple[str, dict[str, Any]]]:
+    """Yields (resource, policy) for the policies in one exported document."""
+    if not isinstance(document, dict):
+        return
+    if isinstance(document.get("bindings"), list):
+        # get-iam-policy output carries no resource name; the file name stands in for it
+        yield str(document.get("resource", source)), document
+        return
+    for key in ("iam_policy", "iamPolicy", "policy"):
+        policy = document.get(key)
+        if isinstance(policy, dict):
+            yield str(document.get("name") or document.get("resource") or source), policy
+
+
+def _open(path: Path) -> TextIO:
+    if str(path) == "-":
+        return sys.stdin
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8")
+    return path.open(encoding="utf-8")
+
+
+class PolicyAnalyzer:
+    """
+    Expands policy bindings into effective permissions per principal.
+
+    Each role's permissions become a bitset over permission ids, read from SQLite once
+    and memoized, so a principal's effective permissions are the OR of its roles' sets.
+    Only the distinct roles of each principal are kept, so memory grows with distinct
+    principal-role pairs, not with the number of bindings read.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, who_can: list[str]) -> None:
+        self.conn = conn
+        (max_id,) = conn.execute("SELECT MAX(id) FROM permission_names").fetchone()
+        self.size = (max_id or 0) + 1
+        self.masks: dict[str, int | None] = {}
+        self.principal_roles: defaultdict[str, set[str]] = defaultdict(set)
+        self.principal_bindings: Counter[str] = Counter()
+        self.unknown_roles: Counter[str] = Counter()
+        self.targets: dict[str, int] = {}
+        for permission in who_can:
+            row = conn.execute(
+                "SELECT id FROM permission_names WHERE permission = ?", (permission,)
+            ).fetchone()
+            if row is None:
+                console.print(f"[yellow]Permission '{permission}' not found in database[/yellow]")
+            else:
+                self.targets[permission] = row[0]
+        self.policies = self.bindings = 0
+
+    def role_mask(self, role: str) -> int | None:
+        """Returns the permission bitset of a role, or None when it is not in the database."""
+        if role not in self.masks:
+            # Predefined roles are stored without their 'roles/' prefix
+            row = self.conn.execute(ROLE_ID, (role.removeprefix("roles/"),)).fetchone()
+            if row is None:
+                self.masks[role] = None
+            else:
+                ids = [pid for (pid,) in self.conn.execute(ROLE_PERMISSION_IDS, (row[0],))]
+                self.masks[role] = bitmask(ids, self.size)
+            count("analyze.roles_expanded")
+        return self.masks[role]
+
+    def add_policy(self, resource: str, policy: dict[str, Any]) -> Iterator[tuple]:
+        """Records a policy's bindings and yields its `--who-can` rows."""
+        self.policies += 1
+        for binding in policy.get("bindings") or ():
+            role = binding.get("role")
+            members = binding.get("members") or ()
+            if not role:
+                continue
+            self.bindings += 1
+            mask = self.role_mask(role)
+            if mask is None:
+                self.unknown_roles[role] += 1
+            for member in members:
+                self.principal_roles[member].add(role)
+                self.principal_bindings[member] += 1
+            if mask is None or not self.targets:
+                continue
+            conditional = "condition" in binding
+            for permission, bit in self.targets.items():
+                if mask >> bit & 1:
+                    for member in members:
+                        yield (permission, member, resource, role, conditional)
+
+    def principal_rows(self) -> Iterator[tuple[str, int, int, int]]:
+        """Yields (principal, permissions, roles, bindings) in principal order."""
+        for principal in sorted(self.principal_roles):
+            roles = self.principal_roles[principal]
+            effective = 0
+            for role in roles:
+                effective |= self.masks[role] or 0
+            yield (principal, effective.bit_count(), len(roles), self.principal_bindings[principal])
+
+
+def _who_can_rows(analyzer: PolicyAnalyzer, paths: list[Path]) -> Iterator[tuple]:
+    """Streams the `--who-can` rows of every file while recording all bindings."""
+    for path in paths:
+        try:
+            with _open(path) as stream:
+                for document in iter_json_values(stream):
+                    for resource, policy in iter_policies(document, str(path)):
+                        yield from analyzer.add_policy(resource, policy)
+        except (OSError, UnicodeDecodeError, json.JSONDecodeError) as error:
+            console.print(f"[red]Cannot read {path}: {error}[/red]")
+    count("analyze.bindings", analyzer.bindings)
+
+
+@profiled("analyze")
+def analyze_policies(paths: list[Path], who_can: list[str] | None = None) -> None:
+    """
+    Streams exported IAM policies and writes effective permissions as JSON lines.
+
+    Without `who_can`, writes one line per principal with its effective permission
+    count once every file is read. With it, writes a line per principal, resource and
+    role granting one of the permissions, as the bindings are read.
+    """
+    started = time.perf_counter()
+    conn = connect(read_only=True)
+
+    try:
+        analyzer = PolicyAnalyzer(conn, who_can or [])
+        if who_can:
+            if analyzer.targets:
+                rows = _who_can_rows(analyzer, paths)
+                written = write_rows(rows, WHO_CAN_COLUMNS, OutputFormat.jsonl)
+                console.print(f"[green]Found {written:,} grants[/green]")
+        else:
+            for _ in _who_can_rows(analyzer, paths):
+                pass
+            write_rows(analyzer.principal_rows(), PRINCIPAL_COLUMNS, OutputFormat.jsonl)
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+        conn.close()
+        return
+
+    conn.close()
+
+    if analyzer.unknown_roles:
+        examples = ", ".join(role for role, _ in analyzer.unknown_roles.most_common(3))
+        console.print(
+            f"[yellow]{len(analyzer.unknown_roles)} roles not in the database grant no "
+            f"permissions here: {examples}; load custom roles with `role --import`[/yellow]"
+        )
+    elapsed = (time.perf_counter() - started) * 1000
+    console.print(
+        f"[green]Analyzed {analyzer.bindings:,} bindings in {analyzer.policies:,} policies "
+        f"for {len(analyzer.principal_roles):,} principals in {elapsed:.0f} ms[/green]"
+    )
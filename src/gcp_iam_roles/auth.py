@@ -1,13 +1,24 @@
 import sys
+from typing import TYPE_CHECKING
 
-import google.auth
-from google.auth.credentials import Credentials
 from rich.console import Console
 
+if TYPE_CHECKING:
+    from google.auth.credentials import Credentials
+    from google.cloud import iam_admin_v1, service_usage_v1
+
 console = Console()
 
+from .profiling import span
+
+# Client instances used instead of the Google API clients, e.g. local stand-ins in benchmarks
+_clients: dict[str, object] = {}
+
+
+def get_google_credentials() -> tuple["Credentials", str]:
+    import google.auth
+    import google.auth.transport.requests
 
-def get_google_credentials() -> tuple[Credentials, str]:
     try:
         credentials, project_id = google.auth.default()
         credentials.refresh(google.auth.transport.requests.Request())
@@ -20,3 +31,48 @@ def get_google_credentials() -> tuple[Credentials, str]:
             "[red]Token has been expired or revoked. Run `gcloud auth login --update-adc` to authenticate.[/red]"
         )
         sys.exit(1)
+
+
+# Cache credentials to avoid multiple authentication calls
+def ensure_authenticated() -> tuple["Credentials", str]:
+    """Ensure Google Cloud credentials are available, caching the result."""
+    if not hasattr(ensure_authenticated, "_cache"):
+        with span("auth"):
+            ensure_authenticated._cache = get_google_credentials()
+    return ensure_authenticated._cache
+
+
+def use_clients(
+    iam: object | None = None, service_usage: object | None = None, project_id: str = "local"
+) -> None:
+    """
+    Injects API clients to use instead of the Google Cloud clients.
+
+    Syncs then run without Application Default Credentials; `ensure_authenticated`
+    returns anonymous credentials for `project_id`.
+    """
+    from google.auth.credentials import AnonymousCredentials
+
+    if iam is not None:
+        _clients["iam"] = iam
+    if service_usage is not None:
+        _clients["service_usage"] = service_usage
+    ensure_authenticated._cache = (AnonymousCredentials(), project_id)
+
+
+def iam_client() -> "iam_admin_v1.IAMClient":
+    """Returns the injected IAM client or a new Google Cloud IAM client."""
+    if "iam" in _clients:
+        return _clients["iam"]
+    from google.cloud import iam_admin_v1
+
+    return iam_admin_v1.IAMClient()
+
+
+def service_usage_client() -> "service_usage_v1.ServiceUsageClient":
+    """Returns the injected Service Usage client or a new Google Cloud one."""
+    if "service_usage" in _clients:
+        return _clients["service_usage"]
+    from google.cloud import service_usage_v1
+
+    return service_usage_v1.ServiceUsageClient()
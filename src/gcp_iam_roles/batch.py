@@ -0,0 +1,237 @@
+import json
+import sqlite3
+import sys
+import time
+from collections.abc import Iterable
+from typing import Any, TextIO
+
+from rich.console import Console
+
+console = Console(stderr=True)
+
+from .completion import COMPLETION_FILES, load_names, match_prefix
+from .connection import connect
+from .db import DEFAULT_SEARCH_LIMIT
+from .fuzzy import FUZZY_SOURCES, query_fuzzy
+from .output import close_stdout_on_broken_pipe
+from .permissions import query_permissions
+from .profiling import profiled
+from .roles import query_roles
+from .services import query_services
+from .snapshot import Snapshot, load_snapshot
+
+# Fallback statements for databases without a snapshot; sqlite3 keeps them prepared in
+# the connection's statement cache, so every repeated request skips compilation.
+ROLE_PERMISSIONS = """
+    SELECT pn.permission
+    FROM roles r
+    JOIN role_permissions rp ON rp.role_id = r.id
+    JOIN permission_names pn ON pn.id = rp.permission_id
+    WHERE r.role = ? AND r.deleted IS NULL
+    ORDER BY pn.permission
+"""
+PERMISSION_ROLES = """
+    SELECT r.role
+    FROM permission_names pn
+    JOIN role_permissions rp ON rp.permission_id = pn.id
+    JOIN roles r ON r.id = rp.role_id
+    WHERE pn.permission = ? AND r.deleted IS NULL
+    ORDER BY r.role
+"""
+ROLE_EXISTS = "SELECT 1 FROM roles WHERE role = ? AND deleted IS NULL"
+
+# Argument counts of plain requests: `diff` takes two roles, and `search`, `fuzzy` and
+# `complete` take one or two arguments
+DIFF_ARGS = 2
+MAX_ARGS = 2
+
+SEARCHES = {
+    "roles": (query_roles, ("role", "title")),
+    "permissions": (query_permissions, ("role", "permission")),
+    "services": (query_services, ("service", "title")),
+}
+
+
+class BatchError(Exception):
+    """A single request that cannot be answered; reported in its response line."""
+
+
+def parse_request(line: str) -> dict[str, Any]:
+    """
+    Parses one request line.
+
+    JSON objects are taken as they are. Plain lines are whitespace-separated:
+    `list ROLE`, `roles PERMISSION`, `diff ROLE1 ROLE2`, `search [KIND] TERM`,
+    `fuzzy [KIND] TERM` and `complete roles|permissions [PREFIX]`.
+    """
+    if line.startswith("{"):
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as error:
+            raise BatchError(f"invalid JSON: {error}") from error
+        if not isinstance(request, dict):
+            raise BatchError("request must be a JSON object")
+        return request
+
+    op, *args = line.split()
+    if op == "list" and len(args) == 1:
+        return {"op": op, "role": args[0]}
+    if op == "roles" and len(args) == 1:
+        return {"op": op, "permission": args[0]}
+    if op == "diff" and len(args) == DIFF_ARGS:
+        return {"op": op, "roles": args}
+    if op in ("search", "fuzzy") and 1 <= len(args) <= MAX_ARGS:
+        kind = args[0] if len(args) == MAX_ARGS else "permissions"
+        return {"op": op, "kind": kind, "term": args[-1]}
+    if op == "complete" and 1 <= len(args) <= MAX_ARGS:
+        prefix = args[1] if len(args) == MAX_ARGS else ""
+        return {"op": op, "kind": args[0], "prefix": prefix}
+    raise BatchError(f"cannot parse request: {line}")
+
+
+def _side(in_left: bool, in_right: bool) -> str:
+    if in_left and in_right:
+        return "common"
+    return "left" if in_left else "right"
+
+
+class BatchSession:
+    """Answers lookups over one SQLite connection and, when present, the mapped snapshot."""
+
+    def __init__(self, conn: sqlite3.Connection, snapshot: Snapshot | None) -> None:
+        self.conn = conn
+        self.snapshot = snapshot
+        # Sorted completion names, loaded on the first completion request of each kind
+        self.names: dict[str, list[str]] = {}
+
+    def _role_exists(self, role: str) -> bool:
+        if self.snapshot is not None:
+            return self.snapshot.permission_indexes(role) is not None
+        return self.conn.execute(ROLE_EXISTS, (role,)).fetchone() is not None
+
+    def permissions_of(self, role: str) -> list[dict[str, str]]:
+        if self.snapshot is not None:
+            permissions = self.snapshot.role_permissions(role)
+        elif self._role_exists(role):
+            permissions = (row[0] for row in self.conn.execute(ROLE_PERMISSIONS, (role,)))
+        else:
+            permissions = None
+        if permissions is None:
+            raise BatchError(f"Role '{role}' not found in database")
+        return [{"permission": permission} for permission in permissions]
+
+    def roles_of(self, permission: str) -> list[dict[str, str]]:
+        if self.snapshot is not None:
+            roles = list(self.snapshot.permission_roles(permission) or ())
+        else:
+            roles = [row[0] for row in self.conn.execute(PERMISSION_ROLES, (permission,))]
+        if not roles:
+            raise BatchError(f"Permission '{permission}' not granted by any role")
+        return [{"role": role} for role in roles]
+
+    def diff(self, role1: str, role2: str) -> list[dict[str, str]]:
+        for role in (role1, role2):
+            if not self._role_exists(role):
+                raise BatchError(f"Role '{role}' not found in database")
+        if role1 == role2:
+            return []
+        if self.snapshot is not None:
+            rows: Iterable[tuple[str, str]] = self.snapshot.diff(role1, role2)
+        else:
+            left = {row[0] for row in self.conn.execute(ROLE_PERMISSIONS, (role1,))}
+            right = {row[0] for row in self.conn.execute(ROLE_PERMISSIONS, (role2,))}
+            rows = sorted(
+                (permission, _side(permission in left, permission in right))
+                for permission in left | right
+            )
+        return [{"permission": permission, "status": status} for permission, status in rows]
+
+    def search(self, kind: str, term: str, limit: int) -> list[dict[str, str]]:
+        if kind not in SEARCHES:
+            raise BatchError(f"unknown search kind '{kind}', expected one of {', '.join(SEARCHES)}")
+        query, columns = SEARCHES[kind]
+        cursor = query(self.conn.cursor(), term, limit)
+        return [dict(zip(columns, row, strict=True)) for row in cursor]
+
+    def fuzzy(self, kind: str, term: str, limit: int) -> list[dict[str, object]]:
+        if kind not in FUZZY_SOURCES:
+            raise BatchError(f"unknown fuzzy kind '{kind}', expected roles or permissions")
+        _, columns = FUZZY_SOURCES[kind]
+        rows = query_fuzzy(self.conn, kind, term, limit)
+        return [dict(zip(columns, row, strict=True)) for row in rows]
+
+    def complete(self, kind: str, prefix: str) -> list[dict[str, str]]:
+        if kind not in COMPLETION_FILES:
+            raise BatchError(f"unknown completion kind '{kind}', expected roles or permissions")
+        if kind not in self.names:
+            self.names[kind] = load_names(kind)
+        column = kind.removesuffix("s")
+        return [{column: name} for name in match_prefix(self.names[kind], prefix)]
+
+    def answer(self, request: dict[str, Any]) -> list[dict[str, object]]:
+        """Dispatches one parsed request and returns its result rows."""
+        try:
+            match request.get("op"):
+                case "list":
+                    return self.permissions_of(request["role"])
+                case "roles":
+                    return self.roles_of(request["permission"])
+                case "diff":
+                    role1, role2 = request["roles"]
+                    return self.diff(role1, role2)
+                case "search":
+                    limit = int(request.get("limit", DEFAULT_SEARCH_LIMIT))
+                    return self.search(request.get("kind", "permissions"), request["term"], limit)
+                case "fuzzy":
+                    limit = int(request.get("limit", DEFAULT_SEARCH_LIMIT))
+                    return self.fuzzy(request.get("kind", "permissions"), request["term"], limit)
+                case "complete":
+                    return self.complete(request["kind"], request.get("prefix", ""))
+                case op:
+                    raise BatchError(
+                        f"unknown op '{op}', expected list, roles, diff, search, fuzzy or complete"
+                    )
+        except (KeyError, TypeError, ValueError) as error:
+            raise BatchError(f"malformed request: {error!r}") from error
+
+
+@profiled("batch")
+def run_batch(lines: TextIO = sys.stdin, out: TextIO = sys.stdout) -> None:
+    """
+    Answers newline- or JSONL-delimited requests, writing one JSON line per request.
+
+    Every response echoes the request (including any `id`) with either its `results` or
+    an `error`, and is flushed immediately so the command can also run as a coprocess.
+    """
+    started = time.perf_counter()
+    answered = failed = 0
+    conn = connect(read_only=True, cached_statements=256)
+    session = BatchSession(conn, load_snapshot())
+
+    try:
+        for raw in lines:
+            line = raw.strip()
+            if not line or line.startswith("#"):
+                continue
+            request: dict[str, Any] = {"line": line}
+            try:
+                request = parse_request(line)
+                response = {**request, "results": session.answer(request)}
+            except BatchError as error:
+                response = {**request, "error": str(error)}
+                failed += 1
+            except sqlite3.Error as error:
+                response = {**request, "error": f"SQLite Error: {error}"}
+                failed += 1
+            out.write(json.dumps(response) + "\n")
+            out.flush()
+            answered += 1
+    except BrokenPipeError:
+        close_stdout_on_broken_pipe()
+    finally:
+        conn.close()
+
+    elapsed = (time.perf_counter() - started) * 1000
+    console.print(
+        f"[green]Answered {answered} requests ({failed} failed) in {elapsed:.0f} ms[/green]"
+    )
@@ -0,0 +1,41 @@
+import json
+import socket
+
+from . import DB_FILE
+
+# Written by `gcp-iam-roles serve`; present only while the daemon runs (or after a crash)
+SOCKET_FILE = DB_FILE.parent.joinpath("gcp-iam-roles.sock")
+# Seconds before a hung daemon is given up on and the query runs locally
+TIMEOUT = 2.0
+
+
+def query_daemon(request: dict[str, object]) -> list[dict[str, str]] | None:
+    """
+    Sends one request to the running daemon and returns its result rows.
+
+    Returns None when no daemon answers or the request fails there, so the caller
+    falls back to answering it in-process, with its own error messages.
+    """
+    if not SOCKET_FILE.exists():
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(TIMEOUT)
+            sock.connect(str(SOCKET_FILE))
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            sock.shutdown(socket.SHUT_WR)
+            chunks = []
+            while chunk := sock.recv(65536):
+                chunks.append(chunk)
+        response = json.loads(b"".join(chunks))
+    except (OSError, ValueError):
+        return None
+    return response.get("results") if isinstance(response, dict) else None
+
+
+def daemon_rows(request: dict[str, object], columns: tuple[str, ...]) -> list[tuple] | None:
+    """Like `query_daemon`, with the rows as tuples in the order of `columns`."""
+    results = query_daemon(request)
+    if results is None:
+        return None
+    return [tuple(row[column] for column in columns) for row in results]
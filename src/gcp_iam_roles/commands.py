@@ -0,0 +1,493 @@
+import sys
+import time
+from pathlib import Path
+
+import typer
+from rich.console import Console
+
+from . import STARTED
+from .analyze import analyze_policies
+from .auth import ensure_authenticated
+from .batch import run_batch
+from .completion import print_permissions, print_roles
+from .cover import DEFAULT_MAX_ROLES, DEFAULT_TOP, cover_roles, read_permissions
+from .custom_roles import import_custom_roles
+from .db import DEFAULT_SEARCH_LIMIT, clear_db, create_db, status_db
+from .fuzzy import search_fuzzy
+from .indexes import rebuild_indexes
+from .lattice import role_subsets, role_supersets
+from .output import OutputFormat
+from .permissions import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_RATE,
+    glob_permissions,
+    list_permission_roles,
+    list_permissions,
+    permission_tree,
+    search_permissions,
+    sync_permissions,
+)
+from .profiling import DEFAULT_TRACE_FILE
+from .profiling import finish as finish_profile
+from .profiling import start as start_profile
+from .roles import (
+    SyncMode,
+    diff_roles,
+    search_roles,
+    sync_roles,
+    sync_roles_incremental,
+    sync_roles_single_pass,
+)
+from .services import DEFAULT_PAGE_SIZE as SERVICES_PAGE_SIZE
+from .services import search_services, service_permissions, service_roles, sync_services
+from .similarity import similar_roles
+
+console = Console()
+
+app = typer.Typer(
+    name="gcp-iam-roles",
+    help="Search Google Cloud IAM roles and permissions",
+)
+
+
+@app.callback(invoke_without_command=True)
+def main(
+    ctx: typer.Context,
+    timings: bool = typer.Option(
+        False, "--timings", help="Show import and run time of the command on stderr"
+    ),
+    profile: bool = typer.Option(
+        False,
+        "--profile",
+        help="Record timing spans, counters and API latencies; print a summary on stderr",
+    ),
+    profile_output: Path = typer.Option(
+        DEFAULT_TRACE_FILE, "--profile-output", help="JSON trace file written by --profile"
+    ),
+    profile_hot: str | None = typer.Option(
+        None,
+        "--profile-hot",
+        help="Capture cProfile stats for a span, e.g. sync.roles.single_pass or index",
+    ),
+) -> None:
+    """Search Google Cloud IAM roles and permissions."""
+    if timings:
+        ctx.call_on_close(_print_timings)
+    if profile:
+        start_profile(" ".join(["gcp-iam-roles", *sys.argv[1:]]), profile_output, profile_hot)
+        ctx.call_on_close(finish_profile)
+    if ctx.invoked_subcommand is None:
+        console.print(ctx.get_help())
+        raise typer.Exit()
+    create_db()
+
+
+def _print_timings() -> None:
+    finished = time.perf_counter()
+    google_loaded = any(name.startswith("google.cloud") for name in sys.modules)
+    Console(stderr=True).print(
+        f"[dim]imports: {(IMPORTED - STARTED) * 1000:.1f} ms, "
+        f"command: {(finished - IMPORTED) * 1000:.1f} ms, "
+        f"total: {(finished - STARTED) * 1000:.1f} ms, "
+        f"google client libraries loaded: {'yes' if google_loaded else 'no'}[/dim]"
+    )
+
+
+@app.command()
+def role(  # noqa: PLR0913
+    ctx: typer.Context,
+    search: str | None = typer.Option(
+        None,
+        "--search",
+        help="Search for roles by name pattern (searches role names, titles, and descriptions)",
+    ),
+    fuzzy: bool = typer.Option(
+        False, "--fuzzy", help="Rank --search results by similarity, tolerating typos"
+    ),
+    limit: int = typer.Option(
+        DEFAULT_SEARCH_LIMIT, "--limit", min=0, help="Maximum number of search results (0 for all)"
+    ),
+    output_format: OutputFormat = typer.Option(
+        OutputFormat.table,
+        "--format",
+        help="Output format; tsv, jsonl and csv stream rows without building a table",
+    ),
+    sync: bool = typer.Option(
+        False, "--sync", help="Sync predefined IAM roles and permissions from Google Cloud APIs"
+    ),
+    import_dir: Path | None = typer.Option(
+        None,
+        "--import",
+        help="Import custom roles from YAML or JSON files below a directory "
+        "(gcloud iam roles describe format); unchanged files are skipped",
+    ),
+    diff: list[str] = typer.Option(
+        [], "--diff", help="Compare permissions between two roles (use --diff role1 --diff role2)"
+    ),
+    mode: SyncMode = typer.Option(
+        SyncMode.per_role,
+        "--mode",
+        help="Sync strategy: 'per-role' calls GetRole for each role, "
+        "'single-pass' pages through ListRoles with the FULL view, "
+        "'incremental' refetches only roles whose etag changed",
+    ),
+    resume: bool = typer.Option(
+        False,
+        "--resume",
+        help="Continue an interrupted or partly failed per-role sync without listing "
+        "roles or fetching completed ones again",
+    ),
+    concurrency: int = typer.Option(
+        DEFAULT_CONCURRENCY, "--concurrency", min=1, help="Number of concurrent API requests"
+    ),
+    rate: float = typer.Option(
+        DEFAULT_RATE, "--rate", min=0.1, help="Maximum API requests per second during sync"
+    ),
+    cover: list[str] = typer.Option(
+        [],
+        "--cover",
+        help="Find the fewest-excess role combinations granting these permissions (repeatable)",
+    ),
+    cover_file: Path | None = typer.Option(
+        None, "--cover-file", help="Read permissions for --cover from a file ('-' for stdin)"
+    ),
+    max_roles: int = typer.Option(
+        DEFAULT_MAX_ROLES, "--max-roles", min=1, help="Maximum roles per --cover combination"
+    ),
+    top: int = typer.Option(DEFAULT_TOP, "--top", min=1, help="Number of results to return"),
+    supersets: list[str] = typer.Option(
+        [],
+        "--supersets",
+        help="List roles that grant every permission of these roles (repeatable)",
+    ),
+    subsets: str | None = typer.Option(
+        None, "--subsets", help="List roles whose permissions are all granted by this role"
+    ),
+    similar: str | None = typer.Option(
+        None,
+        "--similar",
+        help="List the --top roles most similar to a role or a permission file ('-' for stdin)",
+    ),
+) -> None:
+    """
+    Manage GCP IAM roles.
+
+    Examples:
+
+      > gcp-iam-roles role --search compute.
+
+      > gcp-iam-roles role --search vertx --fuzzy
+
+      > gcp-iam-roles role --diff compute.osAdminLogin --diff compute.osLogin
+
+      > gcp-iam-roles role --sync
+
+      > gcp-iam-roles role --sync --concurrency 16 --rate 40
+
+      > gcp-iam-roles role --sync --resume
+
+      > gcp-iam-roles role --sync --mode single-pass
+
+      > gcp-iam-roles role --sync --mode incremental
+
+      > gcp-iam-roles role --import ./iam/custom-roles
+
+      > gcp-iam-roles role --cover compute.instances.get --cover storage.objects.list
+
+      > gcp-iam-roles role --cover-file permissions.txt --max-roles 3
+
+      > gcp-iam-roles role --supersets compute.viewer
+
+      > gcp-iam-roles role --supersets compute.viewer --supersets storage.objectViewer
+
+      > gcp-iam-roles role --subsets compute.admin
+
+      > gcp-iam-roles role --similar compute.viewer --top 10
+
+      > gcp-iam-roles role --similar custom-role-permissions.txt
+
+    """
+    if search:
+        _search_roles(search, fuzzy, limit, output_format)
+    elif sync:
+        _sync_roles(mode, resume, concurrency, rate)
+    elif import_dir:
+        if import_custom_roles(import_dir):
+            rebuild_indexes()
+    elif diff:
+        _diff_roles(diff, output_format)
+    elif cover or cover_file:
+        permissions = read_permissions(cover, cover_file)
+        cover_roles(permissions, max_roles=max_roles, top=top, output_format=output_format)
+    elif supersets:
+        role_supersets(supersets, output_format=output_format)
+    elif subsets:
+        role_subsets(subsets, output_format=output_format)
+    elif similar:
+        similar_roles(similar, top=top, output_format=output_format)
+    else:
+        # Show help when no options are provided
+        console.print(ctx.get_help())
+        raise typer.Exit()
+
+
+def _search_roles(search: str, fuzzy: bool, limit: int, output_format: OutputFormat) -> None:
+    if fuzzy:
+        search_fuzzy("roles", search, limit=limit, output_format=output_format)
+    else:
+        search_roles(search, limit=limit, output_format=output_format)
+
+
+def _sync_roles(mode: SyncMode, resume: bool, concurrency: int, rate: float) -> None:
+    ensure_authenticated()
+    if resume and mode != SyncMode.per_role:
+        # An incremental rerun skips the roles stored with their new etag, and a
+        # single-pass sync lists every role with its permissions anyway
+        console.print(
+            f"[yellow]--resume only applies to the per-role sync, not {mode.value}[/yellow]"
+        )
+    if mode == SyncMode.single_pass:
+        sync_roles_single_pass()
+    elif mode == SyncMode.incremental:
+        sync_roles_incremental(concurrency=concurrency, rate=rate)
+    else:
+        if not resume:
+            sync_roles()
+        sync_permissions(concurrency=concurrency, rate=rate, resume=resume)
+    rebuild_indexes()
+
+
+def _diff_roles(diff: list[str], output_format: OutputFormat) -> None:
+    diff_size = 2
+    if len(diff) != diff_size:
+        console.print("[red]Error: --diff requires exactly two role names[/red]")
+        console.print("Example: gcp-iam-roles role --diff compute.viewer --diff storage.viewer")
+        raise typer.Exit(1)
+    diff_roles(diff[0], diff[1], output_format=output_format)
+
+
+@app.command()
+def permission(  # noqa: PLR0913
+    ctx: typer.Context,
+    search: str | None = typer.Option(
+        None, "--search", help="Search for permissions by name pattern"
+    ),
+    fuzzy: bool = typer.Option(
+        False, "--fuzzy", help="Rank --search results by similarity, tolerating typos"
+    ),
+    limit: int = typer.Option(
+        DEFAULT_SEARCH_LIMIT, "--limit", min=0, help="Maximum number of search results (0 for all)"
+    ),
+    output_format: OutputFormat = typer.Option(
+        OutputFormat.table,
+        "--format",
+        help="Output format; tsv, jsonl and csv stream rows without building a table",
+    ),
+    list_role: str | None = typer.Option(
+        None, "--list", help="List all permissions for a given role"
+    ),
+    roles_for: str | None = typer.Option(
+        None, "--roles", help="List all roles that grant a given permission"
+    ),
+    glob: str | None = typer.Option(
+        None,
+        "--glob",
+        help="List permissions matching a segment glob ('*' matches one segment, '**' any)",
+    ),
+    tree: str | None = typer.Option(
+        None, "--tree", help="Show permission counts below a service or resource ('' for all)"
+    ),
+) -> None:
+    """
+    Manage GCP IAM permissions.
+
+    Examples:
+
+    > gcp-iam-roles permission --search compute.instances.osLogin
+
+    > gcp-iam-roles permission --list compute.admin
+
+    > gcp-iam-roles permission --roles compute.instances.get
+
+    > gcp-iam-roles permission --glob 'compute.*.delete'
+
+    > gcp-iam-roles permission --glob 'storage.objects.**'
+
+    > gcp-iam-roles permission --tree storage
+
+    > gcp-iam-roles permission --search get --limit 0 --format tsv | head
+
+    > gcp-iam-roles permission --search artifactregistry.reader --fuzzy --limit 10
+
+    """
+    if search:
+        _search_permissions(search, fuzzy, limit, output_format)
+    elif list_role:
+        list_permissions(list_role, output_format=output_format)
+    elif roles_for:
+        list_permission_roles(roles_for, output_format=output_format)
+    elif glob:
+        glob_permissions(glob, output_format=output_format)
+    elif tree is not None:
+        permission_tree(tree, output_format=output_format)
+    else:
+        console.print(ctx.get_help())
+        raise typer.Exit()
+
+
+def _search_permissions(search: str, fuzzy: bool, limit: int, output_format: OutputFormat) -> None:
+    if fuzzy:
+        search_fuzzy("permissions", search, limit=limit, output_format=output_format)
+    else:
+        search_permissions(search, limit=limit, output_format=output_format)
+
+
+@app.command()
+def service(  # noqa: PLR0913
+    ctx: typer.Context,
+    search: str | None = typer.Option(None, "--search", help="Search for services by name pattern"),
+    limit: int = typer.Option(
+        DEFAULT_SEARCH_LIMIT, "--limit", min=0, help="Maximum number of search results (0 for all)"
+    ),
+    output_format: OutputFormat = typer.Option(
+        OutputFormat.table,
+        "--format",
+        help="Output format; tsv, jsonl and csv stream rows without building a table",
+    ),
+    permissions_of: str | None = typer.Option(
+        None, "--permissions", help="List the permissions of a service, e.g. compute"
+    ),
+    roles_of: str | None = typer.Option(
+        None, "--roles", help="List the roles granting permissions of a service"
+    ),
+    sync: bool = typer.Option(False, "--sync", help="Sync Google Cloud services"),
+    restart: bool = typer.Option(
+        False, "--restart", help="Ignore the checkpoint of an interrupted sync and start over"
+    ),
+    page_size: int = typer.Option(
+        SERVICES_PAGE_SIZE, "--page-size", min=1, max=200, help="Services requested per page"
+    ),
+) -> None:
+    """
+    Manage GCP services.
+
+    Examples:
+
+    > gcp-iam-roles service --search storage
+
+    > gcp-iam-roles service --permissions compute.googleapis.com
+
+    > gcp-iam-roles service --roles storage --format tsv | head
+
+    """
+    if search:
+        search_services(search, limit=limit, output_format=output_format)
+    elif permissions_of:
+        service_permissions(permissions_of, output_format=output_format)
+    elif roles_of:
+        service_roles(roles_of, output_format=output_format)
+    elif sync:
+        _sync_services(page_size, restart)
+    else:
+        console.print(ctx.get_help())
+        raise typer.Exit()
+
+
+def _sync_services(page_size: int, restart: bool) -> None:
+    ensure_authenticated()
+    sync_services(page_size=page_size, restart=restart)
+    rebuild_indexes()
+
+
+@app.command()
+def batch() -> None:
+    """
+    Answer many lookups from stdin in one process, one JSON line per request.
+
+    Requests are JSON objects or plain lines: list ROLE, roles PERMISSION,
+    diff ROLE1 ROLE2, search [roles|permissions|services] TERM,
+    fuzzy [roles|permissions] TERM and
+    complete roles|permissions [PREFIX].
+
+    Examples:
+
+    > printf 'list compute.viewer\\nroles storage.objects.get\\n' | gcp-iam-roles batch
+
+    > echo '{"id": 7, "op": "search", "kind": "roles", "term": "viewer"}' | gcp-iam-roles batch
+
+    """
+    run_batch()
+
+
+@app.command()
+def analyze(
+    files: list[Path] = typer.Argument(
+        ...,
+        help="IAM policy exports: get-iam-policy JSON, Cloud Asset exports, .gz, or - for stdin",
+    ),
+    who_can: list[str] = typer.Option(
+        [], "--who-can", help="List the principals granted a permission (repeatable)"
+    ),
+) -> None:
+    """
+    Stream exported IAM policies and report effective permissions as JSON lines.
+
+    Writes one line per principal with its effective permission count, or with
+    --who-can one line per principal, resource and role granting the permission.
+
+    Examples:
+
+    > gcloud projects get-iam-policy my-project --format=json > my-project.json
+
+    > gcp-iam-roles analyze my-project.json asset-export.json.gz
+
+    > gcp-iam-roles analyze --who-can storage.objects.delete policies/*.json
+
+    """
+    analyze_policies(files, who_can)
+
+
+@app.command()
+def serve() -> None:
+    """
+    Keep the indexes loaded and answer queries over a Unix socket next to the database.
+
+    Searches, lists, diffs and shell completions use the daemon while it runs. It takes
+    the batch requests, one per line, and reloads when a sync changes the database.
+
+    Example:
+
+    > echo 'complete roles compute.' | socat - UNIX-CONNECT:$HOME/.local/share/gcp-iam-roles/gcp-iam-roles.sock
+
+    """
+    # socketserver and threading are only needed here, so other commands start faster
+    from .daemon import serve as serve_queries
+
+    serve_queries()
+
+
+@app.command()
+def status() -> None:
+    """Show roles and permissions count."""
+    status_db()
+
+
+@app.command("clear-db")
+def clear_database() -> None:
+    """Drop database tables."""
+    clear_db()
+
+
+@app.command("_list-roles", hidden=True)
+def _list_roles_completion(prefix: str = typer.Argument("")) -> None:
+    """List roles for shell completion."""
+    print_roles(prefix)
+
+
+@app.command("_list-permissions", hidden=True)
+def _list_permissions_completion(prefix: str = typer.Argument("")) -> None:
+    """List permissions for shell completion."""
+    print_permissions(prefix)
+
+
+IMPORTED = time.perf_counter()
@@ -0,0 +1,100 @@
+import os
+import sqlite3
+import sys
+from bisect import bisect_left
+from pathlib import Path
+
+from . import DB_FILE
+from .client import query_daemon
+from .connection import connect
+from .output import close_stdout_on_broken_pipe
+
+# Flat, byte-sorted files that shells can read directly or binary search with `look`
+COMPLETION_FILES: dict[str, tuple[Path, str]] = {
+    "roles": (
+        DB_FILE.parent.joinpath("roles.txt"),
+        "SELECT role FROM roles WHERE deleted IS NULL",
+    ),
+    "permissions": (
+        DB_FILE.parent.joinpath("permissions.txt"),
+        "SELECT permission FROM permission_names",
+    ),
+}
+
+
+def write_completion_cache() -> None:
+    """Writes the sorted role and permission completion files next to the database."""
+
+    conn = connect()
+
+    try:
+        for path, query in COMPLETION_FILES.values():
+            # Sorting str by code point matches the byte order `look` expects for UTF-8
+            names = sorted(row[0] for row in conn.execute(query))
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_text("".join(f"{name}\n" for name in names), encoding="utf-8")
+            os.replace(tmp_path, path)
+    finally:
+        conn.close()
+
+
+def remove_completion_cache() -> None:
+    """Deletes the completion files so shells fall back to the CLI."""
+    for path, _ in COMPLETION_FILES.values():
+        path.unlink(missing_ok=True)
+
+
+def load_names(kind: str) -> list[str]:
+    """Returns the sorted role or permission names, from the completion file if present."""
+    path, query = COMPLETION_FILES[kind]
+
+    try:
+        return path.read_text(encoding="utf-8").splitlines()
+    except FileNotFoundError:
+        if not DB_FILE.exists():
+            return []
+        conn = connect(read_only=True)
+        try:
+            return sorted(row[0] for row in conn.execute(query))
+        except sqlite3.Error:
+            # Silently fail if database doesn't exist or has issues
+            return []
+        finally:
+            conn.close()
+
+
+def match_prefix(names: list[str], prefix: str) -> list[str]:
+    """Returns the names starting with `prefix`, by binary search in the sorted list."""
+    start = bisect_left(names, prefix)
+    end = bisect_left(names, prefix + "\U0010ffff", lo=start)
+    return names[start:end]
+
+
+def _complete(kind: str, prefix: str) -> list[str]:
+    # A running daemon already holds the names in memory
+    results = query_daemon({"op": "complete", "kind": kind, "prefix": prefix})
+    if results is not None:
+        return [row[kind.removesuffix("s")] for row in results]
+    return match_prefix(load_names(kind), prefix)
+
+
+def _print_lines(lines: list[str]) -> None:
+    try:
+        sys.stdout.write("".join(f"{line}\n" for line in lines))
+        sys.stdout.flush()
+    except BrokenPipeError:
+        close_stdout_on_broken_pipe()
+
+
+def print_roles(prefix: str = "") -> None:
+    """
+    List Google IAM Roles for CLI completion
+    """
+    _print_lines(_complete("roles", prefix))
+
+
+def print_permissions(prefix: str = "") -> None:
+    """
+    List Google IAM Permissions for CLI completion
+    """
+    _print_lines(_complete("permissions", prefix))
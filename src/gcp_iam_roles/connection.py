@@ -0,0 +1,37 @@
+import sqlite3
+
+from . import DB_FILE
+
+# Per-connection settings; the WAL journal mode is persistent and set once by create_db().
+# With WAL, synchronous=NORMAL only syncs at checkpoints, so commits no longer fsync, and
+# a crash can lose the last transactions but never corrupt the database.
+PRAGMAS = (
+    ("synchronous", "NORMAL"),
+    # Negative sizes are in KiB: 32 MB of page cache
+    ("cache_size", "-32000"),
+    # Reads are served from the mapped file instead of copies in the page cache
+    ("mmap_size", str(256 * 1024 * 1024)),
+    ("temp_store", "MEMORY"),
+)
+# Seconds to wait for a writer, e.g. a sync running in another terminal, instead of failing
+BUSY_TIMEOUT = 5.0
+# Roles written per transaction by the syncs, which bounds the work lost on interruption
+BATCH_SIZE = 500
+
+
+def connect(read_only: bool = False, **kwargs: object) -> sqlite3.Connection:
+    """
+    Opens the database with the shared settings.
+
+    Read-only connections cannot write by accident and can be used while a sync runs.
+    Extra keyword arguments go to `sqlite3.connect`, e.g. `cached_statements`.
+    """
+    if read_only:
+        conn = sqlite3.connect(
+            f"{DB_FILE.as_uri()}?mode=ro", uri=True, timeout=BUSY_TIMEOUT, **kwargs
+        )
+    else:
+        conn = sqlite3.connect(DB_FILE, timeout=BUSY_TIMEOUT, **kwargs)
+    for name, value in PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
@@ -0,0 +1,321 @@
+import heapq
+import sqlite3
+import sys
+import time
+from contextlib import suppress
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+from .connection import connect
+from .output import OutputFormat, write_rows
+from .profiling import profiled, span
+
+DEFAULT_MAX_ROLES = 4
+DEFAULT_TOP = 5
+# Branch-and-bound stops exploring after this many seconds and reports the best covers found
+SEARCH_BUDGET = 0.5
+
+
+@dataclass
+class Cover:
+    roles: list[str]
+    excess: int
+
+
+@dataclass
+class CoverResult:
+    covers: list[Cover]
+    missing: list[str]
+    candidates: int
+    exhaustive: bool
+
+
+def read_permissions(values: list[str], file: Path | None = None) -> list[str]:
+    """Collects permissions from CLI values and an optional file ('-' for stdin)."""
+    lines = list(values)
+    if file is not None:
+        text = sys.stdin.read() if str(file) == "-" else file.read_text(encoding="utf-8")
+        lines.extend(text.splitlines())
+    permissions: list[str] = []
+    for line in lines:
+        content = line.split("#", 1)[0]
+        permissions.extend(token for token in content.replace(",", " ").split() if token)
+    return list(dict.fromkeys(permissions))
+
+
+def bitmask(bits: list[int], size: int) -> int:
+    """Packs bit positions below `size` into an int, which doubles as a fast bitset."""
+    bitmap = bytearray((size >> 3) + 1)
+    for bit in bits:
+        bitmap[bit >> 3] |= 1 << (bit & 7)
+    return int.from_bytes(bitmap, "little")
+
+
+def _load_index(
+    conn: sqlite3.Connection, permissions: list[str]
+) -> tuple[list[str], list[str], list[str], list[int], list[int]]:
+    """
+    Builds bitsets for every role that grants at least one requested permission.
+
+    Returns the unknown permissions, the known permissions in bit order, the candidate
+    role names, a coverage bitset per role over the requested permissions and an excess
+    bitset per role over all other permissions.
+    """
+    placeholders = ",".join("?" * len(permissions))
+    rows = conn.execute(
+        f"SELECT id, permission FROM permission_names WHERE permission IN ({placeholders})",
+        permissions,
+    ).fetchall()
+    target = {permission_id: bit for bit, (permission_id, _) in enumerate(rows)}
+    targets = [permission for _, permission in rows]
+    missing = [permission for permission in permissions if permission not in set(targets)]
+    if not target:
+        return missing, targets, [], [], []
+
+    placeholders = ",".join("?" * len(target))
+    candidate_rows = conn.execute(
+        f"""
+        SELECT DISTINCT r.id, r.role
+        FROM role_permissions rp
+        JOIN roles r ON r.id = rp.role_id
+        WHERE rp.permission_id IN ({placeholders}) AND r.deleted IS NULL
+        """,
+        list(target),
+    ).fetchall()
+    names = {role_id: role for role_id, role in candidate_rows}
+    size = conn.execute("SELECT COALESCE(MAX(id), 0) FROM permission_names").fetchone()[0] + 1
+
+    granted: dict[int, list[int]] = {role_id: [] for role_id in names}
+    placeholders = ",".join("?" * len(names))
+    for role_id, permission_id in conn.execute(
+        f"SELECT role_id, permission_id FROM role_permissions WHERE role_id IN ({placeholders})",
+        list(names),
+    ):
+        granted[role_id].append(permission_id)
+
+    roles: list[str] = []
+    coverage: list[int] = []
+    excess: list[int] = []
+    for role_id, permission_ids in granted.items():
+        roles.append(names[role_id])
+        coverage.append(
+            bitmask([target[pid] for pid in permission_ids if pid in target], len(target))
+        )
+        excess.append(bitmask([pid for pid in permission_ids if pid not in target], size))
+    return missing, targets, roles, coverage, excess
+
+
+def _prune_dominated(coverage: list[int], excess: list[int]) -> list[int]:
+    """Drops roles that another role beats on both coverage and excess grants."""
+    order = sorted(
+        range(len(coverage)), key=lambda i: (-coverage[i].bit_count(), excess[i].bit_count())
+    )
+    kept: list[int] = []
+    for i in order:
+        if not any(coverage[i] & ~coverage[k] == 0 and excess[k] & ~excess[i] == 0 for k in kept):
+            kept.append(i)
+    return kept
+
+
+def _excess(chosen: tuple[int, ...], excess: list[int]) -> int:
+    extra = 0
+    for i in chosen:
+        extra |= excess[i]
+    return extra.bit_count()
+
+
+def _greedy(
+    uncovered: int, kept: list[int], coverage: list[int], excess: list[int]
+) -> tuple[int, ...]:
+    """Weighted greedy cover: repeatedly takes the role with the most new grants per excess."""
+    chosen: tuple[int, ...] = ()
+    extra = 0
+    while uncovered:
+        i = max(
+            kept,
+            key=lambda i: (
+                (coverage[i] & uncovered).bit_count() / (1 + (excess[i] & ~extra).bit_count())
+            ),
+        )
+        if not coverage[i] & uncovered:
+            return ()
+        chosen = (*chosen, i)
+        uncovered &= ~coverage[i]
+        extra |= excess[i]
+    return chosen
+
+
+def _candidates_by_bit(
+    kept: list[int], coverage: list[int], excess: list[int], target_bits: int
+) -> list[list[int]]:
+    """Lists the roles granting each requested permission, least excess first."""
+    by_bit: list[list[int]] = [[] for _ in range(target_bits)]
+    for i in sorted(kept, key=lambda i: (excess[i].bit_count(), -coverage[i].bit_count())):
+        for bit in range(target_bits):
+            if coverage[i] >> bit & 1:
+                by_bit[bit].append(i)
+    return by_bit
+
+
+@dataclass
+class _CoverSearch:
+    """
+    Branch-and-bound over role bitsets, keeping the `top` cheapest covers.
+
+    `best` is a max-heap of (-excess, -role count, roles), so its root is the worst kept
+    cover and bounds every partial cover still explored.
+    """
+
+    by_bit: list[list[int]]
+    coverage: list[int]
+    excess: list[int]
+    max_roles: int
+    top: int
+    best: list[tuple[int, int, tuple[int, ...]]] = field(default_factory=list)
+    seen: set[frozenset[int]] = field(default_factory=set)
+    deadline: float = 0.0
+    exhaustive: bool = True
+
+    def run(self, full: int) -> None:
+        self.deadline = time.perf_counter() + SEARCH_BUDGET
+        self.search(full, (), 0)
+
+    def bound(self) -> tuple[int, int]:
+        if len(self.best) < self.top:
+            return (sys.maxsize, sys.maxsize)
+        return (-self.best[0][0], -self.best[0][1])
+
+    def keep(self, chosen: tuple[int, ...], cost: tuple[int, int]) -> None:
+        key = frozenset(chosen)
+        if key in self.seen:
+            return
+        self.seen.add(key)
+        heapq.heappush(self.best, (-cost[0], -cost[1], chosen))
+        if len(self.best) > self.top:
+            heapq.heappop(self.best)
+
+    def search(self, uncovered: int, chosen: tuple[int, ...], extra: int) -> None:
+        if time.perf_counter() > self.deadline:
+            self.exhaustive = False
+            return
+        cost = (extra.bit_count(), len(chosen))
+        if cost >= self.bound():
+            return
+        if not uncovered:
+            self.keep(chosen, cost)
+            return
+        if len(chosen) == self.max_roles:
+            return
+        # Branch on the uncovered permission with the fewest candidate roles
+        bit = min(
+            (b for b in range(len(self.by_bit)) if uncovered >> b & 1),
+            key=lambda b: len(self.by_bit[b]),
+        )
+        for i in self.by_bit[bit]:
+            self.search(uncovered & ~self.coverage[i], (*chosen, i), extra | self.excess[i])
+
+
+def solve_cover(
+    permissions: list[str], max_roles: int = DEFAULT_MAX_ROLES, top: int = DEFAULT_TOP
+) -> CoverResult:
+    """
+    Finds the role combinations that grant all permissions with the fewest extra grants.
+
+    Covers are ranked by the number of permissions they grant beyond the requested ones,
+    then by the number of roles. A branch-and-bound search over bitsets always branches on
+    the requested permission with the fewest candidate roles and prunes any partial
+    cover whose excess already exceeds the worst kept result.
+    """
+    conn = connect()
+    try:
+        missing, targets, roles, coverage, excess = _load_index(conn, permissions)
+    finally:
+        conn.close()
+
+    if not roles:
+        return CoverResult(covers=[], missing=missing, candidates=0, exhaustive=True)
+
+    kept = _prune_dominated(coverage, excess)
+    by_bit = _candidates_by_bit(kept, coverage, excess, len(targets))
+    full = (1 << len(targets)) - 1
+    # Permissions only granted by deleted roles cannot be covered
+    for bit, candidates in enumerate(by_bit):
+        if not candidates:
+            missing.append(targets[bit])
+            full &= ~(1 << bit)
+
+    state = _CoverSearch(by_bit, coverage, excess, max_roles, top)
+    state.run(full)
+    best = state.best
+    if not best:
+        # The search ran out of time before any cover; greedy still finds one quickly
+        chosen = _greedy(full, kept, coverage, excess)
+        if chosen and len(chosen) <= max_roles:
+            best.append((-_excess(chosen, excess), -len(chosen), chosen))
+
+    covers = [
+        Cover(roles=sorted(roles[i] for i in chosen), excess=-negative_excess)
+        for negative_excess, _, chosen in sorted(best, reverse=True)
+    ]
+    return CoverResult(
+        covers=covers, missing=missing, candidates=len(roles), exhaustive=state.exhaustive
+    )
+
+
+@profiled("query.cover_roles")
+def cover_roles(
+    permissions: list[str],
+    max_roles: int = DEFAULT_MAX_ROLES,
+    top: int = DEFAULT_TOP,
+    output_format: OutputFormat = OutputFormat.table,
+) -> None:
+    """Prints the smallest predefined role combinations that grant the given permissions."""
+    if not permissions:
+        console.print("[red]Error: no permissions given[/red]")
+        return
+
+    started = time.perf_counter()
+    try:
+        result = solve_cover(permissions, max_roles=max_roles, top=top)
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+        return
+    elapsed = (time.perf_counter() - started) * 1000
+
+    if result.missing:
+        Console(stderr=True).print(
+            f"[yellow]Not granted by any role: {', '.join(result.missing)}[/yellow]"
+        )
+
+    rows = [
+        (rank, " ".join(cover.roles), len(cover.roles), cover.excess)
+        for rank, cover in enumerate(result.covers, start=1)
+    ]
+    if output_format != OutputFormat.table:
+        write_rows(rows, ("rank", "roles", "role_count", "excess"), output_format)
+        return
+
+    if not rows:
+        console.print(
+            f"[yellow]No combination of up to {max_roles} roles grants all permissions[/yellow]"
+        )
+        return
+
+    table = Table(
+        caption=f"{len(permissions) - len(result.missing)} coverable permissions, "
+        f"{result.candidates} candidate roles, {elapsed:.0f} ms"
+        + ("" if result.exhaustive else ", search budget exhausted")
+    )
+    table.add_column("Rank", justify="right", style="yellow")
+    table.add_column("Roles", justify="left", max_width=80, style="blue")
+    table.add_column("Excess Permissions", justify="right", style="green")
+    for rank, roles, _, excess in rows:
+        table.add_row(str(rank), roles.replace(" ", "\n"), str(excess))
+
+    with suppress(BrokenPipeError), span("render"):
+        console.print(table)
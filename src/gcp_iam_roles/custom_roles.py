@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from rich.console import Console
+
+console = Console()
+
+from .connection import BATCH_SIZE, connect
+from .permissions import store_role_permissions
+from .profiling import commit, profiled
+from .roles import Role
+
+ROLE_FILE_SUFFIXES = (".yaml", ".yml", ".json")
+# Below this many changed files, starting worker processes costs more than it saves
+PARALLEL_MIN_FILES = 32
+
+UPSERT_CUSTOM_ROLE = """
+    INSERT INTO roles (role, title, description, stage, etag, kind, source, source_hash)
+    VALUES (?, ?, ?, ?, ?, 'custom', ?, ?)
+    ON CONFLICT (role) DO UPDATE SET
+        title = excluded.title,
+        description = excluded.description,
+        stage = excluded.stage,
+        etag = excluded.etag,
+        kind = 'custom',
+        source = excluded.source,
+        source_hash = excluded.source_hash,
+        deleted = NULL
+"""
+RECORD_FILE = """
+    INSERT INTO custom_role_files (path, digest) VALUES (?, ?)
+    ON CONFLICT (path) DO UPDATE SET digest = excluded.digest, imported = CURRENT_TIMESTAMP
+"""
+
+
+@dataclass
+class RoleFile:
+    path: str
+    digest: str
+    roles: list[Role] = field(default_factory=list)
+    error: str | None = None
+
+
+def _load_documents(path: Path, text: str) -> list[Any]:
+    if path.suffix == ".json":
+        data = json.loads(text)
+        return data if isinstance(data, list) else [data]
+    # PyYAML is only needed by --import, so other commands start without it
+    import yaml
+
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    return [document for document in yaml.load_all(text, Loader=loader) if document]
+
+
+def _to_custom_role(document: Any) -> Role:
+    if not isinstance(document, dict):
+        raise ValueError("expected a role mapping")
+    name = str(document.get("name") or "")
+    if "/roles/" not in name or name.startswith("roles/"):
+        raise ValueError(
+            f"'{name}' is not a custom role name like projects/PROJECT/roles/ROLE"
+            if name
+            else "role has no name; export it with `gcloud iam roles describe`"
+        )
+    permissions = document.get("includedPermissions") or []
+    if not isinstance(permissions, list):
+        raise ValueError(f"includedPermissions of {name} is not a list")
+    return Role(
+        name=name,
+        title=str(document.get("title") or ""),
+        description=str(document.get("description") or ""),
+        stage=str(document.get("stage") or "GA"),
+        permissions=sorted({str(permission) for permission in permissions}),
+        etag=str(document.get("etag") or ""),
+        deleted=document.get("deleted") is True,
+    )
+
+
+def parse_role_file(path: str, digest: str) -> RoleFile:
+    """Parses one role file; runs in worker processes, so errors are returned, not raised."""
+    import yaml
+
+    result = RoleFile(path=path, digest=digest)
+    try:
+        text = Path(path).read_text(encoding="utf-8")
+        result.roles = [_to_custom_role(document) for document in _load_documents(Path(path), text)]
+    except (OSError, UnicodeDecodeError, ValueError, TypeError, yaml.YAMLError) as error:
+        result.error = str(error)
+    return result
+
+
+def _digest(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def _parse_files(files: list[tuple[str, str]]) -> list[RoleFile]:
+    """Parses changed files across processes, or inline when there are only a few."""
+    if len(files) < PARALLEL_MIN_FILES:
+        return [parse_role_file(path, digest) for path, digest in files]
+    # Imported here: multiprocessing would add to the startup of every command
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = min(os.process_cpu_count() or 1, len(files) // PARALLEL_MIN_FILES + 1)
+    paths, digests = zip(*files, strict=True)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(files) // (workers * 4))
+        return list(executor.map(parse_role_file, paths, digests, chunksize=chunksize))
+
+
+def _tombstone(cursor: sqlite3.Cursor, role_names: list[str]) -> None:
+    for role_name in role_names:
+        cursor.execute("UPDATE roles SET deleted = CURRENT_TIMESTAMP WHERE role = ?", (role_name,))
+        store_role_permissions(cursor, role_name, [])
+
+
+def _store_file(
+    cursor: sqlite3.Cursor, result: RoleFile, defined: dict[str, str], stale: set[str]
+) -> int:
+    """
+    Upserts the live roles of one parsed file and records its digest.
+
+    Roles the file marks `deleted: true` are added to `stale`. Returns the number of
+    roles written.
+    """
+    imported = 0
+    for role in result.roles:
+        if role.name in defined:
+            console.print(
+                f"[yellow]{role.name} is defined in {defined[role.name]} and "
+                f"{result.path}; keeping the latter[/yellow]"
+            )
+        if role.deleted:
+            stale.add(role.name)
+            continue
+        defined[role.name] = result.path
+        row = (role.name, role.title, role.description, role.stage, role.etag)
+        cursor.execute(UPSERT_CUSTOM_ROLE, (*row, result.path, result.digest))
+        store_role_permissions(cursor, role.name, role.permissions)
+        imported += 1
+    cursor.execute(RECORD_FILE, (result.path, result.digest))
+    return imported
+
+
+@profiled("import.custom_roles")
+def import_custom_roles(directory: Path) -> bool:
+    """
+    Imports custom roles from YAML and JSON files below a directory.
+
+    Files are matched to earlier imports by their SHA-256, so only new or changed files
+    are parsed, across worker processes when there are many. Roles whose file was
+    removed, no longer defines them or marks them `deleted: true` are tombstoned. Returns
+    whether anything changed.
+    """
+    if not directory.is_dir():
+        console.print(f"[red]Not a directory: {directory}[/red]")
+        sys.exit(1)
+
+    root = directory.resolve()
+    files = sorted(
+        path for path in root.rglob("*") if path.suffix in ROLE_FILE_SUFFIXES and path.is_file()
+    )
+
+    conn = connect()
+
+    try:
+        cursor = conn.cursor()
+        # source file -> (role, content hash) of the roles it defined at the last import
+        previous: dict[str, set[tuple[str, str]]] = {}
+        live: set[str] = set()
+        for role_name, source, source_hash in cursor.execute(
+            "SELECT role, source, source_hash FROM roles WHERE kind = 'custom' AND deleted IS NULL"
+        ):
+            live.add(role_name)
+            if Path(source).is_relative_to(root):
+                previous.setdefault(source, set()).add((role_name, source_hash))
+
+        recorded = {
+            path: digest
+            for path, digest in cursor.execute("SELECT path, digest FROM custom_role_files")
+            if Path(path).is_relative_to(root)
+        }
+
+        digests = {str(path): _digest(path) for path in files}
+        changed = [
+            (path, digest) for path, digest in digests.items() if recorded.get(path) != digest
+        ]
+        console.print(
+            f"[blue]Importing custom roles from {root}: {len(files)} files, "
+            f"{len(changed)} new or changed[/blue]"
+        )
+
+        imported = failed = 0
+        defined: dict[str, str] = {}
+        # Roles of removed files, of changed files unless they still define them, and
+        # roles a file marks `deleted: true`
+        stale = {
+            role_name
+            for path, roles in previous.items()
+            if path not in digests
+            for role_name, _ in roles
+        }
+        parsed: set[str] = set()
+        for result in _parse_files(changed):
+            if result.error is not None:
+                # The roles imported before stay until the file parses again
+                console.print(f"[yellow]Skipped {result.path}: {result.error}[/yellow]")
+                failed += 1
+                continue
+            parsed.add(result.path)
+            stale.update(role_name for role_name, _ in previous.get(result.path, ()))
+            written = _store_file(cursor, result, defined, stale)
+            # Commit about every BATCH_SIZE roles, at file boundaries
+            if (imported + written) // BATCH_SIZE > imported // BATCH_SIZE:
+                commit(conn)
+            imported += written
+
+        cursor.executemany(
+            "DELETE FROM custom_role_files WHERE path = ?",
+            [(path,) for path in recorded if path not in digests],
+        )
+        # A role that moved to another file is stale only at its old source, and roles of
+        # files that are unchanged or failed to parse stay as they are
+        kept = {
+            role_name
+            for path, roles in previous.items()
+            if path in digests and path not in parsed
+            for role_name, _ in roles
+        }
+        stale = (stale - defined.keys() - kept) & live
+        _tombstone(cursor, sorted(stale))
+        commit(conn)
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+        conn.close()
+        return False
+    except KeyboardInterrupt:
+        console.print("[yellow]Operation cancelled by user[/yellow]")
+        sys.exit(130)
+
+    conn.close()
+
+    console.print(
+        f"[green]Imported {imported} custom roles, unchanged files: {len(files) - len(changed)}, "
+        f"failed files: {failed}, deleted roles: {len(stale)}[/green]"
+    )
+    return bool(imported or stale)
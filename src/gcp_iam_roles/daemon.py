@@ -0,0 +1,153 @@
+import json
+import os
+import signal
+import socket
+import socketserver
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+
+from rich.console import Console
+
+console = Console(stderr=True)
+
+from . import DB_FILE
+from .batch import BatchError, BatchSession, parse_request
+from .client import SOCKET_FILE
+from .completion import COMPLETION_FILES
+from .connection import connect
+from .snapshot import SNAPSHOT_FILE, load_snapshot
+
+# A sync rewrites these; any change to one reloads the session before the next request.
+# With WAL, committed writes land in the -wal file before they reach the database file.
+WATCHED_FILES = (
+    DB_FILE,
+    Path(f"{DB_FILE}-wal"),
+    SNAPSHOT_FILE,
+    *(path for path, _ in COMPLETION_FILES.values()),
+)
+
+
+def _signature() -> tuple[tuple[int, int] | None, ...]:
+    signature = []
+    for path in WATCHED_FILES:
+        try:
+            stat = path.stat()
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class QueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Answers batch requests from one resident session over a Unix socket.
+
+    The session keeps the snapshot mapped, the completion names in memory and its
+    statements prepared, so a request costs a socket round trip instead of a process.
+    Requests are answered one at a time; each is small next to starting the CLI.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path: Path) -> None:
+        self.lock = threading.Lock()
+        self.session: BatchSession | None = None
+        self.signature: tuple[tuple[int, int] | None, ...] = ()
+        self.reloads = 0
+        # Only the owner may connect
+        umask = os.umask(0o177)
+        try:
+            super().__init__(str(path), QueryHandler)
+        finally:
+            os.umask(umask)
+
+    def _reload(self) -> None:
+        signature = _signature()
+        if self.session is not None and signature == self.signature:
+            return
+        if self.session is not None:
+            self.session.conn.close()
+            self.reloads += 1
+        conn = connect(read_only=True, cached_statements=256, check_same_thread=False)
+        self.session = BatchSession(conn, load_snapshot())
+        self.signature = signature
+
+    def respond(self, line: str) -> dict[str, object]:
+        request: dict[str, object] = {"line": line}
+        with self.lock:
+            try:
+                self._reload()
+                request = parse_request(line)
+                return {**request, "results": self.session.answer(request)}
+            except BatchError as error:
+                return {**request, "error": str(error)}
+            except sqlite3.Error as error:
+                return {**request, "error": f"SQLite Error: {error}"}
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    """
+    Answers the request lines of one connection.
+
+    JSON requests get one JSON response line, as in `gcp-iam-roles batch`. Plain lines,
+    e.g. `complete roles compute.` from a shell, get tab-separated rows ended by
+    an empty line, or `error: ...`.
+    """
+
+    server: QueryServer
+
+    def handle(self) -> None:
+        for raw in self.rfile:
+            line = raw.decode("utf-8", errors="replace").strip()
+            if not line:
+                continue
+            response = self.server.respond(line)
+            if line.startswith("{"):
+                output = json.dumps(response) + "\n"
+            elif "error" in response:
+                output = f"error: {response['error']}\n"
+            else:
+                output = (
+                    "".join("\t".join(map(str, row.values())) + "\n" for row in response["results"])
+                    + "\n"
+                )
+            try:
+                self.wfile.write(output.encode())
+            except BrokenPipeError:
+                return
+
+
+def _is_serving(path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(path))
+        except OSError:
+            return False
+    return True
+
+
+def serve(path: Path = SOCKET_FILE) -> None:
+    """Serves queries on the socket until interrupted; the socket is removed on exit."""
+    if path.exists():
+        if _is_serving(path):
+            console.print(f"[yellow]Already serving on {path}[/yellow]")
+            sys.exit(1)
+        # Left behind by a daemon that was killed
+        path.unlink()
+
+    server = QueryServer(path)
+    # systemd and `kill` stop the daemon with SIGTERM; exit through the cleanup below
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    console.print(f"[green]Serving {DB_FILE} on {path}[/green]")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        path.unlink(missing_ok=True)
+        if server.session is not None:
+            server.session.conn.close()
+        console.print(f"[green]Stopped serving, reloaded {server.reloads} times[/green]")
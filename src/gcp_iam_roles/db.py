@@ -1,5 +1,6 @@
 import sqlite3
 import sys
+import time
 
 from rich.console import Console
 from rich.table import Table
@@ -7,36 +8,397 @@ from rich.table import Table
 console = Console()
 
 from . import DB_FILE
+from .completion import remove_completion_cache
+from .connection import connect
+from .profiling import commit, profiled, span
+from .snapshot import remove_snapshot
 
+# Bump whenever create_db() changes the schema so existing databases are upgraded once
+SCHEMA_VERSION = 9
+
+# Trigram tokens need at least three characters; shorter terms fall back to LIKE.
+FTS_MIN_TERM_LENGTH = 3
+DEFAULT_SEARCH_LIMIT = 100
+
+# FTS table -> (indexed columns, source query selecting the rowid followed by those columns)
+SEARCH_INDEXES = {
+    "roles_fts": (
+        "role, title, description",
+        "SELECT id, role, title, description FROM roles WHERE deleted IS NULL",
+    ),
+    "permissions_fts": ("permission", "SELECT id, permission FROM permission_names"),
+    "services_fts": ("service, title", "SELECT rowid, service, title FROM services"),
+}
+
+
+def _add_missing_columns(conn: sqlite3.Connection, table: str, columns: dict[str, str]) -> None:
+    """Adds columns introduced after a database was first created."""
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for column, column_type in columns.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def fts_phrase(term: str) -> str:
+    """Quotes a search term as an FTS5 phrase so it matches as a literal substring."""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def search_limit(limit: int) -> int:
+    """Converts a CLI limit into a SQLite LIMIT value, where 0 means no limit."""
+    return limit if limit > 0 else -1
+
+
+def _create_search_index(conn: sqlite3.Connection) -> None:
+    """Creates the FTS5 trigram tables and fills any that are empty."""
+    for table, (columns, source) in SEARCH_INDEXES.items():
+        conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5({columns}, tokenize='trigram')"
+        )
+        if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None:
+            conn.execute(f"INSERT INTO {table} (rowid, {columns}) {source}")
+
+
+def _create_role_indexes(conn: sqlite3.Connection) -> None:
+    """Fills the derived role, fuzzy search and service tables of databases synced before them."""
+    from .fuzzy import build_fuzzy_index
+    from .lattice import build_role_lattice
+    from .services import build_service_index
+    from .similarity import build_role_signatures
+
+    if conn.execute("SELECT 1 FROM role_permissions LIMIT 1").fetchone() is None:
+        return
+    if conn.execute("SELECT 1 FROM role_containment LIMIT 1").fetchone() is None:
+        build_role_lattice(conn)
+    if conn.execute("SELECT 1 FROM role_minhash LIMIT 1").fetchone() is None:
+        build_role_signatures(conn)
+    if conn.execute("SELECT 1 FROM fuzzy_trigrams LIMIT 1").fetchone() is None:
+        build_fuzzy_index(conn)
+    if conn.execute("SELECT 1 FROM service_prefixes LIMIT 1").fetchone() is None:
+        build_service_index(conn)
 
-def create_db() -> None:
-    """Creates a SQLite database table to store Google Cloud IAM predefined roles."""
 
-    conn = sqlite3.connect(DB_FILE)
+def rebuild_search_index() -> None:
+    """Rebuilds the FTS5 search tables from the roles, permissions and services tables."""
+
+    conn = connect()
 
     try:
+        # Drop dictionary entries no longer granted by any role
         conn.execute(
             """
-            CREATE TABLE IF NOT EXISTS roles (
-            role TEXT PRIMARY KEY,
-            title TEXT,
-            description TEXT,
-            stage TEXT,
-            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
+            DELETE FROM permission_names
+            WHERE NOT EXISTS (SELECT 1 FROM role_permissions WHERE permission_id = id)
             """
         )
+        for table, (columns, source) in SEARCH_INDEXES.items():
+            conn.execute(f"DELETE FROM {table}")
+            conn.execute(f"INSERT INTO {table} (rowid, {columns}) {source}")
+        conn.execute("INSERT INTO permissions_fts (permissions_fts) VALUES ('optimize')")
+        commit(conn)
+        console.print("[green]Rebuilt search index[/green]")
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+
+    conn.close()
+
+
+ROLES_TABLE = """
+    CREATE TABLE IF NOT EXISTS roles (
+    id INTEGER PRIMARY KEY,
+    role TEXT NOT NULL UNIQUE,
+    title TEXT,
+    description TEXT,
+    stage TEXT,
+    etag TEXT,
+    deleted TIMESTAMP,
+    created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    kind TEXT NOT NULL DEFAULT 'predefined',
+    source TEXT,
+    source_hash TEXT
+    );
+"""
+
+# Columns added to the roles table after its first release; custom roles imported from
+# files have kind 'custom' and remember their file and its SHA-256 for re-imports
+ROLE_COLUMNS = {
+    "etag": "TEXT",
+    "deleted": "TIMESTAMP",
+    "kind": "TEXT NOT NULL DEFAULT 'predefined'",
+    "source": "TEXT",
+    "source_hash": "TEXT",
+}
+
+# SHA-256 of every custom role file at its last import, also of files without live roles,
+# so unchanged files are not parsed again
+CUSTOM_ROLE_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS custom_role_files (
+    path TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    imported TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID;
+    """,
+    """
+    INSERT OR IGNORE INTO custom_role_files (path, digest)
+    SELECT DISTINCT source, source_hash FROM roles
+    WHERE kind = 'custom' AND deleted IS NULL AND source IS NOT NULL;
+    """,
+)
+
+PERMISSION_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS permission_names (
+    id INTEGER PRIMARY KEY,
+    permission TEXT NOT NULL UNIQUE
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS role_permissions (
+    role_id INTEGER NOT NULL REFERENCES roles (id),
+    permission_id INTEGER NOT NULL REFERENCES permission_names (id),
+    PRIMARY KEY (role_id, permission_id)
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS role_permissions_by_permission
+    ON role_permissions (permission_id, role_id);
+    """,
+    """
+    CREATE VIEW IF NOT EXISTS permissions (permission, role) AS
+    SELECT pn.permission, r.role
+    FROM role_permissions rp
+    JOIN roles r ON r.id = rp.role_id
+    JOIN permission_names pn ON pn.id = rp.permission_id;
+    """,
+)
+
+# Strict containment between the permission sets of live roles, rebuilt at sync time.
+# Every superset is stored, so both directions are answered by a single index range scan;
+# `direct` marks the edges of the Hasse diagram, i.e. no role lies strictly in between.
+ROLE_LATTICE_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS role_containment (
+    subset_id INTEGER NOT NULL REFERENCES roles (id),
+    superset_id INTEGER NOT NULL REFERENCES roles (id),
+    direct INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (subset_id, superset_id)
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS role_containment_by_superset
+    ON role_containment (superset_id, subset_id);
+    """,
+)
+
+# MinHash signatures (packed unsigned 64-bit bins) and their LSH band buckets, rebuilt at
+# sync time for `role --similar`
+ROLE_SIMILARITY_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS role_minhash (
+    role_id INTEGER PRIMARY KEY REFERENCES roles (id),
+    signature BLOB NOT NULL
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS role_lsh (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    role_id INTEGER NOT NULL REFERENCES roles (id),
+    PRIMARY KEY (band, bucket, role_id)
+    ) WITHOUT ROWID;
+    """,
+)
+
+# Outcome of the last GetRole call per role: 'pending' until the role of a started sync is
+# stored, then 'ok', 'empty' (no permissions) or 'failed'. Pending roles are where an
+# interrupted sync resumes; empty and failed ones are not fetched again until a TTL passes.
+SYNC_JOURNAL_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS sync_journal (
+    role TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    permissions INTEGER,
+    error TEXT,
+    etag TEXT,
+    fetched TIMESTAMP
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS sync_journal_by_status ON sync_journal (status);
+    """,
+)
+
+# Trigram -> packed ids posting lists of role and permission names for `--fuzzy` searches
+FUZZY_INDEX_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS fuzzy_trigrams (
+    kind TEXT NOT NULL,
+    trigram TEXT NOT NULL,
+    ids BLOB NOT NULL,
+    PRIMARY KEY (kind, trigram)
+    ) WITHOUT ROWID;
+    """,
+)
+
+# Permission prefix -> service mapping and its expansion to permissions and roles, rebuilt
+# at sync time for `service --permissions` and `service --roles`
+SERVICE_INDEX_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS service_prefixes (
+    prefix TEXT PRIMARY KEY,
+    service TEXT NOT NULL
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS service_permissions (
+    service TEXT NOT NULL,
+    permission_id INTEGER NOT NULL REFERENCES permission_names (id),
+    PRIMARY KEY (service, permission_id)
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS service_roles (
+    service TEXT NOT NULL,
+    role_id INTEGER NOT NULL REFERENCES roles (id),
+    permissions INTEGER NOT NULL,
+    PRIMARY KEY (service, role_id)
+    ) WITHOUT ROWID;
+    """,
+)
+# Per-service counts kept up to date with the service index
+SERVICE_COLUMNS = {
+    "permissions": "INTEGER NOT NULL DEFAULT 0",
+    "roles": "INTEGER NOT NULL DEFAULT 0",
+}
+
+# Queries used by `status` to compare the legacy and the normalized permission storage
+LATENCY_QUERIES = {
+    "role_lookup_ms": "SELECT permission FROM permissions WHERE role = ?",
+    "permission_lookup_ms": "SELECT role FROM permissions WHERE permission = ?",
+}
+
+
+def _object_type(conn: sqlite3.Connection, name: str) -> str | None:
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def _db_size(conn: sqlite3.Connection) -> int:
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def _measure_latency(conn: sqlite3.Connection, runs: int = 20) -> dict[str, float]:
+    """Times the role->permissions and permission->roles lookups through the permissions view."""
+    sample = conn.execute("SELECT role, permission FROM permissions LIMIT 1").fetchone()
+    if sample is None:
+        return {}
+    latency = {}
+    for key, query in LATENCY_QUERIES.items():
+        params = (sample[0],) if key == "role_lookup_ms" else (sample[1],)
+        started = time.perf_counter()
+        for _ in range(runs):
+            conn.execute(query, params).fetchall()
+        latency[key] = (time.perf_counter() - started) * 1000 / runs
+    return latency
+
+
+def _migrate_legacy_permissions(conn: sqlite3.Connection) -> None:
+    """
+    Converts the legacy text-keyed permissions table to the interned schema.
+
+    Permissions and roles are stored once in integer-keyed dictionaries and linked by a
+    WITHOUT ROWID join table. The size and lookup latency of the old layout are kept in
+    the meta table so `status` can compare them with the new one.
+    """
+    console.print("[blue]Migrating permissions to the normalized schema...[/blue]")
+
+    before = {"size_bytes": _db_size(conn), **_measure_latency(conn)}
+
+    _add_missing_columns(conn, "roles", ROLE_COLUMNS)
+    conn.execute("ALTER TABLE permissions RENAME TO legacy_permissions")
+    if "id" not in {row[1] for row in conn.execute("PRAGMA table_info(roles)")}:
+        conn.execute("ALTER TABLE roles RENAME TO legacy_roles")
+        conn.execute(ROLES_TABLE)
         conn.execute(
             """
-            CREATE TABLE IF NOT EXISTS permissions (
-            permission TEXT,
-            role TEXT,
-            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (role) REFERENCES roles (role),
-            UNIQUE (permission, role)
-            );
+            INSERT INTO roles (role, title, description, stage, etag, deleted, created)
+            SELECT role, title, description, stage, etag, deleted, created
+            FROM legacy_roles ORDER BY role
             """
         )
+        conn.execute("DROP TABLE legacy_roles")
+    for statement in PERMISSION_TABLES:
+        conn.execute(statement)
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO permission_names (permission)
+        SELECT DISTINCT permission FROM legacy_permissions ORDER BY permission
+        """
+    )
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO role_permissions (role_id, permission_id)
+        SELECT r.id, pn.id
+        FROM legacy_permissions lp
+        JOIN roles r ON r.role = lp.role
+        JOIN permission_names pn ON pn.permission = lp.permission
+        """
+    )
+    conn.execute("DROP TABLE legacy_permissions")
+    # The permission search index is keyed by permission id and is refilled on creation
+    conn.execute("DROP TABLE IF EXISTS permissions_fts")
+    conn.commit()
+    conn.execute("VACUUM")
+
+    after = {"size_bytes": _db_size(conn), **_measure_latency(conn)}
+    conn.executemany(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+        [(f"legacy_{key}", value) for key, value in before.items()]
+        + [(f"migrated_{key}", value) for key, value in after.items()],
+    )
+
+    console.print(
+        f"[green]Migrated permissions: {before['size_bytes'] / 1e6:.1f} MB -> "
+        f"{after['size_bytes'] / 1e6:.1f} MB[/green]"
+    )
+
+
+@profiled("db.create")
+def create_db() -> None:
+    """
+    Creates the SQLite database tables to store Google Cloud IAM predefined roles.
+
+    The schema is created or upgraded only when PRAGMA user_version is behind
+    SCHEMA_VERSION, so up-to-date databases cost a single pragma read.
+    """
+
+    conn = connect()
+
+    if conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+        conn.close()
+        return
+
+    try:
+        # Persistent, so every later connection uses the write-ahead log
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);")
+        if _object_type(conn, "permissions") == "table":
+            _migrate_legacy_permissions(conn)
+        conn.execute(ROLES_TABLE)
+        _add_missing_columns(conn, "roles", ROLE_COLUMNS)
+        for statement in (
+            PERMISSION_TABLES
+            + ROLE_LATTICE_TABLES
+            + ROLE_SIMILARITY_TABLES
+            + FUZZY_INDEX_TABLES
+            + SYNC_JOURNAL_TABLES
+            + CUSTOM_ROLE_TABLES
+            + SERVICE_INDEX_TABLES
+        ):
+            conn.execute(statement)
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS services (
@@ -46,7 +408,11 @@ def create_db() -> None:
             );
             """
         )
+        _add_missing_columns(conn, "services", SERVICE_COLUMNS)
+        _create_search_index(conn)
+        _create_role_indexes(conn)
         conn.commit()
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     except sqlite3.OperationalError as error:
         console.print(f"[red]Error creating table: {error}[/red]")
 
@@ -61,12 +427,29 @@ def clear_db() -> None:
         print("Aborting...")
         sys.exit(0)
 
-    conn = sqlite3.connect(DB_FILE)
+    conn = connect()
     try:
-        conn.execute("DROP TABLE IF EXISTS permissions;")
+        for table in SEARCH_INDEXES:
+            conn.execute(f"DROP TABLE IF EXISTS {table};")
+        conn.execute("DROP VIEW IF EXISTS permissions;")
+        conn.execute("DROP TABLE IF EXISTS role_containment;")
+        conn.execute("DROP TABLE IF EXISTS role_minhash;")
+        conn.execute("DROP TABLE IF EXISTS role_lsh;")
+        conn.execute("DROP TABLE IF EXISTS fuzzy_trigrams;")
+        conn.execute("DROP TABLE IF EXISTS sync_journal;")
+        conn.execute("DROP TABLE IF EXISTS custom_role_files;")
+        conn.execute("DROP TABLE IF EXISTS service_prefixes;")
+        conn.execute("DROP TABLE IF EXISTS service_permissions;")
+        conn.execute("DROP TABLE IF EXISTS service_roles;")
+        conn.execute("DROP TABLE IF EXISTS role_permissions;")
+        conn.execute("DROP TABLE IF EXISTS permission_names;")
         conn.execute("DROP TABLE IF EXISTS roles;")
         conn.execute("DROP TABLE IF EXISTS services;")
+        conn.execute("DROP TABLE IF EXISTS meta;")
         conn.commit()
+        conn.execute("PRAGMA user_version = 0")
+        remove_completion_cache()
+        remove_snapshot()
         console.print("[green]Dropped tables: roles, permissions, services[/green]")
     except sqlite3.OperationalError as error:
         console.print(f"[red]SQLite Error: {error}[/red]")
@@ -74,26 +457,69 @@ def clear_db() -> None:
     conn.close()
 
 
+def _storage_table(conn: sqlite3.Connection) -> Table:
+    """Builds a table comparing the storage and lookup latency before and after normalization."""
+    meta = dict(conn.execute("SELECT key, value FROM meta"))
+    current = {"size_bytes": _db_size(conn), **_measure_latency(conn)}
+
+    def size(value: float | None) -> str:
+        return f"{value / 1e6:.2f} MB" if value is not None else "-"
+
+    def latency(value: float | None) -> str:
+        return f"{value:.3f} ms" if value is not None else "-"
+
+    table = Table(title="[bold blue]Permission Storage[/bold blue]")
+    table.add_column("Metric", justify="left", style="blue")
+    table.add_column("Legacy", justify="right", style="yellow")
+    table.add_column("Normalized", justify="right", style="green")
+    table.add_column("Current", justify="right", style="green")
+    for key, label, formatter in (
+        ("size_bytes", "DB size", size),
+        ("role_lookup_ms", "Role -> permissions", latency),
+        ("permission_lookup_ms", "Permission -> roles", latency),
+    ):
+        table.add_row(
+            label,
+            formatter(meta.get(f"legacy_{key}")),
+            formatter(meta.get(f"migrated_{key}")),
+            formatter(current.get(key)),
+        )
+    return table
+
+
+@profiled("query.status")
 def status_db() -> None:
     """Prints the number of roles and permissions in the SQLite database table."""
 
-    conn = sqlite3.connect(DB_FILE)
+    conn = connect()
 
     try:
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(role) FROM roles;")
+        cursor.execute("SELECT COUNT(role) FROM roles WHERE deleted IS NULL;")
         roles = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(DISTINCT permission) FROM permissions;")
+        cursor.execute("SELECT COUNT(role) FROM roles WHERE deleted IS NULL AND kind = 'custom';")
+        custom_roles = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(role) FROM roles WHERE deleted IS NOT NULL;")
+        deleted_roles = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(DISTINCT permission_id) FROM role_permissions;")
         permissions = cursor.fetchone()[0]
         cursor.execute("SELECT COUNT(DISTINCT service) FROM services;")
         services = cursor.fetchone()[0]
+        journal = dict(cursor.execute("SELECT status, COUNT(*) FROM sync_journal GROUP BY status"))
         table_count = Table(title="[bold blue]Database Status[/bold blue]")
         table_count.add_column("Type", justify="left", style="blue")
         table_count.add_column("Count", justify="right", style="green")
         table_count.add_row("GCP IAM Roles", str(roles))
+        table_count.add_row("GCP IAM Roles (custom)", str(custom_roles))
+        table_count.add_row("GCP IAM Roles (deleted)", str(deleted_roles))
         table_count.add_row("GCP IAM Permissions", str(permissions))
         table_count.add_row("GCP Services", str(services))
-        console.print(table_count)
+        table_count.add_row("Sync journal (pending)", str(journal.get("pending", 0)))
+        table_count.add_row("Sync journal (empty)", str(journal.get("empty", 0)))
+        table_count.add_row("Sync journal (failed)", str(journal.get("failed", 0)))
+        with span("render"):
+            console.print(table_count)
+        console.print(_storage_table(conn))
     except sqlite3.Error as error:
         console.print(f"[red]SQLite Error: {error}[/red]")
 
@@ -0,0 +1,201 @@
+import sqlite3
+from array import array
+from collections import Counter
+from contextlib import suppress
+
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+from .client import daemon_rows
+from .connection import connect
+from .db import DEFAULT_SEARCH_LIMIT, FTS_MIN_TERM_LENGTH
+from .output import OutputFormat, write_rows
+from .profiling import commit, count, profiled, span
+
+# Candidates ranked by shared trigrams that are re-scored with the edit distance, which
+# also bounds the number of results
+FUZZY_CANDIDATES = 50
+# Results scoring below this are noise: a trigram or two shared by chance
+FUZZY_MIN_SCORE = 0.5
+
+# kind -> (source query selecting the id followed by the searched texts, result columns)
+FUZZY_SOURCES = {
+    "roles": (
+        "SELECT id, role, title FROM roles WHERE deleted IS NULL ORDER BY id",
+        ("role", "title", "score"),
+    ),
+    "permissions": (
+        "SELECT id, permission FROM permission_names ORDER BY id",
+        ("permission", "score"),
+    ),
+}
+FUZZY_NAMES = {
+    "roles": "SELECT id, role, title FROM roles WHERE id IN (SELECT value FROM json_each(?))",
+    "permissions": (
+        "SELECT id, permission FROM permission_names WHERE id IN (SELECT value FROM json_each(?))"
+    ),
+}
+
+
+def trigrams(text: str) -> set[str]:
+    return {text[index : index + 3] for index in range(len(text) - 2)}
+
+
+def substring_distance(pattern: str, text: str) -> int:
+    """
+    Returns the fewest edits turning `pattern` into some substring of `text`.
+
+    Uses Myers' bit-parallel algorithm, where one int holds a column of the edit distance
+    matrix, so each character of `text` costs a few int operations instead of a row of
+    `len(pattern)` cells. Leading and trailing text is free, so `vertx` is one edit from
+    `vertex ai user`.
+    """
+    if not pattern:
+        return 0
+    peq: dict[str, int] = {}
+    for index, char in enumerate(pattern):
+        peq[char] = peq.get(char, 0) | 1 << index
+    mask = (1 << len(pattern)) - 1
+    high = 1 << (len(pattern) - 1)
+    positive, negative = mask, 0
+    score = best = len(pattern)
+    for char in text:
+        eq = peq.get(char, 0)
+        xv = eq | negative
+        xh = (((eq & positive) + positive) ^ positive) | eq
+        horizontal_positive = negative | ~(xh | positive) & mask
+        horizontal_negative = positive & xh
+        if horizontal_positive & high:
+            score += 1
+        elif horizontal_negative & high:
+            score -= 1
+        # Unlike a full distance, the first row stays 0: a match may start anywhere
+        horizontal_positive = horizontal_positive << 1 & mask
+        horizontal_negative = horizontal_negative << 1 & mask
+        positive = horizontal_negative | ~(xv | horizontal_positive) & mask
+        negative = horizontal_positive & xv
+        best = min(best, score)
+    return best
+
+
+def build_fuzzy_index(conn: sqlite3.Connection) -> int:
+    """
+    Replaces the trigram posting lists of role and permission names.
+
+    Each (kind, trigram) row holds the sorted ids containing the trigram as a packed
+    array, so a search reads one row per trigram of its term. Returns the row count.
+    """
+    rows: list[tuple[str, str, bytes]] = []
+    for kind, (source, _) in FUZZY_SOURCES.items():
+        postings: dict[str, array] = {}
+        for row_id, *texts in conn.execute(source):
+            grams = set().union(*(trigrams((text or "").lower()) for text in texts))
+            for gram in grams:
+                postings.setdefault(gram, array("I")).append(row_id)
+        rows.extend((kind, gram, ids.tobytes()) for gram, ids in postings.items())
+
+    conn.execute("DELETE FROM fuzzy_trigrams")
+    conn.executemany("INSERT INTO fuzzy_trigrams (kind, trigram, ids) VALUES (?, ?, ?)", rows)
+    return len(rows)
+
+
+def rebuild_fuzzy_index() -> None:
+    """Rebuilds the trigram posting lists used by `--search TERM --fuzzy`."""
+
+    conn = connect()
+
+    try:
+        grams = build_fuzzy_index(conn)
+        commit(conn)
+        console.print(f"[green]Rebuilt fuzzy search index ({grams} trigram postings)[/green]")
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+
+    conn.close()
+
+
+def query_fuzzy(conn: sqlite3.Connection, kind: str, term: str, limit: int) -> list[tuple]:
+    """
+    Returns the names closest to `term` with their scores, best first.
+
+    Candidates are the ids sharing most trigrams with the term, counted from its posting
+    lists. Only those are scored, by the share of the term's trigrams they contain and
+    by their edit distance to the term, each between 0 and 1.
+    """
+    needle = term.lower()
+    if kind == "roles":
+        # Predefined roles are stored without their 'roles/' prefix
+        needle = needle.removeprefix("roles/")
+    grams = trigrams(needle)
+    if not grams:
+        return []
+
+    placeholders = ",".join("?" * len(grams))
+    shared: Counter[int] = Counter()
+    for (blob,) in conn.execute(
+        f"SELECT ids FROM fuzzy_trigrams WHERE kind = ? AND trigram IN ({placeholders})",
+        (kind, *grams),
+    ):
+        ids = array("I")
+        ids.frombytes(blob)
+        shared.update(ids)
+    candidates = dict(shared.most_common(FUZZY_CANDIDATES))
+    count("fuzzy.candidates", len(candidates))
+
+    scored = []
+    for row_id, *texts in conn.execute(FUZZY_NAMES[kind], (str(list(candidates)),)):
+        distance = min(substring_distance(needle, (text or "").lower()) for text in texts)
+        score = (candidates[row_id] / len(grams) + 1 - distance / len(needle)) / 2
+        if score >= FUZZY_MIN_SCORE:
+            scored.append((round(score, 3), *texts))
+    # Best score first, then the shortest name: the closest to the term, not a longer one
+    scored.sort(key=lambda row: (-row[0], len(row[1]), row[1]))
+    if limit > 0:
+        scored = scored[:limit]
+    return [(*texts, score) for score, *texts in scored]
+
+
+@profiled("query.fuzzy")
+def search_fuzzy(
+    kind: str,
+    term: str,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    output_format: OutputFormat = OutputFormat.table,
+) -> None:
+    """Searches role or permission names tolerating typos, ranked by similarity."""
+    if len(term) < FTS_MIN_TERM_LENGTH:
+        console.print(
+            f"[yellow]Fuzzy search needs at least {FTS_MIN_TERM_LENGTH} characters[/yellow]"
+        )
+        return
+
+    _, columns = FUZZY_SOURCES[kind]
+    rows = daemon_rows({"op": "fuzzy", "kind": kind, "term": term, "limit": limit}, columns)
+    if rows is None:
+        conn = connect(read_only=True)
+        try:
+            rows = query_fuzzy(conn, kind, term, limit)
+        except sqlite3.Error as error:
+            console.print(f"[red]SQLite Error: {error}[/red]")
+            conn.close()
+            return
+        conn.close()
+
+    if output_format != OutputFormat.table:
+        write_rows(rows, columns, output_format)
+        return
+    if not rows:
+        console.print(f"[yellow]No {kind} similar to: {term}[/yellow]")
+        return
+
+    table = Table()
+    for column, style in zip(columns, ("blue", "green", "magenta"), strict=False):
+        justify = "right" if column == "score" else "left"
+        table.add_column(column.capitalize(), justify=justify, max_width=80, style=style)
+    for row in rows:
+        table.add_row(*(str(value) for value in row))
+
+    with suppress(BrokenPipeError), span("render"):
+        console.print(table)
@@ -0,0 +1,33 @@
+from rich.console import Console
+
+console = Console()
+
+from .completion import write_completion_cache
+from .db import rebuild_search_index
+from .fuzzy import rebuild_fuzzy_index
+from .lattice import rebuild_role_lattice
+from .profiling import profiled, span
+from .services import rebuild_service_index
+from .similarity import rebuild_role_signatures
+from .snapshot import write_snapshot
+
+
+@profiled("index")
+def rebuild_indexes() -> None:
+    """Rebuilds every structure derived from the roles, permissions and services tables."""
+    with span("search"):
+        rebuild_search_index()
+    with span("fuzzy"):
+        rebuild_fuzzy_index()
+    with span("lattice"):
+        rebuild_role_lattice()
+    with span("signatures"):
+        rebuild_role_signatures()
+    with span("services"):
+        rebuild_service_index()
+    with span("completion"):
+        write_completion_cache()
+    console.print("[green]Wrote shell completion cache[/green]")
+    with span("snapshot"):
+        write_snapshot()
+    console.print("[green]Wrote query snapshot[/green]")
@@ -0,0 +1,83 @@
+import sqlite3
+
+# Seconds before a role that had no permissions is fetched again; a changed etag in the
+# role listing refetches it sooner
+EMPTY_TTL = 7 * 24 * 3600
+# Seconds before a failed role is retried by a new sync; `--resume` retries it right away
+FAILED_TTL = 3600
+
+RECORD = """
+    INSERT INTO sync_journal (role, status, permissions, error, etag, fetched)
+    VALUES (?, ?, ?, ?, (SELECT etag FROM roles WHERE role = ?), CURRENT_TIMESTAMP)
+    ON CONFLICT (role) DO UPDATE SET
+        status = excluded.status,
+        permissions = excluded.permissions,
+        error = excluded.error,
+        etag = excluded.etag,
+        fetched = excluded.fetched
+"""
+
+
+def start_sync(cursor: sqlite3.Cursor) -> tuple[list[str], int]:
+    """
+    Marks the roles a per-role sync has to fetch as pending and returns them.
+
+    These are the live predefined roles without permissions, minus those cached as empty
+    or failed within their TTL, plus any still pending from an interrupted sync. Returns
+    the pending roles and the number skipped by the cache.
+    """
+    rows = cursor.execute(
+        """
+        SELECT r.role, j.status,
+            CASE j.status
+                WHEN 'empty' THEN j.etag IS r.etag AND j.fetched > datetime('now', ?)
+                WHEN 'failed' THEN j.fetched > datetime('now', ?)
+                ELSE 0
+            END
+        FROM roles r
+        LEFT JOIN sync_journal j ON j.role = r.role
+        WHERE r.deleted IS NULL AND r.kind = 'predefined'
+        AND (
+            j.status = 'pending'
+            OR NOT EXISTS (SELECT 1 FROM role_permissions rp WHERE rp.role_id = r.id)
+        )
+        ORDER BY r.role
+        """,
+        (f"-{EMPTY_TTL} seconds", f"-{FAILED_TTL} seconds"),
+    ).fetchall()
+    pending = [role_name for role_name, _, cached in rows if not cached]
+    cursor.executemany(
+        """
+        INSERT INTO sync_journal (role, status) VALUES (?, 'pending')
+        ON CONFLICT (role) DO UPDATE SET status = 'pending'
+        """,
+        [(role_name,) for role_name in pending],
+    )
+    return pending, len(rows) - len(pending)
+
+
+def resume_sync(cursor: sqlite3.Cursor) -> list[str]:
+    """Returns the roles an interrupted or partially failed sync has left, failed ones included."""
+    cursor.execute(
+        """
+        SELECT j.role
+        FROM sync_journal j
+        JOIN roles r ON r.role = j.role
+        WHERE j.status IN ('pending', 'failed') AND r.deleted IS NULL
+        ORDER BY j.role
+        """
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def record_fetch(
+    cursor: sqlite3.Cursor, role_name: str, permissions: int | None, error: str | None = None
+) -> None:
+    """
+    Records the outcome of one GetRole call.
+
+    Write it after the role's permissions, in the same transaction, so a role whose
+    permissions were only partly stored is still pending.
+    """
+    status = "failed" if error is not None else ("ok" if permissions else "empty")
+    cursor.execute(RECORD, (role_name, status, permissions, error, role_name))
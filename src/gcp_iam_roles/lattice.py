@@ -0,0 +1,213 @@
+import json
+import sqlite3
+from contextlib import suppress
+
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+from .connection import connect
+from .cover import bitmask
+from .output import OutputFormat, write_rows
+from .profiling import commit, profiled, span
+
+LATTICE_COLUMNS = ("role", "title", "permissions", "direct")
+
+
+def _containment_edges(granted: dict[int, list[int]], size: int) -> list[tuple[int, int, int]]:
+    """
+    Computes every strict subset relation between the given permission sets.
+
+    Each role's set is packed into an int bitset. Superset candidates for a role are only
+    the roles that grant its rarest permission, so most of the n² pairs are never compared.
+    Returns (subset_id, superset_id, direct) rows.
+    """
+    bits = {role_id: bitmask(permission_ids, size) for role_id, permission_ids in granted.items()}
+    counts = {role_id: len(permission_ids) for role_id, permission_ids in granted.items()}
+    postings: dict[int, list[int]] = {}
+    for role_id, permission_ids in granted.items():
+        for permission_id in permission_ids:
+            postings.setdefault(permission_id, []).append(role_id)
+
+    supersets: dict[int, set[int]] = {}
+    for role_id, permission_ids in granted.items():
+        rarest = min(permission_ids, key=lambda permission_id: len(postings[permission_id]))
+        role_bits = bits[role_id]
+        supersets[role_id] = {
+            other
+            for other in postings[rarest]
+            if counts[other] > counts[role_id] and role_bits & ~bits[other] == 0
+        }
+
+    edges: list[tuple[int, int, int]] = []
+    for role_id, above in supersets.items():
+        # A superset is direct unless it also contains one of the role's other supersets
+        indirect: set[int] = set()
+        for other in above:
+            indirect |= supersets[other]
+        edges.extend((role_id, other, int(other not in indirect)) for other in above)
+    return edges
+
+
+def build_role_lattice(conn: sqlite3.Connection) -> int:
+    """Replaces the role containment table from role_permissions and returns the edge count."""
+    granted: dict[int, list[int]] = {}
+    for role_id, permission_id in conn.execute(
+        """
+        SELECT rp.role_id, rp.permission_id
+        FROM role_permissions rp
+        JOIN roles r ON r.id = rp.role_id
+        WHERE r.deleted IS NULL
+        """
+    ):
+        granted.setdefault(role_id, []).append(permission_id)
+    size = conn.execute("SELECT COALESCE(MAX(id), 0) FROM permission_names").fetchone()[0] + 1
+
+    edges = _containment_edges(granted, size)
+    conn.execute("DELETE FROM role_containment")
+    conn.executemany(
+        "INSERT INTO role_containment (subset_id, superset_id, direct) VALUES (?, ?, ?)", edges
+    )
+    return len(edges)
+
+
+def rebuild_role_lattice() -> None:
+    """Rebuilds the role containment graph used by `role --supersets` and `role --subsets`."""
+
+    conn = connect()
+
+    try:
+        edges = build_role_lattice(conn)
+        commit(conn)
+        console.print(f"[green]Rebuilt role containment graph ({edges} edges)[/green]")
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+
+    conn.close()
+
+
+def _role_ids(cursor: sqlite3.Cursor, role_names: list[str]) -> dict[str, int] | None:
+    placeholders = ",".join("?" * len(role_names))
+    cursor.execute(
+        f"SELECT role, id FROM roles WHERE role IN ({placeholders}) AND deleted IS NULL",
+        role_names,
+    )
+    ids = dict(cursor.fetchall())
+    unknown = [role for role in role_names if role not in ids]
+    if unknown:
+        console.print(f"[red]Role '{', '.join(unknown)}' not found in database[/red]")
+        return None
+    return ids
+
+
+def _print_related(
+    cursor: sqlite3.Cursor, related: dict[int, bool], title: str, output_format: OutputFormat
+) -> None:
+    """Prints related roles, ordered from the closest to the farthest by permission count."""
+    cursor.execute(
+        """
+        SELECT r.id, r.role, r.title, COUNT(rp.permission_id)
+        FROM roles r
+        LEFT JOIN role_permissions rp ON rp.role_id = r.id
+        WHERE r.id IN (SELECT value FROM json_each(?))
+        GROUP BY r.id
+        """,
+        (json.dumps(list(related)),),
+    )
+    rows = [
+        (role, role_title, count, related[role_id])
+        for role_id, role, role_title, count in cursor.fetchall()
+    ]
+    rows.sort(key=lambda row: (not row[3], row[2], row[0]))
+
+    if output_format != OutputFormat.table:
+        write_rows(rows, LATTICE_COLUMNS, output_format)
+        return
+
+    table = Table(title=title)
+    table.add_column("Role", justify="left", max_width=80, style="blue")
+    table.add_column("Title", justify="left", max_width=80, style="green")
+    table.add_column("Permissions", justify="right", style="yellow")
+    table.add_column("Direct", justify="center", style="cyan")
+    for role, role_title, count, direct in rows:
+        table.add_row(role, str(role_title), str(count), "✓" if direct else "")
+    with suppress(BrokenPipeError), span("render"):
+        console.print(table)
+
+
+def _common_supersets(cursor: sqlite3.Cursor, role_ids: list[int]) -> dict[int, bool]:
+    """
+    Returns the roles containing all given roles, a given role included, mapped to
+    whether they are minimal: no other common superset lies strictly below them.
+    """
+    common: set[int] | None = None
+    for role_id in role_ids:
+        cursor.execute("SELECT superset_id FROM role_containment WHERE subset_id = ?", (role_id,))
+        above = {row[0] for row in cursor.fetchall()} | {role_id}
+        common = above if common is None else common & above
+    cursor.execute(
+        """
+        SELECT DISTINCT superset_id
+        FROM role_containment
+        WHERE superset_id IN (SELECT value FROM json_each(?1))
+        AND subset_id IN (SELECT value FROM json_each(?1))
+        """,
+        (json.dumps(sorted(common)),),
+    )
+    above_others = {row[0] for row in cursor.fetchall()}
+    return {role_id: role_id not in above_others for role_id in common}
+
+
+@profiled("query.role_supersets")
+def role_supersets(role_names: list[str], output_format: OutputFormat = OutputFormat.table) -> None:
+    """
+    Prints the roles that grant every permission of all given roles.
+
+    With several roles, a given role that already contains the others counts as a
+    candidate, and the minimal common supersets are marked as direct.
+    """
+    conn = connect()
+
+    try:
+        cursor = conn.cursor()
+        ids = _role_ids(cursor, role_names)
+        if ids is None:
+            conn.close()
+            return
+        if len(ids) == 1:
+            cursor.execute(
+                "SELECT superset_id, direct FROM role_containment WHERE subset_id = ?",
+                (next(iter(ids.values())),),
+            )
+            related = {role_id: bool(direct) for role_id, direct in cursor.fetchall()}
+        else:
+            related = _common_supersets(cursor, list(ids.values()))
+        _print_related(cursor, related, f"Supersets of {', '.join(role_names)}", output_format)
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+
+    conn.close()
+
+
+@profiled("query.role_subsets")
+def role_subsets(role_name: str, output_format: OutputFormat = OutputFormat.table) -> None:
+    """Prints the roles whose permissions are all granted by the given role."""
+    conn = connect()
+
+    try:
+        cursor = conn.cursor()
+        ids = _role_ids(cursor, [role_name])
+        if ids is None:
+            conn.close()
+            return
+        cursor.execute(
+            "SELECT subset_id, direct FROM role_containment WHERE superset_id = ?",
+            (ids[role_name],),
+        )
+        related = {role_id: bool(direct) for role_id, direct in cursor.fetchall()}
+        _print_related(cursor, related, f"Subsets of {role_name}", output_format)
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+
+    conn.close()
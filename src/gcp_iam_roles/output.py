@@ -0,0 +1,62 @@
+import csv
+import json
+import os
+import sys
+from collections.abc import Iterable, Sequence
+from enum import Enum
+
+from .profiling import profiled
+
+
+class OutputFormat(str, Enum):
+    """Output formats for query commands."""
+
+    table = "table"
+    tsv = "tsv"
+    jsonl = "jsonl"
+    csv = "csv"
+
+
+def close_stdout_on_broken_pipe() -> None:
+    """Points stdout at /dev/null after the reader went away so the final flush stays quiet."""
+    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+def _tsv_field(value: object) -> str:
+    return str(value).replace("\t", " ").replace("\n", " ")
+
+
+@profiled("render")
+def write_rows(
+    rows: Iterable[Sequence[object]], columns: Sequence[str], output_format: OutputFormat
+) -> int:
+    """
+    Streams rows to stdout in a machine-readable format and returns the number written.
+
+    Rows are written as they are read from the iterable, typically a SQLite cursor, so
+    memory use does not grow with the result size. Output stops quietly when the reader
+    closes the pipe (e.g. `| head`). Under --profile the `render` span includes reading
+    the rows, since streaming interleaves it with writing them.
+    """
+    out = sys.stdout
+    count = 0
+    try:
+        if output_format == OutputFormat.jsonl:
+            for row in rows:
+                out.write(json.dumps(dict(zip(columns, row, strict=True))) + "\n")
+                count += 1
+        elif output_format == OutputFormat.csv:
+            writer = csv.writer(out, lineterminator="\n")
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            out.write("\t".join(columns) + "\n")
+            for row in rows:
+                out.write("\t".join(_tsv_field(value) for value in row) + "\n")
+                count += 1
+        out.flush()
+    except BrokenPipeError:
+        close_stdout_on_broken_pipe()
+    return count
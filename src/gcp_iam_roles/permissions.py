@@ -1,14 +1,33 @@
 import sqlite3
 import sys
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
+from typing import TYPE_CHECKING
 
-from google.cloud import iam_admin_v1
 from rich.console import Console
 from rich.table import Table
+from rich.tree import Tree
+
+if TYPE_CHECKING:
+    from google.cloud import iam_admin_v1
 
 console = Console()
 
-from . import DB_FILE
+from .auth import iam_client
+from .client import daemon_rows
+from .connection import BATCH_SIZE, connect
+from .db import DEFAULT_SEARCH_LIMIT, FTS_MIN_TERM_LENGTH, fts_phrase, search_limit
+from .journal import record_fetch, resume_sync, start_sync
+from .output import OutputFormat, write_rows
+from .profiling import call_api, commit, profiled, span
+from .ratelimit import AdaptiveBackoff, TokenBucket
+from .snapshot import load_snapshot
+from .trie import PermissionTrie, build_trie
+
+# IAM API read quota is per project; stay well below it by default.
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RATE = 20.0
 
 
 @dataclass
@@ -17,13 +36,19 @@ class RolePermissions:
     permissions: list[str]
 
 
-def get_permissions(role_name: str) -> RolePermissions | None:
+def get_permissions(
+    role_name: str, client: "iam_admin_v1.IAMClient | None" = None
+) -> RolePermissions | None:
     """Retrieves a list of all permissions associated with a given IAM role."""
+    from google.cloud import iam_admin_v1
 
     console.print(f"[blue]Getting permissions for role: {role_name}[/blue]")
 
-    client = iam_admin_v1.IAMClient()
-    role = client.get_role(request=iam_admin_v1.GetRoleRequest(name=role_name))
+    if client is None:
+        client = iam_client()
+    role = call_api(
+        "get_role", client.get_role, request=iam_admin_v1.GetRoleRequest(name=role_name)
+    )
 
     role_permissions = RolePermissions(role=role.name, permissions=list(role.included_permissions))
 
@@ -37,72 +62,258 @@ def get_permissions(role_name: str) -> RolePermissions | None:
         return None
 
 
-def sync_permissions() -> None:
-    """Inserts a list of Google Cloud IAM predefined roles into a SQLite database table."""
+def fetch_permissions(
+    role_names: list[str],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    rate: float = DEFAULT_RATE,
+    on_error: Callable[[str, str], None] | None = None,
+) -> Iterator[tuple[str, RolePermissions | None]]:
+    """
+    Fetches permissions for many roles concurrently.
+
+    All workers share one pooled IAM client, a token bucket that caps the request rate
+    and one backoff, so a quota error slows every worker down. Results are yielded in
+    completion order to the calling thread, which stays the only SQLite writer. Roles
+    whose fetch fails for any reason are reported and skipped; `on_error` is called with
+    the role and the error, also in the calling thread.
+    """
+    client = iam_client()
+    bucket = TokenBucket(rate=rate, capacity=concurrency)
+    backoff = AdaptiveBackoff()
+
+    def fetch(role_name: str) -> RolePermissions | None:
+        def call() -> RolePermissions | None:
+            bucket.acquire()
+            # Add 'roles/' prefix for API call
+            return get_permissions(f"roles/{role_name}", client)
+
+        return backoff.call(call)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    try:
+        futures = {executor.submit(fetch, role_name): role_name for role_name in role_names}
+        for future in as_completed(futures):
+            role_name = futures[future]
+            try:
+                yield role_name, future.result()
+            except Exception as error:
+                # A malformed response must not abort the other fetches
+                console.print(f"[red]Error getting permissions for role {role_name}: {error}[/red]")
+                if on_error is not None:
+                    on_error(role_name, str(error))
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def store_role_permissions(
+    cursor: sqlite3.Cursor, role_name: str, permissions: list[str]
+) -> tuple[int, int]:
+    """Makes the stored permissions of a role match the given list and returns (added, removed)."""
+    row = cursor.execute("SELECT id FROM roles WHERE role = ?", (role_name,)).fetchone()
+    if row is None:
+        return 0, 0
+    role_id = row[0]
+    cursor.execute(
+        """
+        SELECT pn.permission
+        FROM role_permissions rp
+        JOIN permission_names pn ON pn.id = rp.permission_id
+        WHERE rp.role_id = ?
+        """,
+        (role_id,),
+    )
+    current = {row[0] for row in cursor.fetchall()}
+    wanted = set(permissions)
+    added = wanted - current
+    removed = current - wanted
+    if removed:
+        cursor.executemany(
+            """
+            DELETE FROM role_permissions
+            WHERE role_id = ?
+            AND permission_id = (SELECT id FROM permission_names WHERE permission = ?)
+            """,
+            [(role_id, permission) for permission in removed],
+        )
+    if added:
+        cursor.executemany(
+            "INSERT INTO permission_names (permission) VALUES (?) ON CONFLICT DO NOTHING",
+            [(permission,) for permission in added],
+        )
+        cursor.executemany(
+            """
+            INSERT INTO role_permissions (role_id, permission_id)
+            SELECT ?, id FROM permission_names WHERE permission = ?
+            """,
+            [(role_id, permission) for permission in added],
+        )
+    return len(added), len(removed)
+
 
-    conn = sqlite3.connect(DB_FILE)
-    # Get roles without permissions from the database
+def _roles_to_fetch(conn: sqlite3.Connection, resume: bool) -> list[str] | None:
+    """Returns the roles left by an interrupted sync, or starts a new one; None if done."""
+    role_names: list[str] = []
     try:
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT r.role
-            FROM roles r
-            LEFT JOIN permissions p ON r.role = p.role
-            WHERE p.role IS NULL
-            ORDER BY r.role
-        """)
-        roles_without_permissions = [row[0] for row in cursor.fetchall()]
+        if resume:
+            role_names = resume_sync(cursor)
+            if not role_names:
+                console.print("[green]Nothing to resume: the last sync fetched every role[/green]")
+                return None
+            console.print(f"[yellow]Resuming sync with {len(role_names)} roles left[/yellow]")
+        else:
+            role_names, cached = start_sync(cursor)
+            commit(conn)
+            if cached:
+                console.print(
+                    f"[blue]Skipping {cached} roles fetched recently without permissions "
+                    "or with errors[/blue]"
+                )
     except sqlite3.Error as error:
         console.print(f"[red]SQLite Error: {error}[/red]")
+    return role_names
+
 
-    # Insert missing role-permission pairs into 'permissions' table
-    for role_name in roles_without_permissions:
-        # Add 'roles/' prefix for API call
-        full_role_name = f"roles/{role_name}"
-        role_permissions = get_permissions(full_role_name)
-        if not role_permissions:
-            continue
-        # Create batch inserts with clean role name (without prefix)
-        permission_values = [(permission, role_name) for permission in role_permissions.permissions]
+def _store_fetched(
+    conn: sqlite3.Connection,
+    cursor: sqlite3.Cursor,
+    fetched: Iterable[tuple[str, RolePermissions | None]],
+) -> int:
+    """
+    Stores fetched permissions with their journal entries and returns the roles without any.
+
+    Commits every BATCH_SIZE roles. A role stays pending in the journal until its
+    permissions are stored with it.
+    """
+    empty = 0
+    for count, (role_name, role_permissions) in enumerate(fetched, 1):
+        permissions = role_permissions.permissions if role_permissions else []
         try:
-            cursor.executemany(
-                "INSERT INTO permissions (permission, role) VALUES (?, ?)", permission_values
-            )
+            store_role_permissions(cursor, role_name, permissions)
+            record_fetch(cursor, role_name, len(permissions))
         except sqlite3.IntegrityError as error:
             console.print(f"[yellow]SQLite IntegrityError: {error}[/yellow]")
         except sqlite3.Error as error:
             console.print(f"[red]SQLite Error: {error}[/red]")
-        except KeyboardInterrupt:
-            console.print("[yellow]Operation cancelled by user[/yellow]")
-            sys.exit(130)
 
-        conn.commit()
+        if count % BATCH_SIZE == 0:
+            commit(conn)
+        if permissions:
+            console.print(
+                f"[green]Saved {len(permissions)} permissions for role: {role_name}[/green]"
+            )
+        else:
+            empty += 1
+    commit(conn)
+    return empty
+
+
+@profiled("sync.permissions")
+def sync_permissions(
+    concurrency: int = DEFAULT_CONCURRENCY, rate: float = DEFAULT_RATE, resume: bool = False
+) -> None:
+    """
+    Fetches the permissions of the roles stored without any.
+
+    Every fetch is recorded in the sync journal together with the role's permissions, so
+    roles without permissions or whose call failed are not fetched again until their TTL
+    passes, and `resume` continues an interrupted sync with only the roles it left.
+    """
+
+    conn = connect()
+    role_names = _roles_to_fetch(conn, resume)
+    if role_names is None:
+        conn.close()
+        return
+
+    console.print(
+        f"[blue]Fetching permissions for {len(role_names)} roles "
+        f"(concurrency: {concurrency}, rate: {rate}/s)...[/blue]"
+    )
+
+    cursor = conn.cursor()
+    failures: list[str] = []
+
+    def failed(role_name: str, error: str) -> None:
+        record_fetch(cursor, role_name, None, error)
+        failures.append(role_name)
+
+    try:
+        empty = _store_fetched(
+            conn,
+            cursor,
+            fetch_permissions(role_names, concurrency=concurrency, rate=rate, on_error=failed),
+        )
+    except KeyboardInterrupt:
+        # Keep the roles fetched so far; the rest stay pending for `--resume`
+        commit(conn)
         console.print(
-            f"[green]Saved {len(role_permissions.permissions)} permissions for role: {role_name}[/green]"
+            "[yellow]Operation cancelled by user; continue with `role --sync --resume`[/yellow]"
         )
+        sys.exit(130)
+    finally:
+        conn.close()
 
-    conn.close()
+    if empty:
+        console.print(f"[yellow]{empty} roles have no permissions; cached as empty[/yellow]")
+    if failures:
+        console.print(
+            f"[red]{len(failures)} roles failed; retry them with `role --sync --resume`[/red]"
+        )
 
 
-def search_permissions(permission_name: str) -> None:
+def query_permissions(cursor: sqlite3.Cursor, permission_name: str, limit: int) -> sqlite3.Cursor:
+    """Runs a permission search and returns the cursor over its (role, permission) rows."""
+    if len(permission_name) >= FTS_MIN_TERM_LENGTH:
+        # Rank the distinct permissions first, then expand them to the roles granting them
+        return cursor.execute(
+            """
+            SELECT r.role, f.permission
+            FROM (
+                SELECT rowid, permission, rank
+                FROM permissions_fts
+                WHERE permissions_fts MATCH ?
+            ) f
+            JOIN role_permissions rp ON rp.permission_id = f.rowid
+            JOIN roles r ON r.id = rp.role_id
+            ORDER BY f.rank, f.permission, r.role
+            LIMIT ?;
+            """,
+            (fts_phrase(permission_name), search_limit(limit)),
+        )
+    return cursor.execute(
+        """
+        SELECT role, permission
+        FROM permissions
+        WHERE permission LIKE ?
+        ORDER BY permission, role
+        LIMIT ?;
+        """,
+        (f"%{permission_name}%", search_limit(limit)),
+    )
+
+
+@profiled("query.search_permissions")
+def search_permissions(
+    permission_name: str,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    output_format: OutputFormat = OutputFormat.table,
+) -> None:
     """Searches for a Google Cloud IAM predefined permission in the SQLite database table."""
 
     from contextlib import suppress
 
-    conn = sqlite3.connect(DB_FILE)
+    conn = connect()
 
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT role, permission
-            FROM permissions
-            WHERE permission LIKE ?
-            ORDER BY permission, role;
-            """,
-            (f"%{permission_name}%",),
-        )
-        rows = cursor.fetchall()
+        request = {"op": "search", "kind": "permissions", "term": permission_name, "limit": limit}
+        rows = daemon_rows(request, ("role", "permission"))
+        if rows is None:
+            rows = query_permissions(conn.cursor(), permission_name, limit)
+        if output_format != OutputFormat.table:
+            write_rows(rows, ("role", "permission"), output_format)
+            conn.close()
+            return
         table = Table()
         table.add_column("Role", justify="left", max_width=80, style="blue")
         table.add_column("Permission", justify="left", max_width=80, style="green")
@@ -111,19 +322,57 @@ def search_permissions(permission_name: str) -> None:
     except sqlite3.Error as error:
         console.print(f"[red]SQLite Error: {error}[/red]")
 
-    with suppress(BrokenPipeError):
+    with suppress(BrokenPipeError), span("render"):
         console.print(table)
 
     conn.close()
 
 
-def list_permissions(role_name: str) -> None:
+def _print_names(
+    rows: Iterable[tuple[str]], column: str, title: str, empty: str, output_format: OutputFormat
+) -> None:
+    """Streams single-column rows, or prints them as a table."""
+    from contextlib import suppress
+
+    if output_format != OutputFormat.table:
+        if not write_rows(rows, (column,), output_format):
+            console.print(f"[yellow]{empty}[/yellow]")
+        return
+
+    rows = list(rows)
+    if not rows:
+        console.print(f"[yellow]{empty}[/yellow]")
+        return
+
+    table = Table()
+    table.add_column(title, justify="left", max_width=100, style="green")
+    for row in rows:
+        table.add_row(str(row[0]))
+
+    with suppress(BrokenPipeError), span("render"):
+        console.print(table)
+
+
+@profiled("query.list_permissions")
+def list_permissions(role_name: str, output_format: OutputFormat = OutputFormat.table) -> None:
     """
     List Google IAM role permissions for a given role
     """
-    from contextlib import suppress
+    title = f"Role: {role_name}"
+    empty = f"No permissions found for role: {role_name}"
 
-    conn = sqlite3.connect(DB_FILE)
+    rows = daemon_rows({"op": "list", "role": role_name}, ("permission",))
+    if rows is not None:
+        _print_names(rows, "permission", title, empty, output_format)
+        return
+
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        permissions = snapshot.role_permissions(role_name) or ()
+        _print_names(((p,) for p in permissions), "permission", title, empty, output_format)
+        return
+
+    conn = connect()
 
     try:
         cursor = conn.cursor()
@@ -136,26 +385,117 @@ def list_permissions(role_name: str) -> None:
             """,
             (role_name,),
         )
-        rows = cursor.fetchall()
+        _print_names(cursor, "permission", title, empty, output_format)
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
 
-        if not rows:
-            console.print(f"[yellow]No permissions found for role: {role_name}[/yellow]")
-            return
+    conn.close()
 
-        table = Table()
-        table.add_column(f"Role: {role_name}", justify="left", max_width=100, style="green")
 
-        for row in rows:
-            table.add_row(str(row[0]))
+@profiled("query.permission_roles")
+def list_permission_roles(
+    permission: str, output_format: OutputFormat = OutputFormat.table
+) -> None:
+    """
+    List Google IAM roles that grant a given permission
+    """
+    title = f"Permission: {permission}"
+    empty = f"No roles found for permission: {permission}"
+
+    rows = daemon_rows({"op": "roles", "permission": permission}, ("role",))
+    if rows is not None:
+        _print_names(rows, "role", title, empty, output_format)
+        return
+
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        roles = snapshot.permission_roles(permission) or ()
+        _print_names(((role,) for role in roles), "role", title, empty, output_format)
+        return
+
+    conn = connect()
 
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT r.role
+            FROM permission_names pn
+            JOIN role_permissions rp ON rp.permission_id = pn.id
+            JOIN roles r ON r.id = rp.role_id
+            WHERE pn.permission = ? AND r.deleted IS NULL
+            ORDER BY r.role;
+            """,
+            (permission,),
+        )
+        _print_names(cursor, "role", title, empty, output_format)
     except sqlite3.Error as error:
         console.print(f"[red]SQLite Error: {error}[/red]")
 
-    with suppress(BrokenPipeError):
-        console.print(table)
-
     conn.close()
 
 
+def _permission_trie() -> tuple[PermissionTrie, Callable[[int], str]]:
+    """Returns the permission trie and an index -> name lookup, from the snapshot if present."""
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        return snapshot.trie(), snapshot.permission
+
+    conn = connect()
+    try:
+        names = sorted(
+            row[0].encode() for row in conn.execute("SELECT permission FROM permission_names")
+        )
+    finally:
+        conn.close()
+    nodes, order = build_trie(names)
+    return PermissionTrie(nodes, order, b"".join(names)), lambda index: names[index].decode()
+
+
+@profiled("query.glob_permissions")
+def glob_permissions(pattern: str, output_format: OutputFormat = OutputFormat.table) -> None:
+    """
+    List Google IAM permissions matching a segment glob such as compute.*.delete
+    """
+    try:
+        trie, permission = _permission_trie()
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+        return
+
+    rows = ((permission(index),) for index in trie.glob(pattern))
+    empty = f"No permissions match: {pattern}"
+    _print_names(rows, "permission", f"Glob: {pattern}", empty, output_format)
+
+
+@profiled("query.permission_tree")
+def permission_tree(path: str, output_format: OutputFormat = OutputFormat.table) -> None:
+    """
+    Show permission counts below a service or resource prefix such as storage.objects
+    """
+    from contextlib import suppress
+
+    try:
+        trie, _ = _permission_trie()
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+        return
+
+    rows = trie.tree(path)
+    if rows is None:
+        console.print(f"[yellow]No permissions found below: {path}[/yellow]")
+        return
+    if output_format != OutputFormat.table:
+        write_rows(rows, ("path", "permissions"), output_format)
+        return
+
+    (root, total), *children = rows
+    tree = Tree(f"[blue]{root or 'permissions'}[/blue] [green]({total})[/green]")
+    for child, count in children:
+        tree.add(f"[blue]{child}[/blue] [green]({count})[/green]")
+    with suppress(BrokenPipeError), span("render"):
+        console.print(tree)
+
+
 if __name__ == "__main__":
     sync_permissions()
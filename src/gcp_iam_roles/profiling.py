@@ -0,0 +1,331 @@
+import json
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+from typing import Any, TypeVar
+
+from rich.console import Console
+from rich.table import Table
+from rich.tree import Tree
+
+console = Console(stderr=True)
+
+T = TypeVar("T")
+DEFAULT_TRACE_FILE = Path("gcp-iam-roles-profile.json")
+HOT_FUNCTIONS = 20
+
+
+def _message_size(message: object) -> int:
+    """Serialized size of a proto-plus API message, or 0 for anything else."""
+    try:
+        return type(message).pb(message).ByteSize()
+    except (AttributeError, TypeError):
+        return 0
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Profile:
+    """
+    Timing spans, counters and latency histograms recorded while one command runs.
+
+    Spans nest per thread and are kept as Chrome trace events, so the JSON trace opens
+    in Perfetto or chrome://tracing. API calls are recorded as events too, on the thread
+    that made them, and their latencies feed the histograms.
+    """
+
+    def __init__(self, command: str, output: Path, hot: str | None) -> None:
+        self.command = command
+        self.output = output
+        self.hot = hot
+        self.started = time.perf_counter()
+        self.events: list[dict[str, Any]] = []
+        self.counters: Counter[str] = Counter()
+        self.latencies: defaultdict[str, list[float]] = defaultdict(list)
+        self.profiler = None
+        if hot:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+        # Threads inside the hot span; the profiler runs while any is
+        self._hot_threads = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # id -> (connection, total changes at its last commit); the connection is kept so
+        # its id cannot be reused by a later connection
+        self._changes: dict[int, tuple[sqlite3.Connection, int]] = {}
+
+    def _stack(self) -> list[str]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+            self._local.hot_depth = 0
+        return self._local.stack
+
+    def _enter_hot(self) -> None:
+        self._local.hot_depth += 1
+        if self._local.hot_depth == 1:
+            with self._lock:
+                self._hot_threads += 1
+                if self._hot_threads == 1:
+                    self.profiler.enable()
+
+    def _exit_hot(self) -> None:
+        self._local.hot_depth -= 1
+        if self._local.hot_depth == 0:
+            with self._lock:
+                self._hot_threads -= 1
+                if self._hot_threads == 0:
+                    self.profiler.disable()
+
+    def _event(self, category: str, name: str, started: float, elapsed: float) -> None:
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((started - self.started) * 1e6, 1),
+            "dur": round(elapsed * 1e6, 1),
+            "pid": 1,
+            "tid": threading.get_ident(),
+        }
+        with self._lock:
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        stack = self._stack()
+        stack.append(name)
+        path = "/".join(stack)
+        hot = self.profiler is not None and name == self.hot
+        if hot:
+            self._enter_hot()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            if hot:
+                self._exit_hot()
+            stack.pop()
+            self._event("span", path, started, elapsed)
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name: str, started: float, elapsed: float) -> None:
+        self._event("api", name, started, elapsed)
+        with self._lock:
+            self.latencies[name].append(elapsed)
+            self.counters["api.calls"] += 1
+
+    def commit(self, conn: sqlite3.Connection) -> None:
+        started = time.perf_counter()
+        with self.span("db.commit"):
+            conn.commit()
+        elapsed = time.perf_counter() - started
+        _, previous = self._changes.get(id(conn), (conn, 0))
+        self._changes[id(conn)] = (conn, conn.total_changes)
+        with self._lock:
+            self.latencies["db.commit"].append(elapsed)
+            self.counters["db.commits"] += 1
+            self.counters["db.rows_written"] += conn.total_changes - previous
+
+    def _span_tree(self, total: float) -> Tree:
+        # Spans with the same path are merged, in the order they first started
+        merged: dict[str, list[float]] = {}
+        for event in sorted(self.events, key=lambda event: event["ts"]):
+            if event["cat"] == "span":
+                entry = merged.setdefault(event["name"], [0, 0.0])
+                entry[0] += 1
+                entry[1] += event["dur"] / 1e6
+        tree = Tree(f"[bold]{self.command}[/bold] {total * 1000:.1f} ms")
+        nodes = {"": tree}
+        for path, (calls, elapsed) in merged.items():
+            parent = nodes.get(path.rpartition("/")[0], tree)
+            label = f"[blue]{path.rpartition('/')[2]}[/blue] {elapsed * 1000:.1f} ms"
+            label += f" ({elapsed / total:.0%}" + (f", {calls} calls)" if calls > 1 else ")")
+            nodes[path] = parent.add(label)
+        return tree
+
+    def _histograms(self) -> dict[str, dict[str, float]]:
+        histograms = {}
+        for name, latencies in sorted(self.latencies.items()):
+            values = sorted(latencies)
+            histograms[name] = {
+                "count": len(values),
+                "total_ms": sum(values) * 1000,
+                "p50_ms": _percentile(values, 0.5) * 1000,
+                "p90_ms": _percentile(values, 0.9) * 1000,
+                "p99_ms": _percentile(values, 0.99) * 1000,
+                "max_ms": values[-1] * 1000,
+            }
+        return histograms
+
+    def report(self) -> None:
+        """Prints the summary to stderr and writes the JSON trace and cProfile stats."""
+        total = time.perf_counter() - self.started
+        histograms = self._histograms()
+        console.print(self._span_tree(total))
+
+        if self.counters:
+            table = Table(title="[bold blue]Counters[/bold blue]")
+            table.add_column("Counter", justify="left", style="blue")
+            table.add_column("Value", justify="right", style="green")
+            for name, value in sorted(self.counters.items()):
+                table.add_row(name, f"{value:,.0f}" if value == int(value) else f"{value:,.3f}")
+            console.print(table)
+
+        if histograms:
+            table = Table(title="[bold blue]Latency (ms)[/bold blue]")
+            table.add_column("Call", justify="left", style="blue")
+            for column in ("count", "p50_ms", "p90_ms", "p99_ms", "max_ms", "total_ms"):
+                table.add_column(column.removesuffix("_ms"), justify="right", style="green")
+            for name, summary in histograms.items():
+                table.add_row(
+                    name,
+                    str(summary["count"]),
+                    *(f"{summary[key]:.2f}" for key in ("p50_ms", "p90_ms", "p99_ms", "max_ms")),
+                    f"{summary['total_ms']:.1f}",
+                )
+            console.print(table)
+
+        trace = {
+            "command": self.command,
+            "displayTimeUnit": "ms",
+            "total_ms": total * 1000,
+            "counters": dict(self.counters),
+            "histograms": histograms,
+            "traceEvents": self.events,
+        }
+        self.output.write_text(json.dumps(trace) + "\n", encoding="utf-8")
+        console.print(f"[green]Wrote profile trace to {self.output}[/green]")
+
+        if self.profiler is not None and not self.profiler.getstats():
+            console.print(f"[yellow]No '{self.hot}' span ran; nothing was profiled[/yellow]")
+        elif self.profiler is not None:
+            import io
+            import pstats
+
+            stats_file = self.output.with_suffix(".pstats")
+            self.profiler.dump_stats(stats_file)
+            text = io.StringIO()
+            stats = pstats.Stats(self.profiler, stream=text).sort_stats("cumulative")
+            stats.print_stats(HOT_FUNCTIONS)
+            # Plain text so long paths are not wrapped to the console width
+            print(text.getvalue().strip(), file=sys.stderr)
+            console.print(f"[green]Wrote cProfile stats for '{self.hot}' to {stats_file}[/green]")
+
+
+class _Active:
+    """Holds the active profile, which is None unless the CLI runs with --profile."""
+
+    __slots__ = ("profile",)
+
+    def __init__(self) -> None:
+        self.profile: Profile | None = None
+
+
+# A module-level holder rather than a ContextVar, so API worker threads see the profile
+# too; the helpers below only cost an attribute lookup on normal runs.
+_active = _Active()
+
+
+def start(command: str, output: Path = DEFAULT_TRACE_FILE, hot: str | None = None) -> None:
+    """Starts recording; tables and streamed rows are timed as `render` spans."""
+    _active.profile = Profile(command, output, hot)
+
+
+def finish() -> None:
+    """Stops recording and reports the profile."""
+    profile, _active.profile = _active.profile, None
+    if profile is None:
+        return
+    profile.report()
+
+
+def span(name: str) -> AbstractContextManager[None]:
+    """Times a block as a span nested in the current one."""
+    profile = _active.profile
+    return profile.span(name) if profile is not None else nullcontext()
+
+
+def profiled(name: str) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """Decorator that times every call of a function as a span."""
+
+    def decorator(function: Callable[..., T]) -> Callable[..., T]:
+        @wraps(function)
+        def wrapper(*args: object, **kwargs: object) -> T:
+            profile = _active.profile
+            if profile is None:
+                return function(*args, **kwargs)
+            with profile.span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, value: float = 1) -> None:
+    """Adds to a counter, e.g. `api.retries`."""
+    profile = _active.profile
+    if profile is not None:
+        profile.count(name, value)
+
+
+def call_api(name: str, function: Callable[..., T], *args: object, **kwargs: object) -> T:
+    """Calls an API method, recording its latency, response size and failures."""
+    profile = _active.profile
+    if profile is None:
+        return function(*args, **kwargs)
+    started = time.perf_counter()
+    try:
+        result = function(*args, **kwargs)
+    except Exception:
+        profile.count(f"api.{name}.errors")
+        raise
+    finally:
+        profile.observe(name, started, time.perf_counter() - started)
+    profile.count("api.response_bytes", _message_size(result))
+    return result
+
+
+def pages(name: str, pager_pages: Iterable[T]) -> Iterator[T]:
+    """
+    Iterates the pages of a list call, recording each page request.
+
+    The first page arrives with the list call itself, so only later pages are requests.
+    """
+    profile = _active.profile
+    if profile is None:
+        yield from pager_pages
+        return
+    iterator = iter(pager_pages)
+    first = True
+    while True:
+        started = time.perf_counter()
+        page = next(iterator, None)
+        if page is None:
+            return
+        if not first:
+            profile.observe(name, started, time.perf_counter() - started)
+        first = False
+        profile.count("api.response_bytes", _message_size(page))
+        yield page
+
+
+def commit(conn: sqlite3.Connection) -> None:
+    """Commits, recording the commit latency and the rows written since the last commit."""
+    profile = _active.profile
+    if profile is None:
+        conn.commit()
+    else:
+        profile.commit(conn)
@@ -0,0 +1,103 @@
+import random
+import threading
+import time
+from collections.abc import Callable
+from typing import TypeVar
+
+from .profiling import count
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """Thread-safe token bucket used to keep API calls within Google Cloud quotas."""
+
+    def __init__(self, rate: float, capacity: int = 1) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be greater than zero")
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> None:
+        """Blocks until a token is available and consumes it."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            count("api.throttled_s", wait)
+            time.sleep(wait)
+
+
+class AdaptiveBackoff:
+    """
+    Thread-safe delay between API requests that adapts to quota errors.
+
+    Every quota error (HTTP 429 / RESOURCE_EXHAUSTED) or transient unavailability doubles
+    the delay, with jitter, up to `maximum`; every success halves it again, so a sync runs
+    at full speed until the API pushes back. Workers sharing one instance all slow down
+    together, and errors from calls that waited the same delay double it only once.
+    """
+
+    def __init__(
+        self,
+        initial: float = 1.0,
+        maximum: float = 64.0,
+        max_retries: int = 8,
+    ) -> None:
+        self.initial = initial
+        self.maximum = maximum
+        self.max_retries = max_retries
+        self.delay = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> float:
+        """Sleeps for the current delay, if any, and returns it."""
+        delay = self.delay
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def success(self) -> None:
+        with self._lock:
+            self.delay = self.delay / 2 if self.delay > self.initial / 4 else 0.0
+
+    def failure(self, retries: int, waited: float = 0.0) -> bool:
+        """
+        Grows the delay after a call's retryable error; returns False once its retries
+        are exhausted. `waited` is the delay the call slept before failing.
+        """
+        count("api.retries")
+        if retries > self.max_retries:
+            return False
+        grown = min(self.maximum, max(self.initial, waited * 2)) * random.uniform(0.8, 1.2)
+        with self._lock:
+            self.delay = max(self.delay, grown)
+        return True
+
+    def call(self, function: Callable[[], T]) -> T:
+        """Calls `function`, retrying quota and availability errors with growing delays."""
+        from google.api_core.exceptions import ServiceUnavailable, TooManyRequests
+
+        retries = 0
+        while True:
+            waited = self.wait()
+            try:
+                result = function()
+            except (TooManyRequests, ServiceUnavailable):
+                retries += 1
+                if not self.failure(retries, waited):
+                    raise
+                continue
+            self.success()
+            return result
@@ -1,14 +1,45 @@
+import base64
 import sqlite3
 import sys
-from dataclasses import dataclass
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import TYPE_CHECKING
 
-from google.cloud import iam_admin_v1
 from rich.console import Console
 from rich.table import Table
 
+if TYPE_CHECKING:
+    from google.cloud import iam_admin_v1
+
 console = Console()
 
-from . import DB_FILE
+from .auth import iam_client
+from .client import daemon_rows
+from .connection import BATCH_SIZE, connect
+from .db import DEFAULT_SEARCH_LIMIT, FTS_MIN_TERM_LENGTH, fts_phrase, search_limit
+from .journal import record_fetch
+from .output import OutputFormat, write_rows
+from .permissions import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_RATE,
+    fetch_permissions,
+    store_role_permissions,
+)
+from .profiling import call_api, commit, pages, profiled, span
+from .snapshot import Snapshot, load_snapshot
+
+# ListRoles accepts up to 1000 roles per page; FULL view pages carry every permission, so
+# keep them smaller to bound the size of each response.
+DEFAULT_PAGE_SIZE = 100
+
+
+class SyncMode(str, Enum):
+    """Strategies for syncing roles and permissions from the IAM API."""
+
+    per_role = "per-role"
+    single_pass = "single-pass"
+    incremental = "incremental"
 
 
 @dataclass
@@ -17,61 +48,97 @@ class Role:
     title: str
     description: str
     stage: str
+    permissions: list[str] = field(default_factory=list)
+    etag: str = ""
+    deleted: bool = False
+
+
+def _to_role(role: "iam_admin_v1.Role") -> Role:
+    return Role(
+        name=role.name,
+        title=role.title,
+        description=role.description,
+        stage=role.stage.name,
+        permissions=list(role.included_permissions),
+        etag=base64.b64encode(role.etag).decode(),
+        deleted=role.deleted,
+    )
 
 
-def get_roles() -> list[Role]:
+def get_roles(show_deleted: bool = False) -> list[Role]:
     """Retrieves a list of all predefined IAM roles in the current Google Cloud project."""
 
-    roles: list[Role] = []
+    from google.cloud import iam_admin_v1
 
     console.print("[blue]Getting Google Cloud Predefined Roles...[/blue]")
 
-    client = iam_admin_v1.IAMClient()
-    request = iam_admin_v1.ListRolesRequest()
-    data = client.list_roles(request=request)
-
-    for role in data:
-        roles.append(
-            Role(
-                name=role.name,
-                title=role.title,
-                description=role.description,
-                stage=role.stage.name,
-            )
-        )
+    client = iam_client()
+    request = iam_admin_v1.ListRolesRequest(show_deleted=show_deleted)
+    data = call_api("list_roles", client.list_roles, request=request)
+
+    roles = [_to_role(role) for page in pages("list_roles", data.pages) for role in page.roles]
 
     console.print(f"[green]Received {len(roles)} Google Cloud Predefined Roles[/green]")
 
     return roles
 
 
+def iter_role_pages(page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[list[Role]]:
+    """Yields pages of predefined IAM roles including their permissions (FULL view)."""
+    from google.cloud import iam_admin_v1
+
+    client = iam_client()
+    request = iam_admin_v1.ListRolesRequest(view=iam_admin_v1.RoleView.FULL, page_size=page_size)
+
+    data = call_api("list_roles", client.list_roles, request=request)
+    for page in pages("list_roles", data.pages):
+        yield [_to_role(role) for role in page.roles]
+
+
+UPSERT_ROLE = """
+    INSERT INTO roles (role, title, description, stage, etag) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (role) DO UPDATE SET
+        title = excluded.title,
+        description = excluded.description,
+        stage = excluded.stage,
+        etag = excluded.etag,
+        deleted = NULL
+"""
+
+
+def _role_row(role: Role) -> tuple[str, str, str, str, str]:
+    # Strip 'roles/' prefix from role name
+    return role.name.removeprefix("roles/"), role.title, role.description, role.stage, role.etag
+
+
+@profiled("sync.roles")
 def sync_roles() -> None:
-    """Inserts a list of Google Cloud IAM predefined roles into a SQLite database table."""
+    """
+    Upserts the Google Cloud IAM predefined roles into a SQLite database table.
 
-    conn = sqlite3.connect(DB_FILE)
+    Roles missing from the listing are marked as deleted and their permissions dropped.
+    """
+
+    conn = connect()
 
     roles = get_roles()
 
-    new_roles = []
-    old_roles = []
+    new_roles = old_roles = 0
 
     console.print("[blue]Storing roles in database...[/blue]")
 
     try:
         cursor = conn.cursor()
-        for role in roles:
-            try:
-                # Strip 'roles/' prefix from role name
-                role_name_clean = role.name.removeprefix("roles/")
-                cursor.execute(
-                    "INSERT INTO roles (role, title, description, stage) VALUES (?, ?, ?, ?)",
-                    (role_name_clean, role.title, role.description, role.stage),
-                )
-                new_roles.append(role)
-            except sqlite3.IntegrityError:
-                old_roles.append(role)
-                continue
-        conn.commit()
+        existing = {row[0] for row in cursor.execute("SELECT role FROM roles")}
+        rows = [_role_row(role) for role in roles]
+        new_roles = sum(row[0] not in existing for row in rows)
+        old_roles = len(rows) - new_roles
+        # One statement and one transaction for the whole listing
+        cursor.executemany(UPSERT_ROLE, rows)
+        vanished = _mark_deleted(cursor, {row[0] for row in rows})
+        commit(conn)
+        if vanished:
+            console.print(f"[yellow]Marked {len(vanished)} roles as deleted[/yellow]")
     except sqlite3.Error as error:
         console.print(f"[red]SQLite Error: {error}[/red]")
     except KeyboardInterrupt:
@@ -80,28 +147,180 @@ def sync_roles() -> None:
 
     conn.close()
 
-    console.print(f"[green]New roles: {len(new_roles)}, Existing roles: {len(old_roles)}[/green]")
+    console.print(f"[green]New roles: {new_roles}, Existing roles: {old_roles}[/green]")
 
 
-def search_roles(role_name: str) -> None:
-    """Searches for a Google Cloud IAM predefined role in the SQLite database table."""
+def _mark_deleted(cursor: sqlite3.Cursor, live_roles: set[str]) -> list[str]:
+    """Tombstones roles that are no longer returned by the IAM API and drops their permissions."""
+    cursor.execute("SELECT role FROM roles WHERE deleted IS NULL AND kind = 'predefined'")
+    vanished = sorted(row[0] for row in cursor.fetchall() if row[0] not in live_roles)
+    for role_name in vanished:
+        cursor.execute("UPDATE roles SET deleted = CURRENT_TIMESTAMP WHERE role = ?", (role_name,))
+        cursor.execute("DELETE FROM sync_journal WHERE role = ?", (role_name,))
+        store_role_permissions(cursor, role_name, [])
+    return vanished
 
-    from contextlib import suppress
 
-    conn = sqlite3.connect(DB_FILE)
+@profiled("sync.roles.single_pass")
+def sync_roles_single_pass(page_size: int = DEFAULT_PAGE_SIZE) -> None:
+    """
+    Streams predefined roles and their permissions into the database in one pass.
+
+    Uses ListRoles with the FULL view so permissions arrive with each page instead of
+    requiring a GetRole call per role. Roles are committed every BATCH_SIZE roles.
+    """
+
+    conn = connect()
+
+    console.print("[blue]Getting Google Cloud Predefined Roles with permissions...[/blue]")
+
+    live_roles: set[str] = set()
+    total_permissions = 0
+    pending = 0
+
+    try:
+        cursor = conn.cursor()
+        for page in iter_role_pages(page_size=page_size):
+            rows = [_role_row(role) for role in page]
+            cursor.executemany(UPSERT_ROLE, rows)
+            for (role_name_clean, *_), role in zip(rows, page, strict=True):
+                store_role_permissions(cursor, role_name_clean, role.permissions)
+                live_roles.add(role_name_clean)
+                total_permissions += len(role.permissions)
+            pending += len(page)
+            if pending >= BATCH_SIZE:
+                commit(conn)
+                pending = 0
+            console.print(
+                f"[green]Saved {len(page)} roles. Total roles: {len(live_roles)}, "
+                f"permissions: {total_permissions}[/green]"
+            )
+        vanished = _mark_deleted(cursor, live_roles)
+        commit(conn)
+        if vanished:
+            console.print(f"[yellow]Marked {len(vanished)} roles as deleted[/yellow]")
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+    except KeyboardInterrupt:
+        console.print("[yellow]Operation cancelled by user[/yellow]")
+        sys.exit(130)
+    finally:
+        conn.close()
+
+
+@profiled("sync.roles.incremental")
+def sync_roles_incremental(
+    concurrency: int = DEFAULT_CONCURRENCY, rate: float = DEFAULT_RATE
+) -> None:
+    """
+    Refreshes only the predefined roles whose etag changed since the last sync.
+
+    Role metadata and etags come from a single ListRoles listing. GetRole is called only
+    for new or changed roles, and their permissions are updated as a set difference.
+    Roles that disappeared from the API, or are reported as deleted, are tombstoned.
+    """
+
+    conn = connect()
 
     try:
+        remote = {
+            role.name.removeprefix("roles/"): role
+            for role in get_roles(show_deleted=True)
+            if not role.deleted
+        }
+
         cursor = conn.cursor()
-        cursor.execute(
+        cursor.execute("SELECT role, etag FROM roles WHERE deleted IS NULL AND kind = 'predefined'")
+        local = dict(cursor.fetchall())
+        changed = sorted(
+            role_name for role_name, role in remote.items() if local.get(role_name) != role.etag
+        )
+        console.print(
+            f"[blue]Roles: {len(remote)}, changed or new: {len(changed)}, "
+            f"unchanged: {len(remote) - len(changed)}[/blue]"
+        )
+
+        def failed(role_name: str, error: str) -> None:
+            record_fetch(cursor, role_name, None, error)
+
+        added = removed = 0
+        # A role's new etag is committed together with its permissions, so roles lost to
+        # an interruption still look changed to the next sync
+        for count, (role_name, role_permissions) in enumerate(
+            fetch_permissions(changed, concurrency=concurrency, rate=rate, on_error=failed), 1
+        ):
+            cursor.execute(UPSERT_ROLE, _role_row(remote[role_name]))
+            permissions = role_permissions.permissions if role_permissions else []
+            role_added, role_removed = store_role_permissions(cursor, role_name, permissions)
+            record_fetch(cursor, role_name, len(permissions))
+            if count % BATCH_SIZE == 0:
+                commit(conn)
+            added += role_added
+            removed += role_removed
+
+        vanished = _mark_deleted(cursor, set(remote))
+        commit(conn)
+
+        console.print(
+            f"[green]Updated roles: {len(changed)}, permissions added: {added}, "
+            f"removed: {removed}, deleted roles: {len(vanished)}[/green]"
+        )
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+    except KeyboardInterrupt:
+        console.print("[yellow]Operation cancelled by user[/yellow]")
+        sys.exit(130)
+    finally:
+        conn.close()
+
+
+def query_roles(cursor: sqlite3.Cursor, role_name: str, limit: int) -> sqlite3.Cursor:
+    """Runs a role search and returns the cursor over its (role, title) rows."""
+    if len(role_name) >= FTS_MIN_TERM_LENGTH:
+        # Role name matches weigh more than title matches, which weigh more than descriptions
+        return cursor.execute(
             """
             SELECT role, title
-            FROM roles
-            WHERE role LIKE ? OR title LIKE ? OR description LIKE ?
-            ORDER BY role;
+            FROM roles_fts
+            WHERE roles_fts MATCH ?
+            ORDER BY bm25(roles_fts, 10.0, 5.0, 1.0), role
+            LIMIT ?;
             """,
-            (f"%{role_name}%", f"%{role_name}%", f"%{role_name}%"),
+            (fts_phrase(role_name), search_limit(limit)),
         )
-        rows = cursor.fetchall()
+    return cursor.execute(
+        """
+        SELECT role, title
+        FROM roles
+        WHERE deleted IS NULL AND (role LIKE ? OR title LIKE ? OR description LIKE ?)
+        ORDER BY role
+        LIMIT ?;
+        """,
+        (f"%{role_name}%", f"%{role_name}%", f"%{role_name}%", search_limit(limit)),
+    )
+
+
+@profiled("query.search_roles")
+def search_roles(
+    role_name: str,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    output_format: OutputFormat = OutputFormat.table,
+) -> None:
+    """Searches for a Google Cloud IAM predefined role in the SQLite database table."""
+
+    from contextlib import suppress
+
+    conn = connect()
+
+    try:
+        request = {"op": "search", "kind": "roles", "term": role_name, "limit": limit}
+        rows = daemon_rows(request, ("role", "title"))
+        if rows is None:
+            rows = query_roles(conn.cursor(), role_name, limit)
+        if output_format != OutputFormat.table:
+            write_rows(rows, ("role", "title"), output_format)
+            conn.close()
+            return
         table = Table()
         table.add_column("Role", justify="left", max_width=80, style="blue")
         table.add_column("Title", justify="left", max_width=80, style="green")
@@ -110,7 +329,7 @@ def search_roles(role_name: str) -> None:
     except sqlite3.Error as error:
         console.print(f"[red]SQLite Error: {error}[/red]")
 
-    with suppress(BrokenPipeError):
+    with suppress(BrokenPipeError), span("render"):
         console.print(table)
 
     conn.close()
@@ -140,102 +359,159 @@ def _validate_roles_exist(
     return True
 
 
-def diff_roles(role1: str, role2: str) -> None:
+def _stream_diff(
+    cursor: sqlite3.Cursor, role1: str, role2: str, output_format: OutputFormat
+) -> None:
+    """Streams a role diff as (permission, status) rows, merged and sorted by SQLite."""
+    cursor.execute(
+        "SELECT role FROM roles WHERE role IN (?, ?) AND deleted IS NULL", (role1, role2)
+    )
+    found = {row[0] for row in cursor.fetchall()}
+    if not _validate_roles_exist(role1, role2, {role1} & found, {role2} & found):
+        return
+    if role1 == role2:
+        # A role does not differ from itself; the query below would label it all 'left'
+        write_rows((), ("permission", "status"), output_format)
+        return
+    cursor.execute(
+        """
+        SELECT permission,
+            CASE WHEN COUNT(DISTINCT role) = 2 THEN 'common'
+                WHEN MIN(role) = ? THEN 'left'
+                ELSE 'right'
+            END
+        FROM permissions
+        WHERE role IN (?, ?)
+        GROUP BY permission
+        ORDER BY permission;
+        """,
+        (role1, role1, role2),
+    )
+    write_rows(cursor, ("permission", "status"), output_format)
+
+
+@profiled("render")
+def _print_diff(
+    role1: str, role2: str, role1_permissions: set[str], role2_permissions: set[str]
+) -> None:
+    """Prints the summary and the permission tables of a role diff."""
+    if role1 == role2:
+        console.print(f"[yellow]Role '{role1}' is compared with itself: no differences[/yellow]")
+        return
+
+    # Calculate differences
+    only_in_role1 = role1_permissions - role2_permissions
+    only_in_role2 = role2_permissions - role1_permissions
+    common_permissions = role1_permissions & role2_permissions
+
+    # Create summary table
+    summary_table = Table()
+    summary_table.add_column(f"{role1} vs. {role2}", justify="left", style="yellow")
+    summary_table.add_column("Count", justify="right", style="green")
+
+    summary_table.add_row("Common Permissions", str(len(common_permissions)))
+    summary_table.add_row(f"Only in {role1}", str(len(only_in_role1)))
+    summary_table.add_row(f"Only in {role2}", str(len(only_in_role2)))
+    summary_table.add_row(
+        "Total Unique Permissions", str(len(role1_permissions | role2_permissions))
+    )
+
+    console.print(summary_table)
+    console.print()
+
+    # Show common permissions if there are any
+    if common_permissions:
+        common_table = Table()
+        common_table.add_column("Common Permissions", justify="left", style="green", max_width=80)
+        for permission in sorted(common_permissions):
+            common_table.add_row(permission)
+        console.print(common_table)
+
+    # Show permissions only in role1
+    role1_table = Table()
+    role1_table.add_column(f"Only in {role1} (left)", justify="left", style="cyan", max_width=80)
+    if only_in_role1:
+        for permission in sorted(only_in_role1):
+            role1_table.add_row(permission)
+    console.print(role1_table)
+    console.print()
+
+    # Show permissions only in role2
+    role2_table = Table()
+    role2_table.add_column(f"Only in {role2} (right)", justify="left", style="blue", max_width=80)
+    if only_in_role2:
+        for permission in sorted(only_in_role2):
+            role2_table.add_row(permission)
+    console.print(role2_table)
+    console.print()
+
+
+def _diff_from_snapshot(
+    snapshot: Snapshot, role1: str, role2: str, output_format: OutputFormat
+) -> None:
+    """Diffs two roles by merging their sorted permission arrays from the mapped snapshot."""
+    role1_permissions = snapshot.role_permissions(role1)
+    role2_permissions = snapshot.role_permissions(role2)
+    if output_format != OutputFormat.table:
+        role1_found = {role1} if role1_permissions is not None else set()
+        role2_found = {role2} if role2_permissions is not None else set()
+        if _validate_roles_exist(role1, role2, role1_found, role2_found):
+            write_rows(snapshot.diff(role1, role2), ("permission", "status"), output_format)
+        return
+
+    role1_set = set(role1_permissions or ())
+    role2_set = set(role2_permissions or ())
+    if _validate_roles_exist(role1, role2, role1_set, role2_set):
+        _print_diff(role1, role2, role1_set, role2_set)
+
+
+@profiled("query.diff_roles")
+def diff_roles(role1: str, role2: str, output_format: OutputFormat = OutputFormat.table) -> None:
     """Compares permissions between two GCP IAM roles and displays the differences."""
     from contextlib import suppress
 
-    conn = sqlite3.connect(DB_FILE)
+    # The daemon only answers when both roles exist; otherwise the messages come from below
+    rows = daemon_rows({"op": "diff", "roles": [role1, role2]}, ("permission", "status"))
+    if rows is not None:
+        with suppress(BrokenPipeError):
+            if output_format != OutputFormat.table:
+                write_rows(rows, ("permission", "status"), output_format)
+            else:
+                role1_set = {permission for permission, status in rows if status != "right"}
+                role2_set = {permission for permission, status in rows if status != "left"}
+                _print_diff(role1, role2, role1_set, role2_set)
+        return
+
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        with suppress(BrokenPipeError):
+            _diff_from_snapshot(snapshot, role1, role2, output_format)
+        return
+
+    conn = connect()
 
     try:
         cursor = conn.cursor()
 
+        if output_format != OutputFormat.table:
+            _stream_diff(cursor, role1, role2, output_format)
+            conn.close()
+            return
+
         role1_permissions = _get_role_permissions(cursor, role1)
         role2_permissions = _get_role_permissions(cursor, role2)
 
         if not _validate_roles_exist(role1, role2, role1_permissions, role2_permissions):
             return
 
-        # Calculate differences
-        only_in_role1 = role1_permissions - role2_permissions
-        only_in_role2 = role2_permissions - role1_permissions
-        common_permissions = role1_permissions & role2_permissions
-
-        # Create summary table
-        summary_table = Table()
-        summary_table.add_column(f"{role1} vs. {role2}", justify="left", style="yellow")
-        summary_table.add_column("Count", justify="right", style="green")
-
-        summary_table.add_row("Common Permissions", str(len(common_permissions)))
-        summary_table.add_row(f"Only in {role1}", str(len(only_in_role1)))
-        summary_table.add_row(f"Only in {role2}", str(len(only_in_role2)))
-        summary_table.add_row(
-            "Total Unique Permissions", str(len(role1_permissions | role2_permissions))
-        )
-
-        console.print(summary_table)
-        console.print()
-
-        # Show common permissions if there are any
-        if common_permissions:
-            common_table = Table()
-            common_table.add_column(
-                "Common Permissions", justify="left", style="green", max_width=80
-            )
-            for permission in sorted(common_permissions):
-                common_table.add_row(permission)
-            console.print(common_table)
-
-        # Show permissions only in role1
-        role1_table = Table()
-        role1_table.add_column(
-            f"Only in {role1} (left)", justify="left", style="cyan", max_width=80
-        )
-        if only_in_role1:
-            for permission in sorted(only_in_role1):
-                role1_table.add_row(permission)
-        console.print(role1_table)
-        console.print()
-
-        # Show permissions only in role2
-        role2_table = Table()
-        role2_table.add_column(
-            f"Only in {role2} (right)", justify="left", style="blue", max_width=80
-        )
-        if only_in_role2:
-            for permission in sorted(only_in_role2):
-                role2_table.add_row(permission)
-        console.print(role2_table)
-        console.print()
+        with suppress(BrokenPipeError):
+            _print_diff(role1, role2, role1_permissions, role2_permissions)
 
     except sqlite3.Error as error:
         console.print(f"[red]SQLite Error: {error}[/red]")
 
-    with suppress(BrokenPipeError):
-        pass
-
     conn.close()
 
 
-def list_roles() -> None:
-    """
-    List Google IAM Roles for CLI completion
-    """
-    conn = sqlite3.connect(DB_FILE)
-
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT role FROM roles ORDER BY role")
-        roles = cursor.fetchall()
-
-        for role in roles:
-            print(role[0])
-
-    except sqlite3.Error:
-        # Silently fail if database doesn't exist or has issues
-        pass
-    finally:
-        conn.close()
-
-
 if __name__ == "__main__":
     sync_roles()
@@ -1,15 +1,27 @@
 import sqlite3
 import sys
-import time
+from collections.abc import Iterable
 from dataclasses import dataclass
 
-from google.cloud import service_usage_v1
 from rich.console import Console
 from rich.table import Table
 
 console = Console()
 
-from . import DB_FILE
+from .auth import ensure_authenticated, service_usage_client
+from .client import daemon_rows
+from .connection import connect
+from .db import DEFAULT_SEARCH_LIMIT, FTS_MIN_TERM_LENGTH, fts_phrase, search_limit
+from .output import OutputFormat, write_rows
+from .profiling import call_api, commit, profiled, span
+from .ratelimit import AdaptiveBackoff
+
+# ListServices returns at most 200 services per page
+DEFAULT_PAGE_SIZE = 200
+CHECKPOINT_KEY = "services_page_token"
+# Permission prefixes whose service is neither PREFIX.googleapis.com nor
+# cloudPREFIX.googleapis.com
+SERVICE_ALIASES = {"cloudsql": "sqladmin.googleapis.com"}
 
 
 @dataclass
@@ -18,13 +30,22 @@ class Service:
     title: str
 
 
-def sync_services() -> list[Service]:
-    """Retrieves a list of all Google Cloud services."""
-    from . import ensure_authenticated
+@profiled("sync.services")
+def sync_services(page_size: int = DEFAULT_PAGE_SIZE, restart: bool = False) -> list[Service]:
+    """
+    Retrieves a list of all Google Cloud services.
+
+    Each page is upserted together with the next page token in one transaction, so an
+    interrupted sync resumes from the last stored page. Quota errors slow the requests
+    down instead of failing the sync.
+    """
+    from google.cloud import service_usage_v1
+
+    services: list[Service] = []
 
-    services = []
-    page_size = 10
-    delay = 5.0
+    page_token = "" if restart else _get_checkpoint()
+    if page_token:
+        console.print("[yellow]Resuming Google Cloud Services sync from last checkpoint[/yellow]")
 
     console.print(
         "[blue]Searching for Google Cloud Services. Not all Cloud Services provided by Google. This may take a while...[/blue]"
@@ -32,13 +53,21 @@ def sync_services() -> list[Service]:
 
     _, project_id = ensure_authenticated()
 
-    client = service_usage_v1.ServiceUsageClient()
-    request = service_usage_v1.ListServicesRequest(
-        parent=f"projects/{project_id}", page_size=page_size
-    )
+    client = service_usage_client()
+    backoff = AdaptiveBackoff()
 
     try:
-        for page in client.list_services(request=request).pages:
+        while True:
+            request = service_usage_v1.ListServicesRequest(
+                parent=f"projects/{project_id}", page_size=page_size, page_token=page_token
+            )
+            # Only the first page of each pager is read so that every request goes through
+            # the backoff and the page token can be checkpointed
+            page = backoff.call(
+                lambda request=request: call_api(
+                    "list_services", client.list_services, request=request
+                )
+            )
             batch = [
                 Service(name=svc.config.name, title=svc.config.title)
                 for svc in page.services
@@ -47,10 +76,11 @@ def sync_services() -> list[Service]:
             console.print(
                 f"[blue]Found {len(batch)} Google Cloud Services. Total: {len(services) + len(batch)}[/blue]"
             )
-            if batch:
-                services.extend(batch)
-                store_services(batch)
-            time.sleep(delay)
+            services.extend(batch)
+            page_token = page.next_page_token
+            store_services(batch, page_token)
+            if not page_token:
+                break
     except Exception as error:
         console.print(f"[red]Error getting Google Cloud Services: {error}[/red]")
         raise
@@ -61,21 +91,42 @@ def sync_services() -> list[Service]:
     return services
 
 
-def store_services(services: list[Service]) -> None:
-    """Inserts a list of Google Cloud services into a SQLite database table."""
+def _get_checkpoint() -> str:
+    conn = connect()
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (CHECKPOINT_KEY,)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else ""
+
+
+def store_services(services: list[Service], next_page_token: str = "") -> None:
+    """
+    Upserts a list of Google Cloud services into a SQLite database table.
 
-    conn = sqlite3.connect(DB_FILE)
+    The next page token is saved in the same transaction; an empty token clears it.
+    """
+
+    conn = connect()
 
     try:
         cursor = conn.cursor()
         cursor.executemany(
-            "INSERT INTO services (service, title) VALUES (?, ?)",
+            """
+            INSERT INTO services (service, title) VALUES (?, ?)
+            ON CONFLICT (service) DO UPDATE SET title = excluded.title
+            """,
             [(service.name, service.title) for service in services],
         )
-        conn.commit()
+        if next_page_token:
+            cursor.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (CHECKPOINT_KEY, next_page_token),
+            )
+        else:
+            cursor.execute("DELETE FROM meta WHERE key = ?", (CHECKPOINT_KEY,))
+        commit(conn)
         console.print(f"[green]Saved {len(services)} Google Cloud Services in database[/green]")
-    except sqlite3.IntegrityError:
-        console.print("[yellow]Duplicate Google Cloud Services in database[/yellow]")
     except sqlite3.Error as error:
         console.print(f"[red]SQLite Error: {error}[/red]")
     except KeyboardInterrupt:
@@ -85,19 +136,46 @@ def store_services(services: list[Service]) -> None:
     conn.close()
 
 
-def search_services(service_name: str) -> None:
+def query_services(cursor: sqlite3.Cursor, service_name: str, limit: int) -> sqlite3.Cursor:
+    """Runs a service search and returns the cursor over its (service, title) rows."""
+    if len(service_name) >= FTS_MIN_TERM_LENGTH:
+        return cursor.execute(
+            """
+            SELECT service, title
+            FROM services_fts
+            WHERE services_fts MATCH ?
+            ORDER BY bm25(services_fts, 5.0, 1.0), service
+            LIMIT ?;
+            """,
+            (fts_phrase(service_name), search_limit(limit)),
+        )
+    return cursor.execute(
+        "SELECT service,title FROM services WHERE service LIKE ? OR title LIKE ? "
+        "ORDER BY service LIMIT ?;",
+        (f"%{service_name}%", f"%{service_name}%", search_limit(limit)),
+    )
+
+
+@profiled("query.search_services")
+def search_services(
+    service_name: str,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    output_format: OutputFormat = OutputFormat.table,
+) -> None:
     """Searches for a Google Cloud Services in the SQLite database table."""
     from contextlib import suppress
 
-    conn = sqlite3.connect(DB_FILE)
+    conn = connect()
 
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT service,title FROM services WHERE service LIKE ? OR title LIKE ? ORDER BY service;",
-            (f"%{service_name}%", f"%{service_name}%"),
-        )
-        rows = cursor.fetchall()
+        request = {"op": "search", "kind": "services", "term": service_name, "limit": limit}
+        rows = daemon_rows(request, ("service", "title"))
+        if rows is None:
+            rows = query_services(conn.cursor(), service_name, limit)
+        if output_format != OutputFormat.table:
+            write_rows(rows, ("service", "title"), output_format)
+            conn.close()
+            return
         table = Table()
         table.add_column("Service", justify="left", max_width=80, style="blue")
         table.add_column("Title", justify="left", max_width=80, style="green")
@@ -106,11 +184,200 @@ def search_services(service_name: str) -> None:
     except sqlite3.Error as error:
         console.print(f"[red]SQLite Error: {error}[/red]")
 
-    with suppress(BrokenPipeError):
+    with suppress(BrokenPipeError), span("render"):
         console.print(table)
 
     conn.close()
 
 
+def service_for_prefix(prefix: str, services: set[str]) -> str | None:
+    """Returns the service whose permissions start with `prefix.`, if it is in `services`."""
+    for candidate in (
+        SERVICE_ALIASES.get(prefix),
+        f"{prefix}.googleapis.com",
+        f"cloud{prefix}.googleapis.com",
+    ):
+        if candidate in services:
+            return candidate
+    return None
+
+
+def build_service_index(conn: sqlite3.Connection) -> tuple[int, int]:
+    """
+    Maps permission prefixes to services and stores the permissions and roles of each.
+
+    Only services in the `services` table are mapped, so `service --sync` fills the index.
+    Returns the number of mapped prefixes and of prefixes without a service.
+    """
+    cursor = conn.cursor()
+    services = {service for (service,) in cursor.execute("SELECT service FROM services")}
+    prefixes = [
+        prefix
+        for (prefix,) in cursor.execute(
+            "SELECT DISTINCT substr(permission, 1, instr(permission, '.') - 1) "
+            "FROM permission_names"
+        )
+    ]
+    mapping = [(prefix, service_for_prefix(prefix, services)) for prefix in prefixes]
+
+    for table in ("service_prefixes", "service_permissions", "service_roles"):
+        cursor.execute(f"DELETE FROM {table}")
+    cursor.executemany(
+        "INSERT INTO service_prefixes (prefix, service) VALUES (?, ?)",
+        [(prefix, service) for prefix, service in mapping if service],
+    )
+    cursor.execute(
+        """
+        INSERT INTO service_permissions (service, permission_id)
+        SELECT sp.service, pn.id
+        FROM permission_names pn
+        JOIN service_prefixes sp
+            ON sp.prefix = substr(pn.permission, 1, instr(pn.permission, '.') - 1)
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO service_roles (service, role_id, permissions)
+        SELECT sp.service, rp.role_id, COUNT(*)
+        FROM service_permissions sp
+        JOIN role_permissions rp ON rp.permission_id = sp.permission_id
+        JOIN roles r ON r.id = rp.role_id
+        WHERE r.deleted IS NULL
+        GROUP BY sp.service, rp.role_id
+        """
+    )
+    cursor.execute(
+        """
+        UPDATE services SET
+            permissions = (
+                SELECT COUNT(*) FROM service_permissions sp WHERE sp.service = services.service
+            ),
+            roles = (SELECT COUNT(*) FROM service_roles sr WHERE sr.service = services.service)
+        """
+    )
+    mapped = sum(1 for _, service in mapping if service)
+    return mapped, len(mapping) - mapped
+
+
+def rebuild_service_index() -> None:
+    """Rebuilds the service index used by `service --permissions` and `service --roles`."""
+
+    conn = connect()
+
+    try:
+        mapped, unmapped = build_service_index(conn)
+        commit(conn)
+        console.print(
+            f"[green]Rebuilt service index ({mapped} permission prefixes mapped, "
+            f"{unmapped} without a synced service)[/green]"
+        )
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+
+    conn.close()
+
+
+def _service_counts(cursor: sqlite3.Cursor, service_name: str) -> tuple[str, int, int] | None:
+    """Returns (service, permissions, roles), accepting `compute` for compute.googleapis.com."""
+    if "." not in service_name:
+        service_name = f"{service_name}.googleapis.com"
+    row = cursor.execute(
+        "SELECT service, permissions, roles FROM services WHERE service = ?", (service_name,)
+    ).fetchone()
+    if row is None:
+        console.print(f"[red]Service '{service_name}' not found in database[/red]")
+    elif not row[1]:
+        console.print(
+            f"[yellow]No permissions mapped to service: {service_name}; "
+            "run `service --sync` after `role --sync`[/yellow]"
+        )
+        return None
+    return row
+
+
+def _print_service_rows(
+    rows: Iterable[tuple], columns: tuple[str, ...], title: str, output_format: OutputFormat
+) -> None:
+    from contextlib import suppress
+
+    if output_format != OutputFormat.table:
+        write_rows(rows, columns, output_format)
+        return
+
+    table = Table(title=title)
+    for index, column in enumerate(columns):
+        table.add_column(
+            column.capitalize(),
+            justify="right" if column == "permissions" else "left",
+            max_width=100,
+            style=("green", "blue", "magenta")[index],
+        )
+    for row in rows:
+        table.add_row(*(str(value) for value in row))
+
+    with suppress(BrokenPipeError), span("render"):
+        console.print(table)
+
+
+@profiled("query.service_permissions")
+def service_permissions(
+    service_name: str, output_format: OutputFormat = OutputFormat.table
+) -> None:
+    """Lists the permissions of a service from the service index."""
+
+    conn = connect(read_only=True)
+
+    try:
+        cursor = conn.cursor()
+        counts = _service_counts(cursor, service_name)
+        if counts is not None:
+            service, permissions, roles = counts
+            cursor.execute(
+                """
+                SELECT pn.permission
+                FROM service_permissions sp
+                JOIN permission_names pn ON pn.id = sp.permission_id
+                WHERE sp.service = ?
+                ORDER BY pn.permission;
+                """,
+                (service,),
+            )
+            title = f"{service}: {permissions} permissions, granted by {roles} roles"
+            _print_service_rows(cursor, ("permission",), title, output_format)
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+
+    conn.close()
+
+
+@profiled("query.service_roles")
+def service_roles(service_name: str, output_format: OutputFormat = OutputFormat.table) -> None:
+    """Lists the roles granting permissions of a service, those granting most first."""
+
+    conn = connect(read_only=True)
+
+    try:
+        cursor = conn.cursor()
+        counts = _service_counts(cursor, service_name)
+        if counts is not None:
+            service, permissions, roles = counts
+            cursor.execute(
+                """
+                SELECT r.role, r.title, sr.permissions
+                FROM service_roles sr
+                JOIN roles r ON r.id = sr.role_id
+                WHERE sr.service = ?
+                ORDER BY sr.permissions DESC, r.role;
+                """,
+                (service,),
+            )
+            title = f"{service}: {roles} roles granting its {permissions} permissions"
+            _print_service_rows(cursor, ("role", "title", "permissions"), title, output_format)
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+
+    conn.close()
+
+
 if __name__ == "__main__":
     sync_services()
@@ -0,0 +1,220 @@
+import hashlib
+import heapq
+import sqlite3
+from array import array
+from contextlib import suppress
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+from .connection import connect
+from .cover import read_permissions
+from .output import OutputFormat, write_rows
+from .profiling import commit, profiled, span
+
+# 128 one-permutation MinHash bins split into 32 LSH bands of 4 rows: roles with a Jaccard
+# similarity of about 0.4 or more share at least one band bucket with high probability
+SIGNATURE_SIZE = 128
+LSH_BANDS = 32
+LSH_ROWS = SIGNATURE_SIZE // LSH_BANDS
+_BIN_BITS = SIGNATURE_SIZE.bit_length() - 1
+_VALUE_MASK = (1 << (64 - _BIN_BITS)) - 1
+
+
+def _hash(value: str | bytes) -> int:
+    data = value.encode() if isinstance(value, str) else value
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def signature(hashes: list[int]) -> array:
+    """
+    Computes a one-permutation MinHash signature from 64-bit permission hashes.
+
+    Each hash goes to one of SIGNATURE_SIZE bins by its top bits and every bin keeps its
+    smallest value, so a signature costs one hash per permission instead of one per bin.
+    Empty bins borrow the value of the next non-empty bin (densification), which keeps
+    signatures of small roles comparable bin by bin.
+    """
+    bins = [_VALUE_MASK + 1] * SIGNATURE_SIZE
+    for value in hashes:
+        index = value >> (64 - _BIN_BITS)
+        bins[index] = min(bins[index], value & _VALUE_MASK)
+    filled = [index for index, value in enumerate(bins) if value <= _VALUE_MASK]
+    if filled and len(filled) < SIGNATURE_SIZE:
+        for index in range(SIGNATURE_SIZE):
+            if bins[index] > _VALUE_MASK:
+                offset = 1
+                while bins[(index + offset) % SIGNATURE_SIZE] > _VALUE_MASK:
+                    offset += 1
+                bins[index] = bins[(index + offset) % SIGNATURE_SIZE] + offset * (_VALUE_MASK + 1)
+    return array("Q", bins)
+
+
+def _band_buckets(sig: array) -> list[int]:
+    """Hashes each band of a signature to a signed 64-bit SQLite integer."""
+    buckets = []
+    for band in range(LSH_BANDS):
+        value = _hash(sig[band * LSH_ROWS : (band + 1) * LSH_ROWS].tobytes())
+        buckets.append(value - (1 << 64) if value >= 1 << 63 else value)
+    return buckets
+
+
+def build_role_signatures(conn: sqlite3.Connection) -> int:
+    """Replaces the MinHash signatures and LSH buckets of all live roles."""
+    hashes = {
+        permission_id: _hash(permission)
+        for permission_id, permission in conn.execute("SELECT id, permission FROM permission_names")
+    }
+    granted: dict[int, list[int]] = {}
+    for role_id, permission_id in conn.execute(
+        """
+        SELECT rp.role_id, rp.permission_id
+        FROM role_permissions rp
+        JOIN roles r ON r.id = rp.role_id
+        WHERE r.deleted IS NULL
+        """
+    ):
+        granted.setdefault(role_id, []).append(hashes[permission_id])
+
+    conn.execute("DELETE FROM role_minhash")
+    conn.execute("DELETE FROM role_lsh")
+    for role_id, role_hashes in granted.items():
+        sig = signature(role_hashes)
+        conn.execute(
+            "INSERT INTO role_minhash (role_id, signature) VALUES (?, ?)",
+            (role_id, sig.tobytes()),
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO role_lsh (band, bucket, role_id) VALUES (?, ?, ?)",
+            [(band, bucket, role_id) for band, bucket in enumerate(_band_buckets(sig))],
+        )
+    return len(granted)
+
+
+def rebuild_role_signatures() -> None:
+    """Rebuilds the MinHash signatures used by `role --similar`."""
+
+    conn = connect()
+
+    try:
+        roles = build_role_signatures(conn)
+        commit(conn)
+        console.print(f"[green]Rebuilt similarity signatures for {roles} roles[/green]")
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+
+    conn.close()
+
+
+def _query_permissions(cursor: sqlite3.Cursor, query: str) -> tuple[int | None, set[str]] | None:
+    """Resolves `query` to (role id, permissions) for a role name, or (None, permissions) for a file."""
+    row = cursor.execute(
+        "SELECT id FROM roles WHERE role = ? AND deleted IS NULL", (query,)
+    ).fetchone()
+    if row is not None:
+        cursor.execute(
+            """
+            SELECT pn.permission
+            FROM role_permissions rp
+            JOIN permission_names pn ON pn.id = rp.permission_id
+            WHERE rp.role_id = ?
+            """,
+            (row[0],),
+        )
+        return row[0], {permission for (permission,) in cursor.fetchall()}
+    path = Path(query)
+    if query == "-" or path.is_file():
+        return None, set(read_permissions([], path))
+    console.print(f"[red]'{query}' is neither a role in the database nor a file[/red]")
+    return None
+
+
+def find_similar(
+    cursor: sqlite3.Cursor, role_id: int | None, permissions: set[str], top: int
+) -> list[tuple[int, float]]:
+    """
+    Returns up to `top` (role id, exact Jaccard similarity) pairs, most similar first.
+
+    Candidates come from the LSH buckets the query signature falls into. When there are
+    fewer than `top` of them, the closest remaining roles by estimated similarity are added,
+    so weakly similar roles are still ranked. Only candidates get exact scores.
+    """
+    sig = signature([_hash(permission) for permission in permissions])
+    candidates: set[int] = set()
+    for band, bucket in enumerate(_band_buckets(sig)):
+        cursor.execute("SELECT role_id FROM role_lsh WHERE band = ? AND bucket = ?", (band, bucket))
+        candidates.update(row[0] for row in cursor.fetchall())
+    candidates.discard(role_id)
+
+    if len(candidates) < top:
+        estimates = []
+        for other_id, blob in cursor.execute("SELECT role_id, signature FROM role_minhash"):
+            if other_id == role_id or other_id in candidates:
+                continue
+            other = array("Q", blob)
+            estimates.append((sum(a == b for a, b in zip(sig, other, strict=True)), other_id))
+        candidates.update(other_id for _, other_id in heapq.nlargest(top * 4, estimates))
+
+    scores = []
+    for other_id in candidates:
+        cursor.execute(
+            """
+            SELECT pn.permission
+            FROM role_permissions rp
+            JOIN permission_names pn ON pn.id = rp.permission_id
+            WHERE rp.role_id = ?
+            """,
+            (other_id,),
+        )
+        other = {permission for (permission,) in cursor.fetchall()}
+        common = len(permissions & other)
+        union = len(permissions) + len(other) - common
+        if common:
+            scores.append((common / union, other_id))
+    return [(other_id, score) for score, other_id in heapq.nlargest(top, scores)]
+
+
+@profiled("query.similar_roles")
+def similar_roles(
+    query: str, top: int = 10, output_format: OutputFormat = OutputFormat.table
+) -> None:
+    """Prints the roles most similar to a role or to a file of permissions by Jaccard index."""
+
+    conn = connect()
+
+    try:
+        cursor = conn.cursor()
+        resolved = _query_permissions(cursor, query)
+        if resolved is None or not resolved[1]:
+            if resolved is not None:
+                console.print("[red]Error: no permissions given[/red]")
+            conn.close()
+            return
+        role_id, permissions = resolved
+        rows = []
+        for other_id, score in find_similar(cursor, role_id, permissions, top):
+            role, title = cursor.execute(
+                "SELECT role, title FROM roles WHERE id = ?", (other_id,)
+            ).fetchone()
+            rows.append((role, title, round(score, 4)))
+
+        if output_format != OutputFormat.table:
+            write_rows(rows, ("role", "title", "jaccard"), output_format)
+            conn.close()
+            return
+
+        table = Table(title=f"Roles similar to {query}")
+        table.add_column("Role", justify="left", max_width=80, style="blue")
+        table.add_column("Title", justify="left", max_width=80, style="green")
+        table.add_column("Jaccard", justify="right", style="yellow")
+        for role, title, score in rows:
+            table.add_row(role, str(title), f"{score:.3f}")
+        with suppress(BrokenPipeError), span("render"):
+            console.print(table)
+    except sqlite3.Error as error:
+        console.print(f"[red]SQLite Error: {error}[/red]")
+
+    conn.close()
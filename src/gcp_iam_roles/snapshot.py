@@ -0,0 +1,233 @@
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import Iterator
+
+from . import DB_FILE
+from .connection import connect
+from .trie import NODE_FIELDS, PermissionTrie, build_trie
+
+# Read-only index written at sync time so queries can mmap it instead of querying SQLite.
+# SQLite stays the source of truth; a missing or unreadable snapshot falls back to SQL.
+SNAPSHOT_FILE = DB_FILE.parent.joinpath("gcp-iam-roles.idx")
+SNAPSHOT_MAGIC = b"GIRS"
+SNAPSHOT_VERSION = 2
+# Written in native byte order; the marker rejects snapshots copied between architectures
+BYTE_ORDER_MARK = 0x01020304
+
+# magic, version, byte order mark, role, permission and trie node counts and the start of
+# each section: role names (offsets, utf-8 blob), permission names (offsets, utf-8 blob),
+# role -> permissions (offsets, permission indexes), permission -> roles (offsets, role
+# indexes) and the permission segment trie (nodes, trie order)
+HEADER = struct.Struct("<4s5I10I")
+
+
+def _string_table(names: list[bytes]) -> tuple[array, bytes]:
+    offsets = array("I", [0])
+    for name in names:
+        offsets.append(offsets[-1] + len(name))
+    return offsets, b"".join(names)
+
+
+def _postings(lists: list[list[int]]) -> tuple[array, array]:
+    offsets = array("I", [0])
+    values = array("I")
+    for items in lists:
+        values.extend(sorted(items))
+        offsets.append(len(values))
+    return offsets, values
+
+
+def write_snapshot() -> None:
+    """
+    Writes the role and permission snapshot next to the database.
+
+    Names are stored sorted by their UTF-8 bytes, so an index into a string table orders
+    the same way as the name and lookups are a binary search. Each posting list holds
+    indexes into the other table in ascending order.
+    """
+    conn = connect()
+
+    try:
+        roles = sorted(
+            (role.encode(), role_id)
+            for role_id, role in conn.execute("SELECT id, role FROM roles WHERE deleted IS NULL")
+        )
+        permissions = sorted(
+            (permission.encode(), permission_id)
+            for permission_id, permission in conn.execute(
+                "SELECT id, permission FROM permission_names"
+            )
+        )
+        role_index = {role_id: index for index, (_, role_id) in enumerate(roles)}
+        permission_index = {
+            permission_id: index for index, (_, permission_id) in enumerate(permissions)
+        }
+        role_permissions: list[list[int]] = [[] for _ in roles]
+        permission_roles: list[list[int]] = [[] for _ in permissions]
+        for role_id, permission_id in conn.execute(
+            "SELECT role_id, permission_id FROM role_permissions"
+        ):
+            if role_id in role_index and permission_id in permission_index:
+                role_permissions[role_index[role_id]].append(permission_index[permission_id])
+                permission_roles[permission_index[permission_id]].append(role_index[role_id])
+    finally:
+        conn.close()
+
+    trie_nodes, trie_order = build_trie([name for name, _ in permissions])
+    sections: list[bytes] = []
+    for offsets, values in (
+        _string_table([name for name, _ in roles]),
+        _string_table([name for name, _ in permissions]),
+        _postings(role_permissions),
+        _postings(permission_roles),
+        (trie_nodes, trie_order),
+    ):
+        sections.append(offsets.tobytes())
+        data = values if isinstance(values, bytes) else values.tobytes()
+        # Keep every section 4-byte aligned so it can be cast to an unsigned int array
+        sections.append(data + b"\0" * (-len(data) % 4))
+
+    starts = []
+    position = HEADER.size
+    for section in sections:
+        starts.append(position)
+        position += len(section)
+    header = HEADER.pack(
+        SNAPSHOT_MAGIC,
+        SNAPSHOT_VERSION,
+        BYTE_ORDER_MARK,
+        len(roles),
+        len(permissions),
+        len(trie_nodes) // NODE_FIELDS,
+        *starts,
+    )
+
+    tmp_path = SNAPSHOT_FILE.with_suffix(".tmp")
+    with tmp_path.open("wb") as file:
+        file.write(header)
+        for section in sections:
+            file.write(section)
+    os.replace(tmp_path, SNAPSHOT_FILE)
+
+
+def remove_snapshot() -> None:
+    """Deletes the snapshot so queries fall back to SQLite."""
+    SNAPSHOT_FILE.unlink(missing_ok=True)
+
+
+class Snapshot:
+    """
+    Zero-copy view of a snapshot file.
+
+    The file is mapped read-only and every table is a memoryview cast over the mapping,
+    so opening it costs one header unpack regardless of its size. Strings are only
+    decoded when they are returned.
+    """
+
+    def __init__(self, buffer: mmap.mmap) -> None:
+        magic, version, mark, role_count, permission_count, node_count, *starts = (
+            HEADER.unpack_from(buffer)
+        )
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or mark != BYTE_ORDER_MARK:
+            raise ValueError("unsupported snapshot")
+        self._buffer = buffer
+        view = memoryview(buffer)
+
+        def ints(start: int, count: int) -> memoryview:
+            return view[start : start + 4 * count].cast("I")
+
+        self._role_offsets = ints(starts[0], role_count + 1)
+        self._role_names = view[starts[1] : starts[1] + self._role_offsets[-1]]
+        self._permission_offsets = ints(starts[2], permission_count + 1)
+        self._permission_names = view[starts[3] : starts[3] + self._permission_offsets[-1]]
+        self._role_permission_offsets = ints(starts[4], role_count + 1)
+        self._role_permissions = ints(starts[5], self._role_permission_offsets[-1])
+        self._permission_role_offsets = ints(starts[6], permission_count + 1)
+        self._permission_roles = ints(starts[7], self._permission_role_offsets[-1])
+        self._trie_nodes = ints(starts[8], node_count * NODE_FIELDS)
+        self._trie_order = ints(starts[9], permission_count)
+
+    @staticmethod
+    def _name(offsets: memoryview, names: memoryview, index: int) -> bytes:
+        return bytes(names[offsets[index] : offsets[index + 1]])
+
+    def _find(self, offsets: memoryview, names: memoryview, name: str) -> int | None:
+        key = name.encode()
+        low, high = 0, len(offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(offsets, names, middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(offsets) - 1 and self._name(offsets, names, low) == key:
+            return low
+        return None
+
+    def role(self, index: int) -> str:
+        return self._name(self._role_offsets, self._role_names, index).decode()
+
+    def permission(self, index: int) -> str:
+        return self._name(self._permission_offsets, self._permission_names, index).decode()
+
+    def permission_indexes(self, role: str) -> memoryview | None:
+        """Returns the sorted permission indexes of a role, or None for an unknown role."""
+        index = self._find(self._role_offsets, self._role_names, role)
+        if index is None:
+            return None
+        offsets = self._role_permission_offsets
+        return self._role_permissions[offsets[index] : offsets[index + 1]]
+
+    def role_permissions(self, role: str) -> Iterator[str] | None:
+        """Returns the permissions of a role in name order, or None for an unknown role."""
+        indexes = self.permission_indexes(role)
+        if indexes is None:
+            return None
+        return (self.permission(index) for index in indexes)
+
+    def permission_roles(self, permission: str) -> Iterator[str] | None:
+        """Returns the roles granting a permission in name order, or None if none does."""
+        index = self._find(self._permission_offsets, self._permission_names, permission)
+        if index is None:
+            return None
+        offsets = self._permission_role_offsets
+        return (
+            self.role(role_index)
+            for role_index in self._permission_roles[offsets[index] : offsets[index + 1]]
+        )
+
+    def trie(self) -> PermissionTrie:
+        """Returns the permission segment trie over the mapped arrays."""
+        return PermissionTrie(self._trie_nodes, self._trie_order, self._permission_names)
+
+    def diff(self, role1: str, role2: str) -> Iterator[tuple[str, str]]:
+        """Merges two roles' sorted permission indexes into (permission, status) rows."""
+        # A role does not differ from itself
+        if role1 == role2:
+            return
+        left = self.permission_indexes(role1) or []
+        right = self.permission_indexes(role2) or []
+        i = j = 0
+        while i < len(left) or j < len(right):
+            if j == len(right) or (i < len(left) and left[i] < right[j]):
+                yield self.permission(left[i]), "left"
+                i += 1
+            elif i == len(left) or right[j] < left[i]:
+                yield self.permission(right[j]), "right"
+                j += 1
+            else:
+                yield self.permission(left[i]), "common"
+                i += 1
+                j += 1
+
+
+def load_snapshot() -> Snapshot | None:
+    """Maps the snapshot written by the last sync, or returns None when there is none."""
+    try:
+        with SNAPSHOT_FILE.open("rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return Snapshot(buffer)
+    except (OSError, ValueError, struct.error):
+        return None
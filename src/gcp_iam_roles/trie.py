@@ -0,0 +1,151 @@
+from array import array
+from collections import deque
+from collections.abc import Sequence
+from fnmatch import fnmatchcase
+
+# Every node is NODE_FIELDS consecutive uint32 values in one flat array:
+# start and end of its segment inside the permission name blob, the range of its children
+# in the node array, the range of its permissions in the trie order array and its own
+# permission index + 1 (0 when no permission ends at this node). Node 0 is the root.
+NODE_FIELDS = 7
+NAME_START, NAME_END, CHILD_START, CHILD_END, LOW, HIGH, TERMINAL = range(NODE_FIELDS)
+GLOB_MAGIC = "*?["
+
+
+def build_trie(names: Sequence[bytes]) -> tuple[array, array]:
+    """
+    Builds a segment trie over sorted permission names.
+
+    Returns the flat node array and the trie order, the permission indexes sorted by
+    their dot-separated segments. Every subtree covers a contiguous range of the trie
+    order, so its size is `HIGH - LOW` and it can be listed without walking it. Children
+    are added breadth-first, so the children of a node are contiguous and sorted.
+    """
+    name_offsets = [0]
+    for name in names:
+        name_offsets.append(name_offsets[-1] + len(name))
+    order = sorted(range(len(names)), key=lambda index: names[index].split(b"."))
+    segments = [names[index].split(b".") for index in order]
+
+    nodes = array("I", [0, 0, 0, 0, 0, len(order), 0])
+    queue = deque([(0, 0, len(order), 0, 0)])
+    while queue:
+        node, low, high, depth, prefix_length = queue.popleft()
+        base = node * NODE_FIELDS
+        position = low
+        # Permissions ending here sort before the ones continuing below this node
+        while position < high and len(segments[position]) == depth:
+            nodes[base + TERMINAL] = order[position] + 1
+            position += 1
+        nodes[base + CHILD_START] = len(nodes) // NODE_FIELDS
+        while position < high:
+            segment = segments[position][depth]
+            end = position
+            while end < high and segments[end][depth] == segment:
+                end += 1
+            start = name_offsets[order[position]] + prefix_length
+            child = len(nodes) // NODE_FIELDS
+            nodes.extend((start, start + len(segment), 0, 0, position, end, 0))
+            queue.append((child, position, end, depth + 1, prefix_length + len(segment) + 1))
+            position = end
+        nodes[base + CHILD_END] = len(nodes) // NODE_FIELDS
+    return nodes, array("I", order)
+
+
+class PermissionTrie:
+    """Read-only segment trie over the arrays written by `build_trie`, mapped or in memory."""
+
+    def __init__(self, nodes: Sequence[int], order: Sequence[int], names: bytes | memoryview):
+        self._nodes = nodes
+        self._order = order
+        self._names = names
+
+    def _field(self, node: int, field: int) -> int:
+        return self._nodes[node * NODE_FIELDS + field]
+
+    def segment(self, node: int) -> str:
+        start, end = self._field(node, NAME_START), self._field(node, NAME_END)
+        return bytes(self._names[start:end]).decode()
+
+    def children(self, node: int) -> range:
+        return range(self._field(node, CHILD_START), self._field(node, CHILD_END))
+
+    def count(self, node: int) -> int:
+        """Number of permissions at or below `node`."""
+        return self._field(node, HIGH) - self._field(node, LOW)
+
+    def _child(self, node: int, segment: str) -> int | None:
+        key = segment.encode()
+        children = self.children(node)
+        low, high = children.start, children.stop
+        while low < high:
+            middle = (low + high) // 2
+            start = self._field(middle, NAME_START)
+            if bytes(self._names[start : self._field(middle, NAME_END)]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < children.stop and self.segment(low) == segment:
+            return low
+        return None
+
+    def find(self, path: str) -> int | None:
+        """Returns the node for a dot-separated prefix such as `storage.objects`."""
+        node = 0
+        for segment in path.split(".") if path else ():
+            child = self._child(node, segment)
+            if child is None:
+                return None
+            node = child
+        return node
+
+    def _matching_children(self, node: int, segment: str) -> list[int]:
+        """Returns the children of `node` matching one glob segment other than `**`."""
+        if not any(magic in segment for magic in GLOB_MAGIC):
+            child = self._child(node, segment)
+            return [] if child is None else [child]
+        return [child for child in self.children(node) if fnmatchcase(self.segment(child), segment)]
+
+    def glob(self, pattern: str) -> list[int]:
+        """
+        Returns the sorted indexes of permissions matching a segment glob.
+
+        `*`, `?` and `[...]` match within one segment, so `compute.*.delete` matches only
+        three-segment permissions; `**` matches any number of segments. Literal segments
+        are a binary search among the children, so only the matching branches are walked.
+        """
+        parts = pattern.split(".")
+        # Whole subtrees match once only `**` is left, so their permissions are one slice
+        open_ended = [all(rest == "**" for rest in parts[part:]) for part in range(len(parts))]
+        found: set[int] = set()
+
+        def walk(node: int, part: int) -> None:
+            if part < len(parts) and open_ended[part]:
+                found.update(self._order[self._field(node, LOW) : self._field(node, HIGH)])
+                return
+            if part == len(parts):
+                terminal = self._field(node, TERMINAL)
+                if terminal:
+                    found.add(terminal - 1)
+                return
+            segment = parts[part]
+            if segment == "**":
+                walk(node, part + 1)
+                for child in self.children(node):
+                    walk(child, part)
+            else:
+                for child in self._matching_children(node, segment):
+                    walk(child, part + 1)
+
+        walk(0, 0)
+        return sorted(found)
+
+    def tree(self, path: str) -> list[tuple[str, int]] | None:
+        """Returns (path, permission count) for a prefix node followed by each of its children."""
+        node = self.find(path)
+        if node is None:
+            return None
+        prefix = f"{path}." if path else ""
+        return [(path, self.count(node))] + [
+            (prefix + self.segment(child), self.count(child)) for child in self.children(node)
+        ]
@@ -0,0 +1,104 @@
+# Bash completion for gcp-iam-roles CLI tool
+#
+# Install: source this file from ~/.bashrc or copy it to
+# ~/.local/share/bash-completion/completions/gcp-iam-roles
+
+# Role and permission names come from the sorted roles.txt and permissions.txt files written by
+# `gcp-iam-roles role --sync`, binary searched with `look` when available; the CLI is the fallback.
+__gcp_iam_roles_names() {
+    local kind=$1 prefix=$2
+    local dir=$HOME/.local/share/gcp-iam-roles
+    [[ -n $GCP_IAM_ROLES_DB ]] && dir=${GCP_IAM_ROLES_DB%/*}
+    local cache="$dir/$kind.txt"
+    if [[ -r $cache ]]; then
+        if [[ -n $prefix ]] && command -v look >/dev/null; then
+            look -- "$prefix" "$cache"
+        else
+            awk -v prefix="$prefix" 'index($0, prefix) == 1' "$cache"
+        fi
+    else
+        gcp-iam-roles "_list-$kind" "$prefix" 2>/dev/null
+    fi
+}
+
+_gcp_iam_roles() {
+    local cur prev subcommand i
+    cur=${COMP_WORDS[COMP_CWORD]}
+    prev=${COMP_WORDS[COMP_CWORD - 1]}
+    # The subcommand is the first word that is neither a global option nor its value
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        case ${COMP_WORDS[i - 1]} in
+        --profile-output | --profile-hot) continue ;;
+        esac
+        if [[ ${COMP_WORDS[i]} != -* ]]; then
+            subcommand=${COMP_WORDS[i]}
+            break
+        fi
+    done
+
+    case $prev in
+    --diff | --list | --supersets | --subsets)
+        mapfile -t COMPREPLY < <(__gcp_iam_roles_names roles "$cur")
+        return
+        ;;
+    --cover | --roles | --glob | --tree | --who-can)
+        mapfile -t COMPREPLY < <(__gcp_iam_roles_names permissions "$cur")
+        return
+        ;;
+    --similar)
+        mapfile -t COMPREPLY < <(
+            __gcp_iam_roles_names roles "$cur"
+            compgen -f -- "$cur"
+        )
+        return
+        ;;
+    --cover-file | --profile-output)
+        mapfile -t COMPREPLY < <(compgen -f -- "$cur")
+        return
+        ;;
+    --import)
+        mapfile -t COMPREPLY < <(compgen -d -- "$cur")
+        return
+        ;;
+    --search)
+        if [[ $subcommand == permission ]]; then
+            mapfile -t COMPREPLY < <(__gcp_iam_roles_names permissions "$cur")
+        fi
+        return
+        ;;
+    --profile-hot)
+        mapfile -t COMPREPLY < <(compgen -W "sync.roles sync.roles.single_pass sync.roles.incremental sync.permissions sync.services index" -- "$cur")
+        return
+        ;;
+    --mode)
+        mapfile -t COMPREPLY < <(compgen -W "per-role single-pass incremental" -- "$cur")
+        return
+        ;;
+    --format)
+        mapfile -t COMPREPLY < <(compgen -W "table tsv jsonl csv" -- "$cur")
+        return
+        ;;
+    --limit | --concurrency | --rate | --page-size | --max-roles | --top)
+        return
+        ;;
+    esac
+
+    local options
+    case $subcommand in
+    role) options="--search --fuzzy --limit --format --sync --import --mode --resume --concurrency --rate --diff --cover --cover-file --max-roles --top --supersets --subsets --similar --help" ;;
+    permission) options="--search --fuzzy --limit --format --list --roles --glob --tree --help" ;;
+    service) options="--search --limit --format --permissions --roles --sync --restart --page-size --help" ;;
+    analyze)
+        if [[ $cur != -* ]]; then
+            mapfile -t COMPREPLY < <(compgen -f -- "$cur")
+            return
+        fi
+        options="--who-can --help"
+        ;;
+    batch | serve | status | clear-db) options="--help" ;;
+    *) options="role permission service batch analyze serve status clear-db --timings --profile --profile-output --profile-hot --help" ;;
+    esac
+    mapfile -t COMPREPLY < <(compgen -W "$options" -- "$cur")
+}
+
+complete -F _gcp_iam_roles gcp-iam-roles
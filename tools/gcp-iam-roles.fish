@@ -1,8 +1,41 @@
 # Fish completion for gcp-iam-roles CLI tool
 
-# Dynamic completions for role names (for --diff and --list options)
+# Dynamic completions for role and permission names.
+# A running `gcp-iam-roles serve` answers from memory over its socket (needs `socat`).
+# Otherwise `gcp-iam-roles role --sync` writes sorted roles.txt and permissions.txt next to
+# the database; read them directly (binary search with `look` when available) and fall back
+# to the CLI.
+function __gcp_iam_roles_complete --argument-names kind
+    set -l dir $HOME/.local/share/gcp-iam-roles
+    set -q GCP_IAM_ROLES_DB; and set dir (string replace -r '/[^/]*$' '' -- $GCP_IAM_ROLES_DB)
+    set -l cache $dir/$kind.txt
+    set -l socket $dir/gcp-iam-roles.sock
+    set -l prefix (commandline -ct)
+    if test -S $socket; and command -q socat
+        # The reply ends with an empty line, so a stale socket is told apart from no matches
+        set -l names (printf 'complete %s %s\n' $kind "$prefix" | socat -t 2 - UNIX-CONNECT:$socket 2>/dev/null)
+        if set -q names[1]; and not string match -q 'error: *' -- $names[1]
+            string match -v -- '' $names
+            return
+        end
+    end
+    if test -r $cache
+        if test -n "$prefix"; and command -q look
+            look -- $prefix $cache
+        else
+            string match -- "$prefix*" <$cache
+        end
+    else
+        gcp-iam-roles _list-$kind $prefix 2>/dev/null
+    end
+end
+
 function __gcp_iam_roles_get_roles
-    gcp-iam-roles _list-roles 2>/dev/null
+    __gcp_iam_roles_complete roles
+end
+
+function __gcp_iam_roles_get_permissions
+    __gcp_iam_roles_complete permissions
 end
 
 # Main command completion
@@ -10,30 +43,71 @@ complete -c gcp-iam-roles -f
 
 # Global options
 complete -c gcp-iam-roles -l help -d "Show help message"
+complete -c gcp-iam-roles -l timings -d "Show import and run time of the command"
+complete -c gcp-iam-roles -l profile -d "Record timing spans, counters and API latencies"
+complete -c gcp-iam-roles -l profile-output -r -F -d "JSON trace file written by --profile"
+complete -c gcp-iam-roles -l profile-hot -x -a "sync.roles sync.roles.single_pass sync.roles.incremental sync.permissions sync.services index" -d "Capture cProfile stats for a span"
 
 # Subcommands
-complete -c gcp-iam-roles -n "not __fish_seen_subcommand_from role permission service status clear-db" -a role -d "Manage GCP IAM roles"
-complete -c gcp-iam-roles -n "not __fish_seen_subcommand_from role permission service status clear-db" -a permission -d "Manage GCP IAM permissions"
-complete -c gcp-iam-roles -n "not __fish_seen_subcommand_from role permission service status clear-db" -a service -d "Manage GCP services"
-complete -c gcp-iam-roles -n "not __fish_seen_subcommand_from role permission service status clear-db" -a status -d "Show roles and permissions count"
-complete -c gcp-iam-roles -n "not __fish_seen_subcommand_from role permission service status clear-db" -a clear-db -d "Drop database tables"
+complete -c gcp-iam-roles -n "not __fish_seen_subcommand_from role permission service batch analyze serve status clear-db" -a role -d "Manage GCP IAM roles"
+complete -c gcp-iam-roles -n "not __fish_seen_subcommand_from role permission service batch analyze serve status clear-db" -a permission -d "Manage GCP IAM permissions"
+complete -c gcp-iam-roles -n "not __fish_seen_subcommand_from role permission service batch analyze serve status clear-db" -a service -d "Manage GCP services"
+complete -c gcp-iam-roles -n "not __fish_seen_subcommand_from role permission service batch analyze serve status clear-db" -a batch -d "Answer many lookups from stdin in one process"
+complete -c gcp-iam-roles -n "not __fish_seen_subcommand_from role permission service batch analyze serve status clear-db" -a analyze -d "Stream exported IAM policies and report effective permissions"
+complete -c gcp-iam-roles -n "not __fish_seen_subcommand_from role permission service batch analyze serve status clear-db" -a serve -d "Answer queries from a resident process over a Unix socket"
+complete -c gcp-iam-roles -n "not __fish_seen_subcommand_from role permission service batch analyze serve status clear-db" -a status -d "Show roles and permissions count"
+complete -c gcp-iam-roles -n "not __fish_seen_subcommand_from role permission service batch analyze serve status clear-db" -a clear-db -d "Drop database tables"
 
 # Role subcommand options
 complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l search -d "Search for roles by name pattern" -r
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l fuzzy -d "Rank --search results by similarity, tolerating typos"
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l limit -d "Maximum number of search results (0 for all)" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l format -a "table tsv jsonl csv" -d "Output format" -x
 complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l sync -d "Sync predefined IAM roles and permissions from Google Cloud APIs"
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l import -x -a "(__fish_complete_directories)" -d "Import custom roles from YAML or JSON files below a directory"
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l mode -a "per-role single-pass incremental" -d "Sync strategy" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l resume -d "Continue an interrupted or partly failed per-role sync"
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l concurrency -d "Number of concurrent API requests during sync" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l rate -d "Maximum API requests per second during sync" -x
 complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l help -d "Show help message"
 complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l diff -a "(__gcp_iam_roles_get_roles)" -d "Compare permissions between two roles" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l cover -a "(__gcp_iam_roles_get_permissions)" -d "Find the fewest-excess role combinations granting these permissions" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l cover-file -d "Read permissions for --cover from a file ('-' for stdin)" -r -F
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l max-roles -d "Maximum roles per --cover combination" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l top -d "Number of results to return" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l supersets -a "(__gcp_iam_roles_get_roles)" -d "List roles that grant every permission of these roles" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l subsets -a "(__gcp_iam_roles_get_roles)" -d "List roles whose permissions are all granted by this role" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from role" -l similar -a "(__gcp_iam_roles_get_roles)" -d "List the roles most similar to a role or a permission file" -r
 
 # Permission subcommand options
-complete -c gcp-iam-roles -n "__fish_seen_subcommand_from permission" -l search -d "Search for permissions by name pattern" -r
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from permission" -l search -a "(__gcp_iam_roles_get_permissions)" -d "Search for permissions by name pattern" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from permission" -l fuzzy -d "Rank --search results by similarity, tolerating typos"
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from permission" -l limit -d "Maximum number of search results (0 for all)" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from permission" -l format -a "table tsv jsonl csv" -d "Output format" -x
 complete -c gcp-iam-roles -n "__fish_seen_subcommand_from permission" -l help -d "Show help message"
 complete -c gcp-iam-roles -n "__fish_seen_subcommand_from permission" -l list -a "(__gcp_iam_roles_get_roles)" -d "List all permissions for a given role" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from permission" -l roles -a "(__gcp_iam_roles_get_permissions)" -d "List all roles that grant a given permission" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from permission" -l glob -a "(__gcp_iam_roles_get_permissions)" -d "List permissions matching a segment glob" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from permission" -l tree -a "(__gcp_iam_roles_get_permissions)" -d "Show permission counts below a service or resource" -x
 
 # Service subcommand options
 complete -c gcp-iam-roles -n "__fish_seen_subcommand_from service" -l search -d "Search for services by name pattern" -r
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from service" -l limit -d "Maximum number of search results (0 for all)" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from service" -l format -a "table tsv jsonl csv" -d "Output format" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from service" -l permissions -d "List the permissions of a service" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from service" -l roles -d "List the roles granting permissions of a service" -x
 complete -c gcp-iam-roles -n "__fish_seen_subcommand_from service" -l sync -d "Sync Google Cloud services"
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from service" -l restart -d "Ignore the checkpoint of an interrupted sync and start over"
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from service" -l page-size -d "Services requested per page" -x
 complete -c gcp-iam-roles -n "__fish_seen_subcommand_from service" -l help -d "Show help message"
 
-# Status and clear-db subcommand options
+# Analyze subcommand options; the arguments are policy export files
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from analyze" -F
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from analyze" -l who-can -a "(__gcp_iam_roles_get_permissions)" -d "List the principals granted a permission" -x
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from analyze" -l help -d "Show help message"
+
+# Batch, status and clear-db subcommand options
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from batch" -l help -d "Show help message"
+complete -c gcp-iam-roles -n "__fish_seen_subcommand_from serve" -l help -d "Show help message"
 complete -c gcp-iam-roles -n "__fish_seen_subcommand_from status" -l help -d "Show help message"
 complete -c gcp-iam-roles -n "__fish_seen_subcommand_from clear-db" -l help -d "Show help message"